@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+# Historian benchmark.  Pushes scans of many points through mb_historian.HistorianSink as fast as they are accepted,
+# then at a fixed rate to show how busy the writer thread is at that load, and times a one hour read of one point.
+#
+#   python benchmarks/bench_historian.py [-p NUM_POINTS] [-n NUM_SCANS] [-r RATE] [-d DURATION]
+
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mbpy import mb_historian  # noqa: E402
+
+
+def make_scan(names, scan_iter):
+    # mix of counters and slow floats, like a meter's registers
+    scan = {}
+    for name_iter, name in enumerate(names):
+        if name_iter % 2:
+            scan[name] = scan_iter * (name_iter + 1)
+        else:
+            scan[name] = round(230 + math.sin(scan_iter / 60 + name_iter), 2)
+    return scan
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the sustained insert rate of the SQLite historian.')
+    parser.add_argument('-p', '--points', type=int, default=1000, help='Points in every scan. Default is 1000.')
+    parser.add_argument('-n', '--scans', type=int, default=3600,
+                        help='Scans, one second apart, of the burst test. Default is 3600.')
+    parser.add_argument('-r', '--rate', type=int, default=5000,
+                        help='Points per second of the paced test. Default is 5000.')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='Seconds of the paced test. Default is 10.')
+    args = parser.parse_args()
+
+    names = ['meter_%d.reg_%d' % (point_iter // 50, point_iter % 50) for point_iter in range(args.points)]
+    scans = [make_scan(names, scan_iter) for scan_iter in range(min(args.scans, 600))]  # reused, values do not matter
+    start_ns = 1800000000 * 10 ** 9
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # burst: every scan queued at once, timed until the last one is committed
+        db_file = os.path.join(tmp_dir, 'burst.db')
+        historian = mb_historian.HistorianSink(db_file)
+        start_time = time.perf_counter()
+        for scan_iter in range(args.scans):
+            historian.write(start_ns + scan_iter * 10 ** 9, scans[scan_iter % len(scans)])
+        historian.flush()
+        burst_time = time.perf_counter() - start_time
+        historian.close()
+        stats = historian.get_stats()
+        db_size = sum(os.path.getsize(db_file + ext) for ext in ('', '-wal') if os.path.exists(db_file + ext))
+        print('burst:   %10d rows in %6.2f s, %9.0f rows per second, %d batches, %.1f bytes per row' % (
+            stats['rows'], burst_time, stats['rows'] / burst_time, stats['batches'], db_size / stats['rows']))
+
+        read_start = time.perf_counter()
+        num_read = sum(1 for row in mb_historian.read_range(db_file, [names[1]], start_ns, start_ns + 3600 * 10 ** 9))
+        print('read:    %10d rows of one point over an hour in %.2f ms' % (num_read,
+                                                                           (time.perf_counter() - read_start) * 1000))
+
+        # paced: one scan of rate points every second, the writer's busy share is the headroom left
+        db_file = os.path.join(tmp_dir, 'paced.db')
+        historian = mb_historian.HistorianSink(db_file)
+        paced_names = ['point_%d' % point_iter for point_iter in range(args.rate)]
+        paced_scan = make_scan(paced_names, 0)
+        start_time = time.monotonic()
+        scan_iter = 0
+        max_pending = 0
+        while time.monotonic() - start_time < args.duration:
+            historian.write(time.time_ns(), paced_scan)
+            max_pending = max(max_pending, historian.get_stats()['pending'])
+            scan_iter += 1
+            time.sleep(max(0, start_time + scan_iter - time.monotonic()))
+        historian.close()
+        paced_time = time.monotonic() - start_time
+        stats = historian.get_stats()
+        print('paced:   %10d rows in %6.2f s at %d points per second, writer busy %.1f%%, at most %d scans waiting' % (
+            stats['rows'], paced_time, args.rate, stats['write_time'] / paced_time * 100, max_pending))
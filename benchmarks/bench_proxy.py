@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+# Proxy benchmark.  Starts a simulated meter that takes a few connections and answers one request at a time after a
+# short delay, then has many clients poll it directly, through mb_proxy, and through mb_proxy with a cache, and
+# counts good replies per second.
+#
+#   python benchmarks/bench_proxy.py [-c CLIENTS] [-d DELAY] [-m MAX_CONNECTIONS] [-s SECONDS] [-ttl CACHE]
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mbpy import mb_client  # noqa: E402
+from mbpy import mb_proxy  # noqa: E402
+
+
+class MeterSimulator:
+    """Modbus TCP meter that answers function 3 with register number as value, like many real ones it serves only a
+    few connections and one request at a time."""
+    def __init__(self, reply_delay, max_connections):
+        self.reply_delay = reply_delay / 1000  # convert from ms to s
+        self.max_connections = max_connections
+        self.num_requests = 0
+        self._busy_lock = threading.Lock()
+        self._num_connections = 0
+        self._listen_conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listen_conn.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listen_conn.bind(('127.0.0.1', 0))
+        self._listen_conn.listen(16)
+        self.port = self._listen_conn.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            tcp_conn, address = self._listen_conn.accept()
+            if self._num_connections >= self.max_connections:
+                tcp_conn.close()  # what meters do once their connection slots are taken
+                continue
+            self._num_connections += 1
+            threading.Thread(target=self._serve, args=(tcp_conn,), daemon=True).start()
+
+    def _serve(self, tcp_conn):
+        tcp_conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        recv_buf = bytearray()
+        try:
+            while True:
+                recv_chunk = tcp_conn.recv(4096)
+                if not recv_chunk:
+                    break
+                recv_buf.extend(recv_chunk)
+                while len(recv_buf) >= 12:
+                    frame_len = 6 + int.from_bytes(recv_buf[4:6], byteorder='big')
+                    if len(recv_buf) < frame_len:
+                        break
+                    frame = bytes(recv_buf[:frame_len])
+                    del recv_buf[:frame_len]
+                    start_reg = int.from_bytes(frame[8:10], byteorder='big')
+                    num_regs = int.from_bytes(frame[10:12], byteorder='big')
+                    with self._busy_lock:
+                        time.sleep(self.reply_delay)
+                        self.num_requests += 1
+                    pdu = bytes([3, num_regs * 2]) + b''.join(((start_reg + reg_iter) & 0xFFFF).to_bytes(
+                        2, byteorder='big') for reg_iter in range(num_regs))
+                    tcp_conn.sendall(mb_proxy.make_mbap_frame(int.from_bytes(frame[0:2], byteorder='big'), frame[6],
+                                                              pdu))
+        except OSError:
+            pass
+        finally:
+            tcp_conn.close()
+            self._num_connections -= 1
+
+
+def run_clients(port, num_clients, run_time, num_reg_sets):
+    # every client polls one of num_reg_sets register ranges as fast as it is answered, returns (good, errors)
+    counts = [[0, 0] for client_iter in range(num_clients)]
+    end_time = time.monotonic() + run_time
+
+    def poll(client_iter):
+        with mb_client.ModbusClient('127.0.0.1', port, mb_timeout=2000) as client:
+            while time.monotonic() < end_time:
+                error_code, data = client.read_raw(1, 3, 100 + 10 * (client_iter % num_reg_sets), 10)
+                counts[client_iter][error_code is not None] += 1
+                if error_code is not None:
+                    time.sleep(0.05)  # a refused connection fails at once, do not spin on it
+
+    threads = [threading.Thread(target=poll, args=(client_iter,), daemon=True) for client_iter in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(count[0] for count in counts), sum(count[1] for count in counts)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times many clients polling one meter, directly and through a proxy.')
+    parser.add_argument('-c', '--clients', type=int, default=32, help='Clients polling at once. Default is 32.')
+    parser.add_argument('-r', '--reg_sets', type=int, default=4,
+                        help='Different register ranges the clients ask for. Default is 4.')
+    parser.add_argument('-d', '--delay', type=float, default=5, help='Meter reply delay in ms. Default is 5.')
+    parser.add_argument('-m', '--max_connections', type=int, default=4,
+                        help='Connections the meter takes. Default is 4.')
+    parser.add_argument('-s', '--seconds', type=float, default=5, help='Seconds per run. Default is 5.')
+    parser.add_argument('-ttl', '--cache', type=int, default=100, help='Proxy cache in ms. Default is 100.')
+    args = parser.parse_args()
+
+    meter = MeterSimulator(args.delay, args.max_connections)
+    print(args.clients, 'clients,', args.reg_sets, 'register ranges, meter takes', args.max_connections,
+          'connections and', args.delay, 'ms per request')
+    for run_name, cache_ttl in (('direct', None), ('proxy', 0), ('proxy+cache', args.cache)):
+        port = meter.port
+        proxy = None
+        if cache_ttl is not None:
+            proxy = mb_proxy.ModbusProxy(('127.0.0.1', meter.port, 'tcp'), bind='127.0.0.1', port=0,
+                                         mb_timeout=2000, cache_ttl=cache_ttl)
+            proxy.open()
+            port = proxy.port
+            proxy_thread = threading.Thread(target=proxy.run, daemon=True)
+            proxy_thread.start()
+        start_requests = meter.num_requests
+        num_good, num_errs = run_clients(port, args.clients, args.seconds, args.reg_sets)
+        meter_requests = meter.num_requests - start_requests
+        if proxy is not None:
+            proxy.stop()
+            proxy_thread.join()
+        print('%-12s %8.0f good replies/s, %6d failed, meter saw %6.0f requests/s' %
+              (run_name + ':', num_good / args.seconds, num_errs, meter_requests / args.seconds))
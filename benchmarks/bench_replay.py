@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# Replay benchmark for capture files.  Writes a capture of function 3 polls over TCP and RTU, then times how many
+# replies per second mb_capture.replay pushes through verify_no_comm_errs, verify_no_modbus_errs and ModbusData.
+#
+#   python benchmarks/bench_replay.py [-n NUM_POLLS] [-r NUM_REGS] [-t TYPE]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mbpy import mb_poll  # noqa: E402
+from mbpy import mb_capture  # noqa: E402
+
+
+def make_reply(serial_port, trans_id, mb_id, mb_func, num_regs, poll_iter):
+    reply_pdu = bytearray([mb_id, mb_func, num_regs * 2])
+    for reg_iter in range(num_regs):
+        reply_pdu.extend(((poll_iter + reg_iter) & 0xFFFF).to_bytes(2, byteorder='big'))
+    if serial_port is not None:
+        return reply_pdu + mb_poll.calc_crc_byte_array(reply_pdu)
+    return trans_id.to_bytes(2, byteorder='big') + b'\x00\x00' + len(reply_pdu).to_bytes(2, byteorder='big') + \
+        reply_pdu
+
+
+def write_capture(file_name, num_polls, num_regs):
+    # half the polls to a tcp gateway, half to a com port, the same requests a live poll would send
+    with mb_capture.FrameCapture(file_name) as capture:
+        for serial_port, transport, endpoint in ((None, 'tcp', '10.0.0.5:502'), ('/dev/ttyUSB0', 'rtu',
+                                                                                 '/dev/ttyUSB0')):
+            req_template = mb_poll.RequestTemplate(serial_port, False, 1, 3, 100, None, num_regs, 5 + num_regs * 2)
+            for poll_iter in range(num_polls // 2):
+                trans_id = poll_iter & 0xFFFF
+                capture.record_request(transport, endpoint, req_template.get_packet(trans_id))
+                capture.record_reply(transport, endpoint, make_reply(serial_port, trans_id, 1, 3, num_regs,
+                                                                     poll_iter))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times replaying a capture file through the decoder.')
+    parser.add_argument('-n', '--polls', type=int, default=200000, help='Polls in the capture. Default is 200000.')
+    parser.add_argument('-r', '--regs', type=int, default=20, help='Registers per reply. Default is 20.')
+    parser.add_argument('-t', '--typ', type=str, default='float', choices=mb_poll.DATA_TYPE_LIST,
+                        help='Type to decode the replies as. Default is float.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        capture_file = os.path.join(temp_dir, 'bench.mbcap')
+        write_capture(capture_file, args.polls, args.regs)
+        capture_size = os.path.getsize(capture_file)
+
+        start_time = time.perf_counter()
+        num_frames = sum(1 for frame in mb_capture.read_frames(capture_file))
+        read_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        num_replies = 0
+        num_errs = 0
+        for ts_ns, endpoint, mb_id, mb_func, start_reg_zero, otpt in mb_capture.replay(capture_file, args.typ):
+            num_replies += 1
+            if otpt and otpt[0] == 'Err':
+                num_errs += 1
+        replay_time = time.perf_counter() - start_time
+
+    print('capture:   %d frames, %.1f MB, %.1f bytes per frame' % (num_frames, capture_size / 1e6,
+                                                                   capture_size / max(num_frames, 1)))
+    print('read:      %10.0f frames per second' % (num_frames / read_time))
+    print('replay:    %10.0f replies per second (%d replies, %d errors, %s, %d registers)' %
+          (num_replies / replay_time, num_replies, num_errs, args.typ, args.regs))
+    if num_errs:
+        sys.exit(1)
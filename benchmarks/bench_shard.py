@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+# Sharded poller benchmark.  Serves many simulated gateways from separate processes, each answering every request at
+# once with the same block of floats, then polls all of them with mb_shard.ShardedPoller at 1, 2, 4, ... workers up
+# to the number of cpus, and reports polls per second and the speed up over one worker.
+#
+#   python benchmarks/bench_shard.py [-g GATEWAYS] [-n DEVICES] [-l LENGTH] [-s SECONDS] [-w MAX_WORKERS]
+
+import argparse
+import multiprocessing
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mbpy import mb_shard  # noqa: E402
+
+
+def serve_gateways(listen_conns, num_regs, ready_event):
+    # one process, many gateways, a fixed reply so the simulators cost little next to the workers' decoding
+    pdu = bytes([3, num_regs * 2]) + b''.join(struct.pack('>f', reg_iter * 1.5) for reg_iter in range(num_regs // 2))
+    reply_tail = struct.pack('>H', len(pdu) + 1)
+    selector = selectors.DefaultSelector()
+    for listen_conn in listen_conns:
+        selector.register(listen_conn, selectors.EVENT_READ)
+    ready_event.set()
+    while True:
+        for key, mask in selector.select():
+            if key.fileobj in listen_conns:
+                tcp_conn, address = key.fileobj.accept()
+                tcp_conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                selector.register(tcp_conn, selectors.EVENT_READ)
+                continue
+            try:
+                frame = key.fileobj.recv(4096)
+            except OSError:
+                frame = b''
+            if not frame:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                continue
+            # requests are 12 bytes and answered one at a time, so every read holds whole frames
+            for frame_start in range(0, len(frame) - 11, 12):
+                request = frame[frame_start:frame_start + 12]
+                key.fileobj.sendall(request[:4] + reply_tail + request[6:7] + pdu)
+
+
+def measure(devices, num_workers, run_time):
+    # polls per second and errors, not counting the first second while the workers start and connect
+    counts = [0, 0]
+    start_time = time.monotonic() + 1
+
+    def count_batch(batch):
+        if time.monotonic() >= start_time:
+            counts[0] += len(batch)
+            counts[1] += sum(1 for dev_index, poll_time_ns, otpt in batch if otpt and otpt[0] == 'Err')
+
+    poller = mb_shard.ShardedPoller(devices, num_workers, on_batch=count_batch, batch_period=0.2)
+    poller.start()
+    poller.run(run_time + 1)
+    return counts[0] / (time.monotonic() - start_time), counts[1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures how the sharded poller scales with worker processes.')
+    parser.add_argument('-g', '--gateways', type=int, default=64, help='Simulated gateways. Default is 64.')
+    parser.add_argument('-n', '--devices', type=int, default=4, help='Devices behind each gateway. Default is 4.')
+    parser.add_argument('-l', '--length', type=int, default=50, help='Floats read per poll. Default is 50.')
+    parser.add_argument('-s', '--seconds', type=float, default=5, help='Seconds per worker count. Default is 5.')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Most workers to try. Default is the number of cpus.')
+    args = parser.parse_args()
+
+    num_cpus = os.cpu_count() or 1
+    max_workers = args.workers or num_cpus
+    listen_conns = []
+    for gateway_iter in range(args.gateways):
+        listen_conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_conn.bind(('127.0.0.1', 0))
+        listen_conn.listen(16)
+        listen_conns.append(listen_conn)
+    ports = [listen_conn.getsockname()[1] for listen_conn in listen_conns]
+
+    # the simulators get half the cpus, so the workers are what runs out first
+    num_servers = max(1, min(num_cpus // 2, args.gateways))
+    servers = []
+    for server_iter in range(num_servers):
+        ready_event = multiprocessing.Event()
+        server = multiprocessing.Process(target=serve_gateways, daemon=True,
+                                         args=(listen_conns[server_iter::num_servers], args.length * 2, ready_event))
+        server.start()
+        ready_event.wait()
+        servers.append(server)
+    for listen_conn in listen_conns:
+        listen_conn.close()
+
+    devices = [{'ip': '127.0.0.1', 'port': port, 'mb_id': dev_iter + 1, 'num_vals': args.length, 'poll_delay': 0}
+               for port in ports for dev_iter in range(args.devices)]
+    print('%d devices on %d gateways, %d floats per poll, %d cpus, %d simulator processes' % (
+        len(devices), len(ports), args.length, num_cpus, num_servers))
+
+    num_workers = 1
+    base_rate = None
+    while True:
+        poll_rate, num_errs = measure(devices, num_workers, args.seconds)
+        base_rate = base_rate or poll_rate
+        print('workers: %3d %10.0f polls per second, %5.2fx one worker, %3.0f%% per worker, %d errors' % (
+            num_workers, poll_rate, poll_rate / base_rate, poll_rate / base_rate / num_workers * 100, num_errs))
+        if num_workers >= max_workers:
+            break
+        num_workers = min(num_workers * 2, max_workers)
+
+    for server in servers:
+        server.terminate()
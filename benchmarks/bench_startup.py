@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+# Startup benchmark for the command line tool.  Times a bare interpreter, `import mbpy.mb_poll`,
+# `python -m mbpy.mb_poll -h` and `python mbpy/mb_poll.py -h` in fresh processes and checks the import against a
+# budget.  Also checks that importing the module as a library does not load any transport, GPIO or terminal support.
+#
+#   python benchmarks/bench_startup.py [-n RUNS] [-b BUDGET_MS]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ('serial', 'RPi', 'socket', 'select', 'csv', 'argparse', 'shutil')
+
+
+def time_command(cmd, num_runs):
+    run_times = []
+    for run_iter in range(num_runs):
+        start_time = time.perf_counter()
+        subprocess.run(cmd, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        run_times.append((time.perf_counter() - start_time) * 1000)
+    run_times.sort()
+    return run_times[len(run_times) // 2]  # median in ms
+
+
+def find_loaded_lazy_modules():
+    check_code = ('import sys, mbpy.mb_poll; print(" ".join(sorted({m.split(".")[0] for m in sys.modules} & '
+                  'set(%r))))' % (LAZY_MODULES,))
+    otpt = subprocess.run([sys.executable, '-c', check_code], cwd=REPO_DIR, stdout=subprocess.PIPE, check=True)
+    return otpt.stdout.decode().split()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times interpreter startup plus importing mbpy.mb_poll.')
+    parser.add_argument('-n', '--runs', type=int, default=20, help='Number of runs per measurement. Default is 20.')
+    parser.add_argument('-b', '--budget', type=float, default=10,
+                        help='Allowed import time in ms on top of a bare interpreter. Default is 10.')
+    args = parser.parse_args()
+
+    # installed packages run from compiled bytecode, so make sure the timings do not include compiling mb_poll.py
+    subprocess.run([sys.executable, '-m', 'compileall', '-q', 'mbpy'], cwd=REPO_DIR, check=True)
+
+    bare_ms = time_command([sys.executable, '-c', 'pass'], args.runs)
+    import_ms = time_command([sys.executable, '-c', 'import mbpy.mb_poll'], args.runs)
+    module_help_ms = time_command([sys.executable, '-m', 'mbpy.mb_poll', '-h'], args.runs)
+    script_help_ms = time_command([sys.executable, os.path.join('mbpy', 'mb_poll.py'), '-h'], args.runs)
+
+    print('bare interpreter:       %7.1f ms' % bare_ms)
+    print('import mbpy.mb_poll:    %7.1f ms  (+%.1f ms, budget %.1f ms)' % (import_ms, import_ms - bare_ms,
+                                                                          args.budget))
+    print('-m mbpy.mb_poll -h:     %7.1f ms  (+%.1f ms)' % (module_help_ms, module_help_ms - bare_ms))
+    # a script run directly is compiled from source every time, the module form and the mb_poll entry point are not
+    print('mbpy/mb_poll.py -h:     %7.1f ms  (+%.1f ms)' % (script_help_ms, script_help_ms - bare_ms))
+
+    loaded_modules = find_loaded_lazy_modules()
+    if loaded_modules:
+        print('modules loaded on import that should wait until used:', ', '.join(loaded_modules))
+
+    if import_ms - bare_ms > args.budget or loaded_modules:
+        print('FAIL')
+        sys.exit(1)
+    print('OK')
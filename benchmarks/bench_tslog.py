@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+# Time series log benchmark.  Logs a day of one second polls of counters, slow moving floats and noisy floats, then
+# compares the log to the same rows as csv and times the bulk decoder and a one minute read from the middle.
+#
+#   python benchmarks/bench_tslog.py [-n NUM_POLLS] [-r NUM_VALS]
+
+import argparse
+import csv
+import io
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from struct import pack, unpack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mbpy import mb_poll  # noqa: E402
+from mbpy import mb_tslog  # noqa: E402
+
+
+def to_float32(val):
+    # the values a 'float' poll would really decode to
+    return unpack('>f', pack('>f', val))[0]
+
+
+SERIES = (
+    ('counters', 'uint32', lambda poll_iter, val_iter: 1000 * val_iter + poll_iter * (val_iter + 1) // 3),
+    ('slow floats', 'float', lambda poll_iter, val_iter: to_float32(round(230 + math.sin(poll_iter / 600 + val_iter),
+                                                                          1))),
+    ('noisy floats', 'float', lambda poll_iter, val_iter: to_float32(50 + random.gauss(0, 0.05))),
+)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares time series logs to csv files.')
+    parser.add_argument('-n', '--polls', type=int, default=86400, help='Polls of each series. Default is 86400.')
+    parser.add_argument('-r', '--vals', type=int, default=10, help='Values per poll. Default is 10.')
+    args = parser.parse_args()
+
+    start_ns = time.time_ns() // 1000000000 * 1000000000
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, data_type, make_val in SERIES:
+            log_file = os.path.join(temp_dir, name.replace(' ', '_') + '.mbts')
+            csv_buf = io.StringIO()
+            csv_wrtr = csv.writer(csv_buf)
+            start_time = time.perf_counter()
+            with mb_tslog.TimeSeriesLog(log_file, data_type, args.vals) as tslog:
+                for poll_iter in range(args.polls):
+                    ts_ns = start_ns + poll_iter * 1000000000 + random.randint(0, 5) * 1000000  # a little jitter
+                    if poll_iter % 1000 == 999:
+                        otpt = mb_poll.MB_ERR_DICT[87]
+                    else:
+                        otpt = [make_val(poll_iter, val_iter) for val_iter in range(args.vals)]
+                    tslog.append(ts_ns, otpt)
+                    csv_wrtr.writerow([str(datetime.fromtimestamp(ts_ns / 1e9))] + list(otpt))
+            write_time = time.perf_counter() - start_time
+            csv_size = len(csv_buf.getvalue())
+            log_size = os.path.getsize(log_file)
+
+            start_time = time.perf_counter()
+            num_samples = sum(len(times) for times, statuses, val_columns in mb_tslog.read_blocks(log_file))
+            decode_time = time.perf_counter() - start_time
+
+            mid_ns = start_ns + args.polls // 2 * 1000000000
+            start_time = time.perf_counter()
+            num_rows = sum(1 for row in mb_tslog.read_rows(log_file, mid_ns, mid_ns + 60000000000))
+            range_time = time.perf_counter() - start_time
+
+            print('%-13s csv %9d bytes, log %8d bytes, %6.1fx smaller, %5.2f bytes per poll' %
+                  (name + ':', csv_size, log_size, csv_size / log_size, log_size / args.polls))
+            print('%-13s write %8.0f polls/s, decode %8.0f polls/s, one minute read %d rows in %.1f ms' %
+                  ('', args.polls / write_time, num_samples / decode_time, num_rows, range_time * 1000))
@@ -1,11 +1,12 @@
 #!/usr/bin/python3
 
 from math import log10
+from bisect import bisect_left, bisect_right
 # from mbpy.mb_poll import modbus_poller
 import mbpy.mb_poll as mb_poll
-from time import (sleep, time)
-import threading
-import queue
+from mbpy.mb_client import ModbusClient
+from mbpy.mb_worker import PollWorker
+from functools import partial
 import csv
 import os
 import sys
@@ -13,7 +14,7 @@ import serial
 import serial.tools.list_ports
 from datetime import datetime
 from tkinter import (Frame, Button, Entry, Label, Checkbutton, GROOVE, DISABLED, NORMAL, TclError, IntVar, StringVar, N,
-                     W, E, S, NW, Tk, filedialog, messagebox, Toplevel, Image)  # , PhotoImage)
+                     W, E, S, NW, Tk, filedialog, messagebox, Image)  # , PhotoImage)
 from tkinter.ttk import Combobox
 import matplotlib
 import matplotlib.pyplot as plt
@@ -91,7 +92,79 @@ def scale_axis(axis_low_val, axis_high_val, arrow_key, b_ctrl_key):
     return otpt
 
 
+class MinMaxHistory:
+    """Every sample of one trend plus min/max summaries of 4, 16, 64, ... samples, so any x range can be drawn from
+    about as many points as the axes are pixels wide however long the history gets."""
+    def __init__(self, factor=4):
+        self.factor = factor
+        # per level: x of the first sample in each bucket (for bisect), (x, y) of the bucket min and of the max
+        self.starts = [[]]
+        self.mins = [[]]
+        self.maxs = [[]]
+
+    def __len__(self):
+        return len(self.starts[0])
+
+    def append(self, x, y):
+        pnt = (x, y)
+        self.starts[0].append(x)
+        self.mins[0].append(pnt)
+        self.maxs[0].append(pnt)
+
+        # fold every complete group of factor buckets into one bucket on the level above
+        level = 0
+        while len(self.starts[level]) % self.factor == 0:
+            if level + 1 == len(self.starts):
+                self.starts.append([])
+                self.mins.append([])
+                self.maxs.append([])
+            group_start = len(self.starts[level]) - self.factor
+            self.starts[level + 1].append(self.starts[level][group_start])
+            self.mins[level + 1].append(min(self.mins[level][group_start:], key=lambda pnt: pnt[1]))
+            self.maxs[level + 1].append(max(self.maxs[level][group_start:], key=lambda pnt: pnt[1]))
+            level += 1
+
+    def _append_points(self, level, first_ind, last_ind, xs, ys):
+        for ind in range(first_ind, last_ind):
+            min_pnt = self.mins[level][ind]
+            max_pnt = self.maxs[level][ind]
+            if min_pnt is max_pnt:
+                xs.append(min_pnt[0])
+                ys.append(min_pnt[1])
+            else:  # keep the line going forward in x
+                for pnt in ((min_pnt, max_pnt) if min_pnt[0] <= max_pnt[0] else (max_pnt, min_pnt)):
+                    xs.append(pnt[0])
+                    ys.append(pnt[1])
+
+    def get_points(self, x_low, x_high, max_buckets):
+        # (xs, ys) covering x_low to x_high with at most about max_buckets min/max pairs
+        xs, ys = [], []
+        if not self.starts[0]:
+            return xs, ys
+
+        level = 0
+        while level + 1 < len(self.starts) and \
+                bisect_right(self.starts[level], x_high) - bisect_left(self.starts[level], x_low) > max_buckets:
+            level += 1
+
+        # one bucket either side so the line runs off the edges of the axes
+        first_ind = max(0, bisect_left(self.starts[level], x_low) - 1)
+        last_ind = min(len(self.starts[level]), bisect_right(self.starts[level], x_high) + 1)
+        self._append_points(level, first_ind, last_ind, xs, ys)
+
+        # newest samples not yet folded into a bucket on this level, from the partial groups on the levels below
+        num_covered = len(self.starts[level]) * self.factor ** level
+        if last_ind < len(self.starts[level]):
+            return xs, ys
+        for lower_level in range(level - 1, -1, -1):
+            first_ind = num_covered // self.factor ** lower_level
+            self._append_points(lower_level, first_ind, len(self.starts[lower_level]), xs, ys)
+            num_covered = len(self.starts[lower_level]) * self.factor ** lower_level
+        return xs, ys
+
+
 def _quit():
+    inpt_app_rt.display_app.stop_poller()
     root.quit()
     root.destroy()
 
@@ -423,6 +496,7 @@ class DisplayApp:
         self.graph_figure = plt.figure(1, figsize=(6.2, 5), dpi=100, tight_layout=True)
         self.graph_canvas = FigureCanvasTkAgg(self.graph_figure, master=self.graph_mstr_frame)
         self.graph_canvas.draw()  # show()
+        self.graph_canvas.mpl_connect('draw_event', self.on_plot_draw)
 
         # self.canvas.mpl_connect('key_press_event', self.on_key_event)
 
@@ -490,12 +564,19 @@ class DisplayApp:
         self.graph_figure.autofmt_xdate(rotation=45)
         self.graph_figure.axes[0].xaxis.set_major_formatter(dates.DateFormatter('%m-%d %H:%M:%S'))
         self.plots = [None] * 4
-        dum_plt, = self.graph_figure.axes[0].plot_date([], [], marker='', linestyle='-')
+        dum_plt, = self.graph_figure.axes[0].plot_date([], [], marker='', linestyle='-', animated=True)
         self.plots[0] = dum_plt
         self.active_plot = 0  # 0 is all plots
+        # the lines are animated, full draws only happen when the axes change and every other frame is blitted
+        self.plot_hists = []  # MinMaxHistory per plot
+        self.plot_background = None
+        self.plot_frame_delay = 50  # ms between plot frames, caps the frame rate no matter how fast the polls are
+        self.plot_polls_shown = 20  # number of polls across the x axis while following new data
+        self._job_plot_frame = None
+        self.b_plot_dirty = False
+        self.b_plot_fit_y = False
 
         self.b_disp_graph = False
-        self.poll_start_time = time()
 
         self.ip = '165.123.136.170'
         self.mbid = 9
@@ -512,17 +593,16 @@ class DisplayApp:
         self.b_write_msg = False
         # self.typ = 'float'
 
-        self.queue = None  # queue.PriorityQueue()
-        self.queue_poll_delay = 99  # amount of time between queue checks
-        self._job_mb_poller = None
+        self.poll_worker = None  # one PollWorker per output frame, it keeps the connection open between polls
+        self.queue_poll_delay = 50  # amount of time between queue checks
+        self._job_process_queue = None
         self.tot_polls = 0
         self.val_polls = 0
 
     def start_button(self):
-        while not self.queue.empty():
-            self.queue.get(block=False)
+        self.poll_worker.get_results()  # drop anything polled before the pause
         self.run_poller(False)
-        self.mstr.after(self.queue_poll_delay, self.process_queue)
+        self._job_process_queue = self.mstr.after(self.queue_poll_delay, self.process_queue)
 
     def run_poller(self, b_pause):
         if not b_pause:  # run task
@@ -537,92 +617,63 @@ class DisplayApp:
                 self.btn_resume.configure(state=DISABLED)
                 self.btn_save_data.configure(state=DISABLED)
 
-            # self.queue = queue.Queue()
-            self.poll_start_time = time()
-
-            ModbusPollThreadedTask(self.queue, self.ip, self.mbid, self.start_reg, self.num_vals, self.data_type,
-                                   self.byte_swap, self.word_swap, self.poll_delay,
-                                   int((self.poll_start_time - time()) * 1000) + self.poll_delay - 50, self.port,
-                                   self.mb_func).start()
+            self.poll_worker.resume()
+            if self.b_disp_graph and self._job_plot_frame is None:
+                self._job_plot_frame = self.mstr.after(self.plot_frame_delay, self.process_plot_frame)
+        else:  # pause task, the worker finishes a poll in progress on its own and anything it returns is dropped
+            self.poll_worker.pause()
+            if self._job_process_queue is not None:
+                self.mstr.after_cancel(self._job_process_queue)
+                self._job_process_queue = None
 
-            # self.mstr.after(self.tm, self.process_queue)
-        else:  # pause task
-            self.queue.put((0, 'Paused'))
+            if self.b_disp_graph:
+                self.stop_plot_frames()
+                if self.b_plot_dirty:  # show the last polls before the plot is frozen
+                    self.b_plot_dirty = False
+                    self.draw_plot_frame()
+                self.btn_pause_g.configure(state=DISABLED)
+                self.btn_resume_g.configure(state=NORMAL)
+                self.btn_adj_plt.configure(state=NORMAL)
+                self.btn_save_plot_g.configure(state=NORMAL)
+                self.btn_save_data_g.configure(state=NORMAL)
+            else:
+                self.btn_pause.configure(state=DISABLED)
+                self.btn_resume.configure(state=NORMAL)
+                self.btn_save_data.configure(state=NORMAL)
 
     def process_queue(self):
-        try:
-            queue_msg = self.queue.get(block=False)
-            queue_msg = queue_msg[1]
-            # handle output ******************************************************************************************
-            if queue_msg == 'Paused':
-                # print(msg)
-                if self._job_mb_poller is not None:
-                    self.mstr.after_cancel(self._job_mb_poller)
-                    self._job_mb_poller = None
-
-                if self.b_disp_graph:
-                    self.btn_pause_g.configure(state=DISABLED)
-                else:
-                    self.btn_pause.configure(state=DISABLED)
-                self.mstr.update()
-
-                # kill thread here?
-                if threading.active_count() > 1:
-                    wait_splash_screen = WaitSplash(self.mstr)
-                    # top.update()
-
-                    while threading.active_count() > 1:
-                        # print('thread running on pause')
-                        sleep(.05)
-                    else:
-                        wait_splash_screen.destroy()
-
-                while not self.queue.empty():
-                    self.queue.get(block=False)
-
-                if self.b_disp_graph:
-                    # self.b_pause_g.configure(state=DISABLED)
-                    self.btn_resume_g.configure(state=NORMAL)
-                    self.btn_adj_plt.configure(state=NORMAL)
-                    self.btn_save_plot_g.configure(state=NORMAL)
-                    self.btn_save_data_g.configure(state=NORMAL)
-                else:
-                    # self.b_pause.configure(state=DISABLED)
-                    self.btn_resume.configure(state=NORMAL)
-                    self.btn_save_data.configure(state=NORMAL)
-                return
+        # handles every poll finished since the last check, so polls faster than the check rate are not lost
+        for poll_time, queue_msg in self.poll_worker.get_results():
+            self.tot_polls += 1
+            if queue_msg[0] != 'Err':
+                self.val_polls += 1
+                self.write_otpt_to_labels(queue_msg, poll_time)
             else:
-                # print(time(), threading.active_count())
-                self.tot_polls += 1
-                if self.b_disp_graph:  # graph data
-                    if queue_msg[0] != 'Err':
-                        self.val_polls += 1
-                        self.l_mb_err_g.configure(text='Err: None')
-                        self.write_otpt_to_labels(queue_msg)
-                    else:
-                        self.l_mb_err_g.configure(text='Err: ' + str(queue_msg[1]))
-                        self.write_err(queue_msg)
-                    self.l_tot_polls_g.configure(text='Total Polls: ' + str(self.tot_polls))
-                    self.l_val_polls_g.configure(text='Valid Polls: ' + str(self.val_polls))
-                else:  # no graph
-
-                    # while (self.chk_tm + self.pd / 1000 - time()) > 0.02:
-                    #     pass
-                    if queue_msg[0] != 'Err':
-                        self.val_polls += 1
-                        self.l_mb_err.configure(text='Err: None')
-                        self.write_otpt_to_labels(queue_msg)
-                    else:
-                        self.l_mb_err.configure(text='Err: ' + str(queue_msg[1]))
-                        self.write_err(queue_msg)
-                    self.l_tot_polls.configure(text='Total Polls: ' + str(self.tot_polls))
-                    self.l_val_polls.configure(text='Valid Polls: ' + str(self.val_polls))
+                self.write_err(queue_msg, poll_time)
+
+            if self.b_disp_graph:  # graph data
+                self.l_mb_err_g.configure(text='Err: None' if queue_msg[0] != 'Err' else 'Err: ' + str(queue_msg[1]))
+                self.l_tot_polls_g.configure(text='Total Polls: ' + str(self.tot_polls))
+                self.l_val_polls_g.configure(text='Valid Polls: ' + str(self.val_polls))
+            else:  # no graph
+                self.l_mb_err.configure(text='Err: None' if queue_msg[0] != 'Err' else 'Err: ' + str(queue_msg[1]))
+                self.l_tot_polls.configure(text='Total Polls: ' + str(self.tot_polls))
+                self.l_val_polls.configure(text='Valid Polls: ' + str(self.val_polls))
+
+            if self.b_write_msg:  # writes are only sent once per resume
+                self.run_poller(True)
+                return
+
+        self._job_process_queue = self.mstr.after(self.queue_poll_delay, self.process_queue)
 
-                self._job_mb_poller = self.mstr.after(max(0, int((self.poll_start_time - time()) * 1000) +
-                                                          self.poll_delay), lambda: self.run_poller(self.b_write_msg))
-                self.mstr.after(self.queue_poll_delay, self.process_queue)
-        except queue.Empty:
-            self.mstr.after(self.queue_poll_delay, self.process_queue)
+    def stop_poller(self):
+        self.stop_plot_frames()
+        if self._job_process_queue is not None:
+            self.mstr.after_cancel(self._job_process_queue)
+            self._job_process_queue = None
+        if self.poll_worker is not None:
+            self.poll_worker.stop()  # closes its connection from its own thread once a poll in progress returns
+            self.poll_worker = None
 
     def display_otpt_frame(self, b_disp_graph, ip, mbid, start_reg=1, num_vals=1, data_type='float', b_byte_swap=False,
                            b_word_swap=False, poll_delay=1000, port=502, mb_func=3):
@@ -652,12 +703,21 @@ class DisplayApp:
         self.otpt_errs = [[] for _ in range(3)]
         self.otpt_start_strs = ['' for _ in range(self.num_vals)]
 
-        self.queue = queue.PriorityQueue()
+        self.stop_poller()
+        client = ModbusClient(self.ip, self.port, mb_timeout=self.poll_delay)
+        self.poll_worker = PollWorker(partial(client.request, self.mbid, self.mb_func, self.start_reg, self.num_vals,
+                                              self.data_type, self.byte_swap, self.word_swap),
+                                      self.poll_delay, on_close=client.close, b_single_shot=self.b_write_msg)
+        self.poll_worker.pause()
+        self.poll_worker.start()
 
         if b_disp_graph == 1:
             self.b_disp_graph = True
             self.active_plot = 0
             self.init_otpt_labels(num_otpts)
+            self.plot_hists = [MinMaxHistory() for _ in range(num_otpts)]
+            self.b_plot_dirty = False
+            self.b_plot_fit_y = True
 
             self.mstr.bind('<Key>', self.on_key_event)
             self.mstr.bind('<Control-Up>', lambda e: self.on_key_event(e, True))
@@ -690,7 +750,8 @@ class DisplayApp:
         self.otpt_data = []
         self.otpt_start_strs = []
         self.otpt_errs = []
-        self.run_poller(True)
+        self.plot_hists = []
+        self.stop_poller()
 
     def init_otpt_labels(self, num_otpts):
         start_reg = self.start_reg
@@ -748,7 +809,7 @@ class DisplayApp:
                     self.graph_figure.add_subplot(num_otpts, 1, ii + 1)
                     plt.setp(self.graph_figure.axes[ii].get_xticklabels(), rotation=45)
                     self.graph_figure.axes[ii].xaxis.set_major_formatter(dates.DateFormatter('%m-%d %H:%M:%S'))
-                    dum_plt, = self.graph_figure.axes[ii].plot_date([], [], marker='', linestyle='-')
+                    dum_plt, = self.graph_figure.axes[ii].plot_date([], [], marker='', linestyle='-', animated=True)
                     self.plots[ii] = dum_plt
 
                 if num_otpts == 2:
@@ -805,7 +866,7 @@ class DisplayApp:
             self.l_tot_polls.configure(text='Total Polls: 0')
             self.l_val_polls.configure(text='Valid Polls: 0')
 
-    def write_otpt_to_labels(self, data):
+    def write_otpt_to_labels(self, data, poll_time):
         if len(self.otpt_lbls) == len(data):
             # handle data
 
@@ -822,37 +883,83 @@ class DisplayApp:
                 self.otpt_lbls[ii].configure(text=otpt_str)
                 self.otpt_data[ii].append(data[ii])
 
-            self.otpt_data[-1].append(dates.date2num(datetime.now()))
-
-            if self.b_disp_graph:
-                total_polls = len(self.otpt_data[0]) - 1
-
-                if total_polls > 1:
-                    for ii in range(self.num_vals):
-                        if total_polls > 20:
-                            minx = total_polls - 20
-                        else:
-                            minx = 1
-
-                        # renew plot data
-                        self.plots[ii].set_xdata(self.otpt_data[-1][1:])
-                        self.plots[ii].set_ydata(self.otpt_data[ii][1:])
-
-                        # reset axes
-                        self.graph_figure.axes[ii].set_autoscaley_on(True)
-                        self.graph_figure.axes[ii].relim()
-                        self.graph_figure.axes[ii].set_xlim([self.otpt_data[-1][minx], self.otpt_data[-1][total_polls]])
-                        self.graph_figure.axes[ii].autoscale_view()
+            poll_date = dates.date2num(datetime.fromtimestamp(poll_time))
+            self.otpt_data[-1].append(poll_date)
 
-                    self.graph_canvas.draw()
+            if self.b_disp_graph:  # drawn by the next plot frame
+                for ii in range(len(self.plot_hists)):
+                    self.plot_hists[ii].append(poll_date, data[ii])
+                self.b_plot_dirty = True
 
         else:
             pass
 
-    def write_err(self, data):
+    def on_plot_draw(self, event):
+        # any full draw (new limits, resize, grid) leaves a fresh background to blit the lines onto
+        self.plot_background = self.graph_canvas.copy_from_bbox(self.graph_figure.bbox)
+        for ii in range(len(self.plot_hists)):
+            self.graph_figure.axes[ii].draw_artist(self.plots[ii])
+
+    def update_plot_lines(self):
+        # sets every line to the decimated history inside its current x limits, returns (y min, y max) per plot
+        y_ranges = []
+        for ii in range(len(self.plot_hists)):
+            axis = self.graph_figure.axes[ii]
+            x_low, x_high = axis.get_xlim()
+            xs, ys = self.plot_hists[ii].get_points(x_low, x_high, max(1, int(axis.bbox.width)))
+            self.plots[ii].set_data(xs, ys)
+            y_ranges.append((min(ys), max(ys)) if ys else None)
+        return y_ranges
+
+    def redraw_plot(self):
+        self.update_plot_lines()
+        self.graph_canvas.draw()
+
+    def draw_plot_frame(self):
+        if not self.plot_hists or not len(self.plot_hists[0]):
+            return
+        b_full_draw = False
+        latest_date = self.plot_hists[0].starts[0][-1]
+        x_span = self.plot_polls_shown * max(1, self.poll_delay) / 86400000  # ms to days
+        for ii in range(len(self.plot_hists)):
+            x_low, x_high = self.graph_figure.axes[ii].get_xlim()
+            if latest_date > x_high or latest_date < x_low:  # jump ahead in steps so most frames keep their ticks
+                self.graph_figure.axes[ii].set_xlim([latest_date - 0.75 * x_span, latest_date + 0.25 * x_span])
+                b_full_draw = True
+
+        for ii, y_range in enumerate(self.update_plot_lines()):
+            if y_range is None:
+                continue
+            y_low, y_high = self.graph_figure.axes[ii].get_ylim()
+            if self.b_plot_fit_y or y_range[0] < y_low or y_range[1] > y_high:  # only grows while polling
+                y_margin = (y_range[1] - y_range[0]) * 0.1 or abs(y_range[1]) * 0.1 or 1
+                self.graph_figure.axes[ii].set_ylim([y_range[0] - y_margin, y_range[1] + y_margin])
+                b_full_draw = True
+        self.b_plot_fit_y = False
+
+        if b_full_draw or self.plot_background is None:
+            self.graph_canvas.draw()
+        else:
+            self.graph_canvas.restore_region(self.plot_background)
+            for ii in range(len(self.plot_hists)):
+                self.graph_figure.axes[ii].draw_artist(self.plots[ii])
+            self.graph_canvas.blit(self.graph_figure.bbox)
+
+    def process_plot_frame(self):
+        if self.b_plot_dirty:
+            self.b_plot_dirty = False
+            self.draw_plot_frame()
+        self._job_plot_frame = self.mstr.after(self.plot_frame_delay, self.process_plot_frame)
+
+    def stop_plot_frames(self):
+        if self._job_plot_frame is not None:
+            self.mstr.after_cancel(self._job_plot_frame)
+            self._job_plot_frame = None
+
+    def write_err(self, data, poll_time):
         self.otpt_errs[0].append(data[1])
         self.otpt_errs[1].append(data[2])
-        self.otpt_errs[2].append(dates.date2num(datetime.now()))
+        self.otpt_errs[2].append(dates.date2num(datetime.fromtimestamp(poll_time)))
 
     def reset_cntrs(self):
         self.tot_polls = 0
@@ -872,10 +979,17 @@ class DisplayApp:
                   ('LaTeX', '.pgf')]
         graph_file = filedialog.asksaveasfilename(defaultextension='.png', filetypes=ftypes, parent=self.mstr)
         if graph_file != '':
+            for plot in self.plots:  # animated artists are left out of saved figures
+                if plot is not None:
+                    plot.set_animated(False)
             try:
                 plt.savefig(graph_file, dpi=400)
             except IOError:
                 messagebox.showerror('File Error', 'Plot could not be saved because file is already open!')
+            finally:
+                for plot in self.plots:
+                    if plot is not None:
+                        plot.set_animated(True)
 
     def save_data(self):
         # print(os.getcwd())
@@ -920,14 +1034,14 @@ class DisplayApp:
                         new_lim = scale_axis(lw, hg, event.keysym, ctrl)
                         self.graph_figure.axes[i].set_ylim(new_lim)
         
-                    self.graph_canvas.draw()
+                    self.redraw_plot()
                 elif event.keysym in ('Left', 'Right'):  # , 'ctrl+left', 'ctrl+right'):
                     for i in range(minax, maxax):
                         lw, hg = self.graph_figure.axes[i].get_xlim()
                         new_lim = scale_axis(lw, hg, event.keysym, ctrl)
                         self.graph_figure.axes[i].set_xlim(new_lim)
         
-                    self.graph_canvas.draw()
+                    self.redraw_plot()
                 elif event.keysym == 's':
                     self.save_graph_figure()
                 elif event.keysym == 'w':
@@ -941,60 +1055,6 @@ class DisplayApp:
                 self.run_poller(True)
 
 
-class WaitSplash(Toplevel):
-    def __init__(self, mstr):
-        Toplevel.__init__(self, master=mstr)
-
-        Label(self, text='Please wait until background\nthreads are done running.', bg='white').grid(sticky=W+E+N+S)
-        self.columnconfigure(0, weight=1)
-        self.rowconfigure(0, weight=1)
-        mstr_width = mstr.winfo_width()
-        mstr_height = mstr.winfo_height()
-        mstr_x = mstr.winfo_rootx()
-        mstr_y = mstr.winfo_rooty()
-
-        width = mstr_width / 5 * 4
-        height = mstr_height / 5 * 4
-        x = mstr_x + (mstr_width - width) / 2
-        y = mstr_y + (mstr_height - height) / 2
-
-        self.configure(bg='white')
-        self.geometry('%dx%d+%d+%d' % (width, height, x, y))
-
-        self.overrideredirect(True)
-        self.update()
-
-
-class ModbusPollThreadedTask(threading.Thread):
-    def __init__(self, queue_obj, ip, mbid, start_reg, num_vals, data_type, b_byte_swap, b_word_swap, mb_timeout,
-                 poll_delay, port, mb_func):
-        self.ip = ip
-        self.mbid = mbid
-        self.start_reg = start_reg
-        self.num_vals = num_vals
-        self.data_type = data_type
-        self.b_byte_swap = b_byte_swap
-        self.b_word_swap = b_word_swap
-        self.port = port
-        self.mb_func = mb_func
-        self.mb_timeout = mb_timeout
-        self.poll_delay = poll_delay
-
-        # print(self.timeout, self.pd)
-        threading.Thread.__init__(self)
-        self.queue = queue_obj
-
-    def run(self):
-        # run function overrides thread run method
-        # print('start ', time())
-        otpt = mb_poll.modbus_poller(self.ip, self.mbid, self.start_reg, self.num_vals, data_type=self.data_type,
-                                     b_byteswap=self.b_byte_swap, b_wordswap=self.b_word_swap,
-                                     mb_timeout=self.mb_timeout, poll_delay=self.poll_delay, port=self.port,
-                                     mb_func=self.mb_func)
-        # print('finish', time(), '\n')
-        self.queue.put((1, otpt))
-
-
 matplotlib.use('TkAgg')
 
 root = Tk()
@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+
+import os
+import sys
+from functools import partial
+from datetime import datetime
+from tkinter import (Frame, Button, Label, Canvas, Scrollbar, GROOVE, DISABLED, NORMAL, TclError, VERTICAL, N, W, E, S,
+                     Tk, filedialog, messagebox)
+from mbpy.mb_client import ClientPool  # folder.file import class
+from mbpy.mb_pointmap import PollPlan
+from mbpy.mb_worker import PollWorker
+
+
+# (title, width in pixels) of each table column
+TABLE_COLUMNS = (('Name', 220), ('Device', 170), ('Register', 80), ('Value', 140), ('Updated', 100),
+                 ('Status', 220))
+ROW_HEIGHT = 18
+STATUS_COLUMN = 5
+
+
+def format_point_val(val):
+    if isinstance(val, float):
+        return '%.2f' % val
+    return str(val)
+
+
+def _quit():
+    dash_app_rt.stop_poller()
+    root.quit()
+    root.destroy()
+
+
+class DashboardApp:
+    """Table of every point in a point map, polled by one background worker.
+
+    Only the rows that fit in the window have canvas items, scrolling reuses them for other points, and a refresh
+    only touches the cells whose text changed.
+    """
+    def __init__(self, mstr):
+        self.mstr = mstr
+
+        self.btn_frame = Frame(mstr, bd=2, relief=GROOVE)
+        self.table_frame = Frame(mstr, bd=2, relief=GROOVE)
+        self.btn_frame.grid(row=0, column=0, sticky=W + E, padx=5, pady=5)
+        self.table_frame.grid(row=1, column=0, sticky=W + E + N + S, padx=5, pady=(0, 5))
+        mstr.rowconfigure(1, weight=1)
+        mstr.columnconfigure(0, weight=1)
+
+    # button frame widgets
+        self.btn_open = Button(self.btn_frame, text='Open Point Map', width=14, command=self.open_point_map)
+        self.btn_pause = Button(self.btn_frame, text='Pause', width=8, state=DISABLED, command=self.pause_poller)
+        self.btn_resume = Button(self.btn_frame, text='Resume', width=8, state=DISABLED, command=self.resume_poller)
+        self.l_status = Label(self.btn_frame, text='No point map loaded.', anchor=W)
+
+        self.btn_open.grid(row=0, column=0, padx=5, pady=5)
+        self.btn_pause.grid(row=0, column=1, padx=5, pady=5)
+        self.btn_resume.grid(row=0, column=2, padx=5, pady=5)
+        self.l_status.grid(row=0, column=3, padx=5, sticky=W)
+
+    # table frame widgets
+        table_width = sum(col_width for col_title, col_width in TABLE_COLUMNS)
+        self.header_canvas = Canvas(self.table_frame, width=table_width, height=ROW_HEIGHT, highlightthickness=0)
+        self.table_canvas = Canvas(self.table_frame, width=table_width, height=ROW_HEIGHT * 30, bg='white',
+                                   highlightthickness=0)
+        self.table_scroll = Scrollbar(self.table_frame, orient=VERTICAL, command=self.on_scroll)
+
+        self.header_canvas.grid(row=0, column=0, sticky=W + E)
+        self.table_canvas.grid(row=1, column=0, sticky=W + E + N + S)
+        self.table_scroll.grid(row=1, column=1, sticky=N + S)
+        self.table_frame.rowconfigure(1, weight=1)
+        self.table_frame.columnconfigure(0, weight=1)
+
+        col_x = 0
+        self.col_xs = []
+        for col_title, col_width in TABLE_COLUMNS:
+            self.header_canvas.create_text(col_x + 3, ROW_HEIGHT // 2, text=col_title, anchor=W)
+            self.col_xs.append(col_x + 3)
+            col_x += col_width
+
+        self.table_canvas.bind('<Configure>', self.on_resize)
+        self.table_canvas.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.table_canvas.bind('<Button-4>', lambda e: self.scroll_rows(-3))
+        self.table_canvas.bind('<Button-5>', lambda e: self.scroll_rows(3))
+
+    # variables
+        self.points = []
+        self.row_index = {}  # point name: row
+        self.latest = {}  # point name: (poll time, value or error tuple)
+        self.dirty_names = set()  # points with a new value since the last refresh
+        self.first_row = 0
+        self.slot_items = []  # canvas text ids for each row that fits in the window, one per column
+        self.slot_texts = []  # text each of those items shows now, so unchanged cells are skipped
+        self.b_redraw_all = True  # scrolled or resized, every visible row has to be checked
+
+        self.mb_timeout = 1500
+        self.refresh_delay = 200  # ms between table refreshes
+        self.poll_worker = None
+        self._job_refresh = None
+        self.num_scans = 0
+        self.num_errs = 0
+
+    def open_point_map(self, file_name=None):
+        if file_name is None:
+            file_name = filedialog.askopenfilename(filetypes=[('Point Map', '.json .yaml .yml .csv')],
+                                                   parent=self.mstr)
+            if not file_name:
+                return
+        try:
+            poll_plan = PollPlan.from_file(file_name)
+        except (ValueError, IOError, ImportError) as err:
+            messagebox.showerror('Point Map Error', str(err), parent=self.mstr)
+            return
+
+        self.stop_poller()
+        self.points = poll_plan.points
+        self.row_index = {point['name']: row for row, point in enumerate(self.points)}
+        self.latest = {}
+        self.dirty_names = set()
+        self.first_row = 0
+        self.num_scans = 0
+        self.num_errs = 0
+        self.b_redraw_all = True
+        self.render_rows()
+
+        client_pool = ClientPool(self.mb_timeout)
+        self.poll_worker = PollWorker(partial(poll_plan.scan, client_pool, True), on_close=client_pool.close_all,
+                                      next_due_func=poll_plan.get_next_due)
+        self.poll_worker.start()
+        self.mstr.title('PyBus Dashboard - ' + os.path.basename(file_name))
+        self.resume_poller()
+
+    def pause_poller(self):
+        self.poll_worker.pause()
+        self.btn_pause.configure(state=DISABLED)
+        self.btn_resume.configure(state=NORMAL)
+
+    def resume_poller(self):
+        self.poll_worker.resume()
+        self.btn_pause.configure(state=NORMAL)
+        self.btn_resume.configure(state=DISABLED)
+        if self._job_refresh is None:
+            self._job_refresh = self.mstr.after(self.refresh_delay, self.process_queue)
+
+    def stop_poller(self):
+        if self._job_refresh is not None:
+            self.mstr.after_cancel(self._job_refresh)
+            self._job_refresh = None
+        if self.poll_worker is not None:
+            self.poll_worker.stop()  # closes its connections from its own thread once a scan in progress returns
+            self.poll_worker = None
+
+    def process_queue(self):
+        for poll_time, point_vals in self.poll_worker.get_results():
+            self.num_scans += 1
+            for name, val in point_vals.items():
+                self.latest[name] = (poll_time, val)
+                if isinstance(val, tuple) and val and val[0] == 'Err':
+                    self.num_errs += 1
+            self.dirty_names.update(point_vals)
+
+        self.l_status.configure(text=str(len(self.points)) + ' points, ' + str(self.num_scans) + ' scans, ' +
+                                str(self.num_errs) + ' errors')
+        self.render_rows()
+        self._job_refresh = self.mstr.after(self.refresh_delay, self.process_queue)
+
+    def get_row_texts(self, row):
+        point = self.points[row]
+        register = str(point['register']) if point['bit'] is None else str(point['register']) + '.' + \
+            str(point['bit'])
+        device = point['ip'] + ':' + str(point['port']) + ' #' + str(point['mb_id'])
+        if point['name'] not in self.latest:
+            return [point['name'], device, register, '', '', 'Waiting']
+
+        poll_time, val = self.latest[point['name']]
+        updated = datetime.fromtimestamp(poll_time).strftime('%H:%M:%S')
+        if isinstance(val, tuple) and val and val[0] == 'Err':
+            return [point['name'], device, register, '', updated, 'Err ' + str(val[1]) + ': ' + str(val[2])]
+        return [point['name'], device, register, format_point_val(val), updated, 'OK']
+
+    def update_slot(self, slot, row):
+        row_texts = self.get_row_texts(row) if row < len(self.points) else [''] * len(TABLE_COLUMNS)
+        for col, text in enumerate(row_texts):
+            if self.slot_texts[slot][col] != text:
+                self.slot_texts[slot][col] = text
+                if col == STATUS_COLUMN:
+                    self.table_canvas.itemconfigure(self.slot_items[slot][col], text=text,
+                                                    fill='red' if text.startswith('Err') else 'black')
+                else:
+                    self.table_canvas.itemconfigure(self.slot_items[slot][col], text=text)
+
+    def render_rows(self):
+        num_slots = len(self.slot_items)
+        if self.b_redraw_all:
+            for slot in range(num_slots):
+                self.update_slot(slot, self.first_row + slot)
+            self.b_redraw_all = False
+        else:
+            for name in self.dirty_names:
+                slot = self.row_index.get(name, -1) - self.first_row
+                if 0 <= slot < num_slots:
+                    self.update_slot(slot, self.first_row + slot)
+        self.dirty_names.clear()
+
+        if self.points:
+            self.table_scroll.set(self.first_row / len(self.points),
+                                  min(1.0, (self.first_row + num_slots) / len(self.points)))
+        else:
+            self.table_scroll.set(0, 1)
+
+    def on_resize(self, event):
+        # one slot of canvas items per row that fits, plus one for the partly shown row at the bottom
+        num_slots = event.height // ROW_HEIGHT + 1
+        while len(self.slot_items) > num_slots:
+            for item in self.slot_items.pop():
+                self.table_canvas.delete(item)
+            self.slot_texts.pop()
+        while len(self.slot_items) < num_slots:
+            slot_y = len(self.slot_items) * ROW_HEIGHT + ROW_HEIGHT // 2
+            self.slot_items.append([self.table_canvas.create_text(col_x, slot_y, text='', anchor=W)
+                                    for col_x in self.col_xs])
+            self.slot_texts.append([''] * len(TABLE_COLUMNS))
+        self.scroll_rows(0)
+
+    def scroll_rows(self, num_rows):
+        last_first_row = max(0, len(self.points) - len(self.slot_items) + 1)
+        self.first_row = max(0, min(last_first_row, self.first_row + num_rows))
+        self.b_redraw_all = True
+        self.render_rows()
+
+    def on_scroll(self, *args):
+        if args[0] == 'moveto':
+            self.scroll_rows(int(float(args[1]) * len(self.points)) - self.first_row)
+        elif args[0] == 'scroll':
+            self.scroll_rows(int(args[1]) * (max(1, len(self.slot_items) - 2) if args[2] == 'pages' else 1))
+
+    def on_mouse_wheel(self, event):
+        self.scroll_rows(-3 if event.delta > 0 else 3)
+
+
+root = Tk()
+root.title('PyBus Dashboard')
+root.protocol("WM_DELETE_WINDOW", _quit)
+if os.name == 'nt':
+    icopath = os.getcwd() + '/resources/Upenn16.ico'
+    root.iconbitmap(icopath)
+
+dash_app_rt = DashboardApp(root)
+if len(sys.argv) > 1:
+    root.after(0, lambda: dash_app_rt.open_point_map(sys.argv[1]))
+
+root.mainloop()
+
+try:
+    root.destroy()  # optional; see description below
+except TclError:
+    pass
@@ -1,17 +1,16 @@
 #!/usr/bin/python3
 
 from math import log10
-from mbpy.mb_poll import modbus_poller  # folder.file import function
-from time import (sleep, time)
-import threading
-import queue
+from mbpy.mb_client import ModbusClient  # folder.file import class
+from mbpy.mb_worker import PollWorker
+from functools import partial
 import csv
 import os
 import serial
 import serial.tools.list_ports
 from datetime import datetime
 from tkinter import (Frame, Button, Entry, Label, Checkbutton, GROOVE, DISABLED, NORMAL, TclError, IntVar, StringVar, N,
-                     W, E, S, NW, Tk, filedialog, messagebox, Toplevel, PhotoImage)
+                     W, E, S, NW, Tk, filedialog, messagebox, PhotoImage)
 from tkinter.ttk import Combobox
 # import matplotlib
 # import matplotlib.pyplot as plt
@@ -99,6 +98,7 @@ def adj_axes(lw, hg, typ, ctrl):
 
 
 def _quit():
+    inpt_app_rt.disp_app.stop_poller()
     root.quit()
     root.destroy()
 
@@ -480,7 +480,6 @@ class DisplayApp:
         # self.wch_plt = 0
 
         self.flg_gph = False
-        self.chk_tm = time()
 
         self.ip = '165.123.136.170'
         self.dev = 9
@@ -497,118 +496,69 @@ class DisplayApp:
         self.wrt = True
         self.typ = 'float'
 
-        self.queue = None  # queue.PriorityQueue()
-        self.tm = 101  # amount of time between queue checks
+        self.worker = None  # one PollWorker per output frame, it keeps the connection open between polls
+        self.tm = 50  # amount of time between queue checks
         self._job = None
         self.totpolls = 0
         self.valpolls = 0
 
     def start_button(self):
-        while not self.queue.empty():
-            self.queue.get(block=False)
+        self.worker.get_results()  # drop anything polled before the pause
         self.run_poller(True)
-        self.mstr.after(self.tm, self.process_queue)
+        self._job = self.mstr.after(self.tm, self.process_queue)
 
     def run_poller(self, flg_pse):
         if flg_pse:  # run task
             if self.flg_gph:
                 pass
-                # self.b_pause_g.configure(state=NORMAL)
-                # self.b_resume_g.configure(state=DISABLED)
-                # self.b_adj_plt.configure(state=DISABLED)
-                # self.b_savegr_g.configure(state=DISABLED)
-                # self.b_savetx_g.configure(state=DISABLED)
             else:
                 self.b_pause.configure(state=NORMAL)
                 self.b_resume.configure(state=DISABLED)
                 self.b_savetx.configure(state=DISABLED)
 
-            # self.queue = queue.Queue()
-            self.chk_tm = time()
+            self.worker.resume()
+        else:  # pause task, the worker finishes a poll in progress on its own and anything it returns is dropped
+            self.worker.pause()
+            if self._job is not None:
+                self.mstr.after_cancel(self._job)
+                self._job = None
 
-            ThreadedTask(self.queue, self.ip, self.dev, self.strt, self.lgth, self.dtype, self.bs, self.ws, self.pd,
-                         int((self.chk_tm - time()) * 1000) + self.pd - 50, self.prt, self.func).start()  #
-
-            # self.mstr.after(self.tm, self.process_queue)
-        else:  # pause task
-            self.queue.put((0, 'Paused'))
+            if self.flg_gph:
+                pass
+            else:
+                self.b_pause.configure(state=DISABLED)
+                self.b_resume.configure(state=NORMAL)
+                self.b_savetx.configure(state=NORMAL)
 
     def process_queue(self):
-        try:
-            msg = self.queue.get(block=False)
-            msg = msg[1]
-            # handle output ******************************************************************************************
-            if msg == 'Paused':
-                # print(msg)
-                if self._job is not None:
-                    self.mstr.after_cancel(self._job)
-                    self._job = None
-
-                if self.flg_gph:
-                    pass
-                    # self.b_pause_g.configure(state=DISABLED)
-                else:
-                    self.b_pause.configure(state=DISABLED)
-                self.mstr.update()
-
-                # kill thread here?
-                if threading.active_count() > 1:
-                    top = WaitSplash(self.mstr)
-                    # top.update()
-
-                    while threading.active_count() > 1:
-                        # print('thread running on pause')
-                        sleep(.05)
-                    else:
-                        top.destroy()
-
-                while not self.queue.empty():
-                    self.queue.get(block=False)
-
-                if self.flg_gph:
-                    # self.b_pause_g.configure(state=DISABLED)
-                    pass
-                    # self.b_resume_g.configure(state=NORMAL)
-                    # self.b_adj_plt.configure(state=NORMAL)
-                    # self.b_savegr_g.configure(state=NORMAL)
-                    # self.b_savetx_g.configure(state=NORMAL)
-                else:
-                    # self.b_pause.configure(state=DISABLED)
-                    self.b_resume.configure(state=NORMAL)
-                    self.b_savetx.configure(state=NORMAL)
-                return
+        # handles every poll finished since the last check, so polls faster than the check rate are not lost
+        for poll_tm, msg in self.worker.get_results():
+            self.totpolls += 1
+            if self.flg_gph:
+                pass
             else:
-                # print(time(), threading.active_count())
-                self.totpolls += 1
-                if self.flg_gph:
-                    pass
-                    # if msg[0] != 'Err':
-                    #     self.valpolls += 1
-                    #     self.l_errs_g.configure(text='Err: None')
-                    #     self.write_lbls(msg)
-                    # else:
-                    #     self.l_errs_g.configure(text='Err: ' + str(msg[1]))
-                    # self.l_tot_polls_g.configure(text='Total Polls: ' + str(self.totpolls))
-                    # self.l_val_polls_g.configure(text='Valid Polls: ' + str(self.valpolls))
+                if msg[0] != 'Err':
+                    self.valpolls += 1
+                    self.l_errs.configure(text='Err: None')
+                    self.write_lbls(msg, poll_tm)
                 else:
-                    if msg[0] != 'Err':
-                        self.valpolls += 1
-                        self.l_errs.configure(text='Err: None')
-                        self.write_lbls(msg)
-                    else:
-                        self.l_errs.configure(text='Err: ' + str(msg[1]))
-                    self.l_tot_polls.configure(text='Total Polls: ' + str(self.totpolls))
-                    self.l_val_polls.configure(text='Valid Polls: ' + str(self.valpolls))
-
-                # time.sleep(max(0, self.chk_tm + self.pd - time.time()))
-                # self.run_poller(True)
-                # self._job = self.mstr.after(max(0, int((self.chk_tm + self.pd - time()) * 1000)),
-                #                             lambda: self.run_poller(True))
-                self._job = self.mstr.after(max(0, int((self.chk_tm - time()) * 1000) + self.pd),
-                                            lambda: self.run_poller(self.wrt))
-                self.mstr.after(self.tm, self.process_queue)
-        except queue.Empty:
-            self.mstr.after(self.tm, self.process_queue)
+                    self.l_errs.configure(text='Err: ' + str(msg[1]))
+                self.l_tot_polls.configure(text='Total Polls: ' + str(self.totpolls))
+                self.l_val_polls.configure(text='Valid Polls: ' + str(self.valpolls))
+
+            if not self.wrt:  # writes are only sent once per resume
+                self.run_poller(False)
+                return
+
+        self._job = self.mstr.after(self.tm, self.process_queue)
+
+    def stop_poller(self):
+        if self._job is not None:
+            self.mstr.after_cancel(self._job)
+            self._job = None
+        if self.worker is not None:
+            self.worker.stop()  # closes its connection from its own thread once a poll in progress returns
+            self.worker = None
 
     def makeframe(self, flg_frm, ip, dev, strt=1, cnt=1, typ='float', bs=False, ws=False, pd=1000, prt=502, funct=3):
         self.totpolls = 0
@@ -635,7 +585,12 @@ class DisplayApp:
 
         self.otpt = [[] for _ in range(self.lgth + 1)]
 
-        self.queue = queue.PriorityQueue()
+        self.stop_poller()
+        client = ModbusClient(self.ip, self.prt, mb_timeout=self.pd)
+        self.worker = PollWorker(partial(client.request, self.dev, self.func, self.strt, self.lgth, self.dtype, self.bs,
+                                         self.ws), self.pd, on_close=client.close, b_single_shot=not self.wrt)
+        self.worker.pause()
+        self.worker.start()
 
         if flg_frm == 1:
             pass
@@ -673,7 +628,7 @@ class DisplayApp:
             self.text_frm.grid_remove()
 
         self.otpt = []
-        self.run_poller(False)
+        self.stop_poller()
 
     def mk_lbls(self, strt, cnt):
         if self.typ in two_byte_frmt_list:  # ('bin', 'hex', 'ascii', 'uint16', 'sint16'):
@@ -778,7 +733,7 @@ class DisplayApp:
         self.l_tot_polls.configure(text='Total Polls: 0')
         self.l_val_polls.configure(text='Valid Polls: 0')
 
-    def write_lbls(self, data):
+    def write_lbls(self, data, poll_tm):
         if len(self.text_lbls) == len(data):
             # handle data
             for i in range(len(self.text_lbls)):
@@ -792,7 +747,7 @@ class DisplayApp:
                 self.otpt[i].append(data[i])
 
             # self.otpt[-1].append(dates.date2num(datetime.now()))
-            self.otpt[-1].append(datetime.now())  # slim version of previous line
+            self.otpt[-1].append(datetime.fromtimestamp(poll_tm))  # slim version of previous line
 
             # if self.flg_gph:
             #     plls = len(self.otpt[0]) - 1
@@ -904,55 +859,6 @@ class DisplayApp:
         #         self.run_poller(False)
 
 
-class WaitSplash(Toplevel):
-    def __init__(self, mstr):
-        Toplevel.__init__(self, master=mstr)
-
-        Label(self, text='Please wait until background\nthreads are done running.', bg='white').grid(sticky=W+E+N+S)
-        self.columnconfigure(0, weight=1)
-        self.rowconfigure(0, weight=1)
-        rw = mstr.winfo_width()
-        rh = mstr.winfo_height()
-        rx = mstr.winfo_rootx()
-        ry = mstr.winfo_rooty()
-
-        w = rw / 5 * 4
-        h = rh / 5 * 4
-        x = rx + (rw - w) / 2
-        y = ry + (rh - h) / 2
-
-        self.configure(bg='white')
-        self.geometry('%dx%d+%d+%d' % (w, h, x, y))
-
-        self.overrideredirect(True)
-        self.update()
-
-
-class ThreadedTask(threading.Thread):
-    def __init__(self, queue_obj, ip, dev, strt, lgth, dtype, bs, ws, to, pd, prt, func):
-        self.ip = ip
-        self.dev = dev
-        self.strt = strt
-        self.lgth = lgth
-        self.dtype = dtype
-        self.bs = bs
-        self.ws = ws
-        self.prt = prt
-        self.func = func
-        self.timeout = to
-        self.pd = pd
-
-        threading.Thread.__init__(self)
-        self.queue = queue_obj
-
-    def run(self):
-        # run function overrides thread run method
-        otpt = modbus_poller(self.ip, self.dev, self.strt, self.lgth, data_type=self.dtype, b_byteswap=self.bs,
-                             b_wordswap=self.ws, mb_timeout=self.timeout, poll_delay=self.pd, port=self.prt,
-                             mb_func=self.func)
-        self.queue.put((1, otpt))
-
-
 # dtypes = {'Binary': 'bin', 'Hex': 'hex', 'ASCII': 'ascii', 'Unsigned Int 16': 'uint16', 'Signed Int 16': 'sint16',
 #           'Unsigned Int 32': 'uint32', 'Signed Int 32': 'sint32', 'Float': 'float', 'Mod1k': 'mod1k',
 #           'Mod10k': 'mod10k', 'Mod20k': 'mod20k', 'Unsigned Int 64': 'uint64', 'Mod30k': 'mod30k', 'Energy': 'engy',
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+from operator import add
+from collections import deque
+
+
+STAT_NAMES = ('first', 'last', 'min', 'max', 'mean', 'sum', 'count', 'errs')
+DEFAULT_STATS = ('min', 'max', 'mean', 'last')
+
+
+class PaneStats:
+    """Running first, last, min, max and sum of every value of one key over one pane, whatever the number of polls."""
+    __slots__ = ('start_ns', 'count', 'errs', 'firsts', 'lasts', 'mins', 'maxs', 'sums')
+
+    def __init__(self, start_ns):
+        self.start_ns = start_ns
+        self.count = 0  # good polls
+        self.errs = 0  # polls that returned an error
+        self.firsts = self.lasts = self.mins = self.maxs = self.sums = None
+
+    def update(self, values):
+        # one poll, every value at once, map runs the loop in c
+        if not self.count or len(values) != len(self.lasts):
+            self.firsts = list(values)
+            self.mins = list(values)
+            self.maxs = list(values)
+            self.sums = list(values)
+            self.count = 0
+        else:
+            self.mins = list(map(min, self.mins, values))
+            self.maxs = list(map(max, self.maxs, values))
+            self.sums = list(map(add, self.sums, values))
+        self.lasts = list(values)
+        self.count += 1
+
+    def merge(self, other):
+        # folds a later pane into this one
+        self.errs += other.errs
+        if not other.count:
+            return
+        if not self.count or len(other.lasts) != len(self.lasts):
+            self.firsts, self.mins, self.maxs, self.sums = other.firsts, other.mins, other.maxs, other.sums
+            self.count = 0
+        else:
+            self.mins = list(map(min, self.mins, other.mins))
+            self.maxs = list(map(max, self.maxs, other.maxs))
+            self.sums = list(map(add, self.sums, other.sums))
+        self.lasts = other.lasts
+        self.count += other.count
+
+    def get(self, stat):
+        if stat == 'count':
+            return self.count
+        elif stat == 'errs':
+            return self.errs
+        elif not self.count:
+            return None  # a pane of only errors has no values
+        elif stat == 'mean':
+            return [val_sum / self.count for val_sum in self.sums]
+        return getattr(self, stat + 's')
+
+
+class Window:
+    """A tumbling window, or a rolling one when it is split into several panes.
+
+    Panes are aligned to multiples of width / num_panes of the clock.  Each time a pane ends, the stats over the
+    last num_panes panes are put out, so Window(60000) gives one result per minute and Window(900000, num_panes=15)
+    gives the last 15 minutes once a minute.  Only num_panes running stats are ever kept per key.
+    """
+    def __init__(self, width, stats=DEFAULT_STATS, num_panes=1):
+        unknown_stats = set(stats) - set(STAT_NAMES)
+        if unknown_stats or not stats:
+            raise ValueError('Unknown stats: ' + ', '.join(sorted(unknown_stats)) + '. Use any of: ' +
+                             ', '.join(STAT_NAMES))
+        if width <= 0 or num_panes < 1:
+            raise ValueError('Window width and panes must be positive.')
+        self.width = width  # ms
+        self.stats = tuple(stats)
+        self.num_panes = int(num_panes)
+        self.pane_ns = int(width * 1e6) // self.num_panes
+
+    @classmethod
+    def from_spec(cls, spec):
+        # 'WIDTH[/PANES][:STAT,STAT,...]' such as '60000' or '900000/15:mean,max'
+        width_spec, sep, stats_spec = spec.partition(':')
+        width, sep, num_panes = width_spec.partition('/')
+        try:
+            return cls(float(width), stats_spec.split(',') if stats_spec else DEFAULT_STATS,
+                       int(num_panes) if num_panes else 1)
+        except (TypeError, ValueError) as err:
+            raise ValueError('Invalid window ' + repr(spec) + ': ' + str(err))
+
+    def get_name(self):
+        if self.num_panes == 1:
+            return str(int(self.width)) + 'ms'
+        return str(int(self.width)) + 'ms/' + str(self.num_panes)
+
+
+class _WindowState:
+    """The panes of one window for one key."""
+    __slots__ = ('window', 'panes', 'cur_pane')
+
+    def __init__(self, window, start_ns):
+        self.window = window
+        self.panes = deque(maxlen=window.num_panes - 1)  # closed panes still inside the rolling window
+        self.cur_pane = PaneStats(start_ns)
+
+    def advance(self, ts_ns, on_close):
+        # closes every pane that ended before ts_ns, calling on_close(end_ns, merged stats) for each that had polls
+        pane_ns = self.window.pane_ns
+        skipped = 0
+        while ts_ns >= self.cur_pane.start_ns + pane_ns:
+            end_ns = self.cur_pane.start_ns + pane_ns
+            merged = self.get_merged()
+            if merged.count or merged.errs:
+                on_close(end_ns, merged)
+            if self.panes.maxlen:
+                self.panes.append(self.cur_pane)
+            self.cur_pane = PaneStats(end_ns)
+            skipped += 1
+            if skipped > self.window.num_panes:
+                # a long gap, every pane is empty by now so jump straight to the one holding ts_ns
+                self.panes.clear()
+                self.cur_pane = PaneStats(ts_ns - ts_ns % pane_ns)
+                break
+
+    def get_merged(self):
+        merged = PaneStats(self.panes[0].start_ns if self.panes else self.cur_pane.start_ns)
+        for pane in self.panes:
+            merged.merge(pane)
+        merged.merge(self.cur_pane)
+        return merged
+
+
+class Aggregator:
+    """Stage between decoding and the sinks, turns every poll into per window stats and keeps the raw polls short.
+
+    add is called with each poll's values, or an error tuple, under a key such as the device or point name.
+    on_window(key, window, end_ns, stats) is called whenever a window closes, with stats as {stat: value list or
+    count}.  A window that only saw errors still closes, with count 0 and None for every value stat.
+    """
+    def __init__(self, windows, on_window=None, raw_size=0):
+        self.windows = [Window.from_spec(window) if isinstance(window, str) else window for window in windows]
+        self.on_window = on_window
+        self.raw_size = raw_size
+        self.raw = {}  # key: deque of the last raw_size (ts_ns, values)
+        self._states = {}  # key: [_WindowState per window]
+
+    def add(self, key, ts_ns, values):
+        states = self._states.get(key)
+        if states is None:
+            states = [_WindowState(window, ts_ns - ts_ns % window.pane_ns) for window in self.windows]
+            self._states[key] = states
+        b_err = bool(values) and values[0] == 'Err'
+        for state in states:
+            state.advance(ts_ns, lambda end_ns, merged, window=state.window: self._emit(key, window, end_ns, merged))
+            if b_err:
+                state.cur_pane.errs += 1
+            else:
+                state.cur_pane.update(values)
+
+        if self.raw_size:
+            raw_polls = self.raw.get(key)
+            if raw_polls is None:
+                raw_polls = deque(maxlen=self.raw_size)
+                self.raw[key] = raw_polls
+            raw_polls.append((ts_ns, values))
+
+    def _emit(self, key, window, end_ns, merged):
+        if self.on_window is not None:
+            self.on_window(key, window, end_ns, {stat: merged.get(stat) for stat in window.stats})
+
+    def get_current(self, key, window_index=0):
+        # stats of the window still open, {stat: value list or count}, None before the first poll
+        states = self._states.get(key)
+        if states is None:
+            return None
+        merged = states[window_index].get_merged()
+        if not merged.count:
+            return None
+        return {stat: merged.get(stat) for stat in states[window_index].window.stats}
+
+    def flush(self, ts_ns=None):
+        # puts out every open window, at the end of a run.  Rolling windows count the open pane as closed at ts_ns
+        for key, states in self._states.items():
+            for state in states:
+                merged = state.get_merged()
+                if merged.count or merged.errs:
+                    end_ns = state.cur_pane.start_ns + state.window.pane_ns if ts_ns is None else ts_ns
+                    self._emit(key, state.window, end_ns, merged)
+        self._states.clear()
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+
+import sys
+import csv
+import json
+import time
+import shlex
+try:
+    from mbpy import mb_poll  # folder.file import
+    from mbpy import mb_gateway
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+    import mb_gateway
+
+
+# everything a json job can hold, anything left out takes these values
+JOB_DEFAULTS = {'name': None, 'port': 502, 'transport': 'tcp', 'mb_func': 3, 'start_reg': 1, 'num_vals': 1,
+                'data_type': 'float', 'b_byteswap': False, 'b_wordswap': False, 'zero_based': False,
+                'b_raw_bytes': False, 'write_vals': None, 'write_reg': None}
+CSV_HEADER = ['job', 'name', 'ip', 'port', 'mb_id', 'mb_func', 'start_reg', 'ts', 'error', 'values...']
+
+
+def make_job(job):
+    # fills in defaults for a job dict, needs at least 'ip' and 'mb_id'
+    unknown_keys = set(job) - set(JOB_DEFAULTS) - {'ip', 'mb_id'}
+    if 'ip' not in job or 'mb_id' not in job or unknown_keys:
+        raise ValueError('Job needs ip and mb_id, unknown keys: ' + ', '.join(sorted(unknown_keys)))
+    full_job = dict(JOB_DEFAULTS)
+    full_job.update(job)
+    if full_job['data_type'] not in mb_poll.DATA_TYPE_LIST:
+        raise ValueError('Unknown type ' + repr(full_job['data_type']))
+    if full_job['transport'] not in mb_poll.NET_TRANSPORTS:
+        raise ValueError('Unknown transport ' + repr(full_job['transport']))
+    # the same checks mb_poll's command line gives a job line
+    try:
+        full_job['port'] = int(full_job['port'])
+        full_job['mb_id'] = mb_poll.device_bw(full_job['mb_id'])
+        full_job['mb_func'] = mb_poll.modbus_func_bw(full_job['mb_func'])
+        full_job['start_reg'] = mb_poll.register_bw(full_job['start_reg'])
+        full_job['num_vals'] = int(full_job['num_vals'])
+        if full_job['write_reg'] is not None:
+            full_job['write_reg'] = mb_poll.register_bw(full_job['write_reg'])
+        write_vals = full_job['write_vals']
+        if write_vals is not None:
+            if isinstance(write_vals, (list, tuple)):
+                if any(isinstance(val, bool) or not isinstance(val, (int, float, str)) for val in write_vals):
+                    raise ValueError('write_vals must be numbers')
+                write_vals = ','.join(str(val) for val in write_vals)
+            full_job['write_vals'] = mb_poll.write_vals_bw(write_vals)
+    except Exception as err:  # ValueError, TypeError or the argparse.ArgumentTypeError of the mb_poll checks
+        raise ValueError('Invalid job ' + str(job.get('name') or job.get('ip')) + ': ' + str(err))
+    return full_job
+
+
+def make_job_parser():
+    # parser for one job line, the same positional arguments and flags as mb_poll plus -tr and -n.  Bad lines raise
+    # ValueError instead of exiting
+    import argparse
+
+    class JobParser(argparse.ArgumentParser):
+        def error(self, message):
+            raise ValueError(message)
+
+    parser = JobParser(prog='job', add_help=False)
+    parser.add_argument('ip', type=str)
+    parser.add_argument('dev', type=mb_poll.device_bw)
+    parser.add_argument('srt', type=mb_poll.register_bw)
+    parser.add_argument('lng', type=int)
+    parser.add_argument('-t', '--typ', type=str, default='float', choices=mb_poll.DATA_TYPE_LIST)
+    parser.add_argument('-bs', '--byteswap', action='store_true')
+    parser.add_argument('-ws', '--wordswap', action='store_true')
+    parser.add_argument('-0', '--zbased', action='store_true')
+    parser.add_argument('-pt', '--port', type=int, default=502)
+    parser.add_argument('-tr', '--transport', type=str, default='tcp', choices=mb_poll.NET_TRANSPORTS)
+    parser.add_argument('-f', '--func', type=mb_poll.modbus_func_bw, default=3)
+    parser.add_argument('-rb', '--raw_bytes', action='store_true')
+    parser.add_argument('-wr', '--wrt_reg', type=mb_poll.register_bw, default=None)
+    parser.add_argument('-wv', '--wrt_vals', type=mb_poll.write_vals_bw, default=None)
+    parser.add_argument('-n', '--name', type=str, default=None)
+    return parser
+
+
+def parse_job_line(job_parser, line):
+    args = job_parser.parse_args(shlex.split(line))
+    return make_job({'name': args.name, 'ip': args.ip, 'port': args.port, 'transport': args.transport,
+                     'mb_id': args.dev, 'mb_func': args.func, 'start_reg': args.srt, 'num_vals': args.lng,
+                     'data_type': args.typ, 'b_byteswap': args.byteswap, 'b_wordswap': args.wordswap,
+                     'zero_based': args.zbased, 'b_raw_bytes': args.raw_bytes, 'write_vals': args.wrt_vals,
+                     'write_reg': args.wrt_reg})
+
+
+def parse_jobs(text):
+    # a json list of job objects, or one job per line as either a json object or mb_poll arguments
+    # ('10.0.0.5 1 100 4 -t uint16').  Blank lines and lines starting with # are skipped.  Raises ValueError naming
+    # the line of the first bad job.
+    if text.lstrip().startswith('['):
+        try:
+            return [make_job(job) for job in json.loads(text)]
+        except (TypeError, AttributeError) as err:
+            raise ValueError('Jobs must be objects: ' + str(err))
+
+    job_parser = None
+    jobs = []
+    for line_iter, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            if line.startswith('{'):
+                jobs.append(make_job(json.loads(line)))
+            else:
+                if job_parser is None:
+                    job_parser = make_job_parser()
+                jobs.append(parse_job_line(job_parser, line))
+        except ValueError as err:
+            raise ValueError('line ' + str(line_iter) + ': ' + str(err))
+    return jobs
+
+
+def get_error(otpt):
+    # (number, text) of an error tuple, None for values
+    if otpt is None:
+        return 114, 'UNKNOWN ERROR'
+    if otpt and otpt[0] == 'Err':
+        return otpt[1], otpt[2]
+    return None
+
+
+def run_jobs(jobs, gateway_pool):
+    # yields (index in jobs, job, output) as each job finishes.  Jobs on one endpoint share its connections and run
+    # as the gateway's policy allows, different endpoints run at the same time
+    requests = [{'ip': job['ip'], 'port': job['port'], 'transport': job['transport'], 'mb_id': job['mb_id'],
+                 'mb_func': job['mb_func'], 'start_reg': job['start_reg'], 'num_vals': job['num_vals'],
+                 'data_type': job['data_type'], 'b_byteswap': job['b_byteswap'], 'b_wordswap': job['b_wordswap'],
+                 'zero_based': job['zero_based'], 'b_raw_bytes': job['b_raw_bytes'], 'write_vals': job['write_vals'],
+                 'write_reg': job['write_reg']} for job in jobs]
+    for job_iter, otpt in gateway_pool.run_unordered(requests):
+        yield job_iter, jobs[job_iter], otpt
+
+
+class JsonLinesWriter:
+    """One json object per finished job."""
+    def __init__(self, out_file):
+        self.out_file = out_file
+
+    def write(self, job_iter, job, otpt, ts_ns):
+        error = get_error(otpt)
+        self.out_file.write(json.dumps({
+            'job': job_iter, 'name': job['name'], 'ip': job['ip'], 'port': job['port'], 'mb_id': job['mb_id'],
+            'mb_func': job['mb_func'], 'start_reg': job['start_reg'], 'ts': ts_ns,
+            'values': None if error is not None else otpt, 'error': None if error is None else list(error)}) + '\n')
+        self.out_file.flush()
+
+
+class CsvWriter:
+    """One row per finished job, the values take the columns after the header's last one."""
+    def __init__(self, out_file):
+        self.out_file = out_file
+        self.csv_wrtr = csv.writer(out_file)
+        self.csv_wrtr.writerow(CSV_HEADER)
+
+    def write(self, job_iter, job, otpt, ts_ns):
+        error = get_error(otpt)
+        row = [job_iter, job['name'] or '', job['ip'], job['port'], job['mb_id'], job['mb_func'], job['start_reg'],
+               ts_ns, '' if error is None else error[0]]
+        self.csv_wrtr.writerow(row + (list(otpt) if error is None else [error[1]]))
+        self.out_file.flush()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Runs many queries in one process, reusing a connection per '
+                                                 'endpoint and querying different endpoints at the same time.')
+    parser.add_argument('jobs', type=str, nargs='?', default='-',
+                        help='Job file, or - for stdin (default). A json list of jobs, or one job per line as mb_poll '
+                             'arguments (IP DEV SRT LNG [-t -bs -ws -0 -pt -tr -f -rb -wr -wv -n NAME]) or a json '
+                             'object.')
+    parser.add_argument('-fmt', '--format', type=str, default='jsonl', choices=('jsonl', 'csv'),
+                        help='Result format, one line per job in the order jobs finish. Default is jsonl.')
+    parser.add_argument('-fl', '--file', type=str, default=None, help='Writes results to this file instead of stdout.')
+    parser.add_argument('-to', '--timeout', type=mb_poll.timeout_bw, default=1500,
+                        help='Time in milliseconds to wait for reply message. Default is 1500.')
+    parser.add_argument('-o', '--policies', type=str, default=None,
+                        help='Json gateway policy file from python -m mbpy.mb_gateway, default is one request at a '
+                             'time per endpoint.')
+    args = parser.parse_args(argv)
+
+    if args.jobs == '-':
+        jobs_text = sys.stdin.read()
+    else:
+        with open(args.jobs, 'r') as jobs_file:
+            jobs_text = jobs_file.read()
+    try:
+        jobs = parse_jobs(jobs_text)
+    except ValueError as err:
+        parser.error(str(err))
+
+    policies = mb_gateway.load_policies(args.policies) if args.policies is not None else None
+    out_file = open(args.file, 'w', newline='') if args.file is not None else sys.stdout
+    try:
+        writer = CsvWriter(out_file) if args.format == 'csv' else JsonLinesWriter(out_file)
+        num_errs = 0
+        with mb_gateway.GatewayPool(policies, mb_timeout=args.timeout) as gateway_pool:
+            for job_iter, job, otpt in run_jobs(jobs, gateway_pool):
+                writer.write(job_iter, job, otpt, time.time_ns())
+                num_errs += get_error(otpt) is not None
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
+    if num_errs:
+        print(num_errs, 'of', len(jobs), 'jobs failed', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
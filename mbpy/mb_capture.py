@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+
+import os
+import mmap
+import time
+import threading
+from struct import Struct
+try:
+    from mbpy import mb_poll  # folder.file import
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+
+
+# layout of a capture file:  header | records
+#   header: magic, layout version
+#   record: kind, transport, endpoint id, time in ns, length of the payload, then the payload.  Endpoint records
+#           (kind 0) carry the name that later frames of that id were sent to, frames carry the bytes on the wire.
+# files are only ever appended to, a record cut short by a crash is ignored on reading
+CAPTURE_MAGIC = b'MBFC'
+CAPTURE_VERSION = 1
+HEADER_STRUCT = Struct('<4sI')
+RECORD_STRUCT = Struct('<BBHqH')
+
+KIND_ENDPOINT = 0
+DIR_TX = 1  # request sent to the device
+DIR_RX = 2  # reply from the device, empty if nothing came back before the timeout
+TRANSPORTS = ('tcp', 'rtu', 'rtu_tcp', 'udp')  # stored as the index
+RTU_TRANSPORTS = ('rtu', 'rtu_tcp')  # frames with an address in front and a crc at the end instead of an MBAP header
+
+
+class FrameCapture:
+    """Append only log of every request and reply frame, shared by any number of clients and threads."""
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = open(file_name, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(HEADER_STRUCT.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+        self._endpoint_ids = {}  # name: id, ids start over in every session appended to the file
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, direction, transport, endpoint, frame, ts_ns=None):
+        if ts_ns is None:
+            ts_ns = time.time_ns()
+        transport_id = TRANSPORTS.index(transport)
+        endpoint = str(endpoint)  # com ports are numbers on windows
+        with self._lock:
+            endpoint_id = self._endpoint_ids.get(endpoint)
+            if endpoint_id is None:
+                endpoint_id = len(self._endpoint_ids)
+                self._endpoint_ids[endpoint] = endpoint_id
+                endpoint_bytes = endpoint.encode('utf-8')
+                self._file.write(RECORD_STRUCT.pack(KIND_ENDPOINT, transport_id, endpoint_id, ts_ns,
+                                                    len(endpoint_bytes)))
+                self._file.write(endpoint_bytes)
+            self._file.write(RECORD_STRUCT.pack(direction, transport_id, endpoint_id, ts_ns, len(frame)))
+            self._file.write(frame)
+
+    def record_request(self, transport, endpoint, frame):
+        self.record(DIR_TX, transport, endpoint, frame)
+
+    def record_reply(self, transport, endpoint, frame):
+        self.record(DIR_RX, transport, endpoint, frame)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_frames(file_name):
+    # yields (ts_ns, direction, transport, endpoint, frame) for every frame in the file, in the order captured
+    with open(file_name, 'rb') as capture_file:
+        if os.fstat(capture_file.fileno()).st_size < HEADER_STRUCT.size:
+            return
+        with mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ) as capture_map:
+            magic, version = HEADER_STRUCT.unpack_from(capture_map, 0)
+            if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+                raise ValueError(file_name + ' is not a capture file this version can read.')
+
+            endpoints = {}
+            file_size = len(capture_map)
+            offset = HEADER_STRUCT.size
+            while offset + RECORD_STRUCT.size <= file_size:
+                kind, transport_id, endpoint_id, ts_ns, payload_len = RECORD_STRUCT.unpack_from(capture_map, offset)
+                offset += RECORD_STRUCT.size
+                if offset + payload_len > file_size:
+                    break  # last record was cut short
+                payload = capture_map[offset:offset + payload_len]
+                offset += payload_len
+
+                if kind == KIND_ENDPOINT:
+                    endpoints[endpoint_id] = payload.decode('utf-8', 'ignore')
+                else:
+                    yield ts_ns, kind, TRANSPORTS[transport_id], endpoints.get(endpoint_id, ''), payload
+
+
+def parse_request(transport, frame):
+    # (trans_id, mb_id, mb_func, start_reg_zero, num_regs, val_to_write, packet_write_list) of a request frame
+    if transport in RTU_TRANSPORTS:
+        trans_id = None
+        body = frame[:-2]
+    else:
+        trans_id = int.from_bytes(frame[:2], byteorder='big')
+        body = frame[6:]
+    mb_id, mb_func = body[0], body[1]
+    start_reg_zero = int.from_bytes(body[2:4], byteorder='big')
+    quantity = int.from_bytes(body[4:6], byteorder='big')
+
+    if mb_func == 5:
+        return trans_id, mb_id, mb_func, start_reg_zero, 1, int(quantity == 0xFF00), list(body[:6])
+    elif mb_func == 6:
+        return trans_id, mb_id, mb_func, start_reg_zero, 1, quantity, list(body[:6])
+    elif mb_func == 16:
+        return trans_id, mb_id, mb_func, start_reg_zero, quantity, None, list(body[:6])
+    return trans_id, mb_id, mb_func, start_reg_zero, quantity, None, None
+
+
+def get_num_vals(mb_func, num_regs, data_type):
+    # inverse of get_expected_num_ret_bytes for a read of num_regs registers
+    if mb_func in (1, 2):
+        return num_regs
+    elif data_type in mb_poll.ONE_BYTE_FORMATS:
+        return num_regs * 2
+    elif data_type in mb_poll.FOUR_BYTE_FORMATS:
+        return num_regs // 2
+    elif data_type in mb_poll.SIX_BYTE_FORMATS:
+        return num_regs // 3
+    elif data_type in mb_poll.EIGHT_BYTE_FORMATS:
+        return num_regs // 4
+    return num_regs
+
+
+def replay(file_name, data_type='float', b_byteswap=False, b_wordswap=False, b_raw_bytes=False, endpoint=None,
+           mb_id=None, mb_func=None):
+    # pairs every reply with its request and runs it through the same checks and decoder as a live poll, yields
+    # (ts_ns, endpoint, mb_id, mb_func, start_reg_zero, otpt) where otpt is a value list or an error tuple
+    data_type, error_code = mb_poll.validate_data_type(data_type)
+    if error_code is not None:
+        raise ValueError('Invalid data type ' + str(data_type))
+    pending = {}  # (endpoint, trans_id): parsed request waiting for its reply
+    mb_datas = {}  # (mb_func, start_reg_zero, num_regs): ModbusData, reused for every reply to the same request
+
+    for ts_ns, direction, transport, frame_endpoint, frame in read_frames(file_name):
+        if endpoint is not None and frame_endpoint != endpoint:
+            continue
+        b_rtu = transport in RTU_TRANSPORTS
+
+        if direction == DIR_TX:
+            try:
+                request = parse_request(transport, frame)
+            except IndexError:
+                continue  # too short to be a request
+            pending[(frame_endpoint, request[0])] = request
+            continue
+
+        if b_rtu:
+            request = pending.pop((frame_endpoint, None), None)
+        elif len(frame) >= 2:
+            request = pending.pop((frame_endpoint, int.from_bytes(frame[:2], byteorder='big')), None)
+        else:  # timed out, the reply belongs to the newest request to this endpoint
+            request = None
+            for pending_key in reversed(list(pending)):
+                if pending_key[0] == frame_endpoint:
+                    request = pending.pop(pending_key)
+                    break
+        if request is None:
+            continue  # capture started between a request and its reply
+
+        trans_id, req_mb_id, req_mb_func, start_reg_zero, num_regs, val_to_write, packet_write_list = request
+        if (mb_id is not None and req_mb_id != mb_id) or (mb_func is not None and req_mb_func != mb_func):
+            continue
+
+        if not frame:
+            yield ts_ns, frame_endpoint, req_mb_id, req_mb_func, start_reg_zero, mb_poll.MB_ERR_DICT[87]
+            continue
+        error_code, recv_packet = mb_poll.verify_no_comm_errs('rtu' if b_rtu else None, frame, None, 0)
+        if error_code is not None:
+            yield ts_ns, frame_endpoint, req_mb_id, req_mb_func, start_reg_zero, error_code
+            continue
+
+        b_write_mb = req_mb_func in (5, 6, 16)
+        error_code, register_list = mb_poll.verify_no_modbus_errs(recv_packet, req_mb_id, req_mb_func, val_to_write,
+                                                                  b_write_mb, packet_write_list)
+        if error_code is not None:
+            otpt = error_code
+        elif req_mb_func == 16:
+            otpt = [start_reg_zero, num_regs]  # the reply only echoes what was written
+        else:
+            mb_data = mb_datas.get((req_mb_func, start_reg_zero, num_regs))
+            if mb_data is None:
+                mb_data = mb_poll.ModbusData(start_reg_zero + 1, get_num_vals(req_mb_func, num_regs, data_type),
+                                             b_byteswap, b_wordswap, None, data_type, req_mb_func,
+                                             b_raw_bytes=b_raw_bytes)
+                mb_datas[(req_mb_func, start_reg_zero, num_regs)] = mb_data
+            mb_data.translate_regs_to_vals(register_list)
+            otpt = mb_data.get_value_array()
+        yield ts_ns, frame_endpoint, req_mb_id, req_mb_func, start_reg_zero, otpt
+
+
+def main(argv=None):
+    import argparse
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description='Decodes the frames of a capture file again, without the devices.')
+    parser.add_argument('capture', type=str, help='Capture file written by --capture.')
+    parser.add_argument('-t', '--typ', type=str, default='float', choices=mb_poll.DATA_TYPE_LIST,
+                        help='The desired type to be returned. Default is float.')
+    parser.add_argument('-bs', '--byteswap', action='store_true', help='Sets byteswap to true.  Default is Big Endian.')
+    parser.add_argument('-ws', '--wordswap', action='store_true',
+                        help='Sets wordswap to true.  Default is Little Endian.')
+    parser.add_argument('-rb', '--raw_bytes', action='store_true',
+                        help='Returns bytes after accounting for word and byte swaps.')
+    parser.add_argument('-e', '--endpoint', type=str, default=None,
+                        help='Only frames to this ip:port or com port. Default is every endpoint.')
+    parser.add_argument('-d', '--dev', type=int, default=None, help='Only this device id. Default is every device.')
+    parser.add_argument('-f', '--func', type=int, default=None, help='Only this function. Default is every function.')
+    parser.add_argument('--frames', action='store_true', help='Print the raw frames instead of decoding them.')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print the number of replies per second.')
+    args = parser.parse_args(argv)
+
+    start_time = time.perf_counter()
+    num_replies = 0
+    if args.frames:
+        for ts_ns, direction, transport, endpoint, frame in read_frames(args.capture):
+            num_replies += 1
+            if not args.quiet:
+                print(datetime.fromtimestamp(ts_ns / 1e9), 'tx' if direction == DIR_TX else 'rx', transport,
+                      endpoint, frame.hex(' '))
+    else:
+        for ts_ns, endpoint, mb_id, mb_func, start_reg_zero, otpt in replay(
+                args.capture, args.typ, args.byteswap, args.wordswap, args.raw_bytes, args.endpoint, args.dev,
+                args.func):
+            num_replies += 1
+            if not args.quiet:
+                print(datetime.fromtimestamp(ts_ns / 1e9), endpoint, 'dev', mb_id, 'func', mb_func, 'start',
+                      start_reg_zero, ':', otpt)
+    run_time = time.perf_counter() - start_time
+    if args.quiet:
+        print(num_replies, 'frames' if args.frames else 'replies', 'in', round(run_time, 3), 's,',
+              round(num_replies / max(run_time, 1e-9)), 'per second')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,483 @@
+#!/usr/bin/python3
+
+import time
+import select
+import socket
+try:
+    from mbpy import mb_poll  # folder.file import
+    from mbpy import mb_result
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+    import mb_result
+
+
+class ModbusClient:
+    """Keeps one connection to a gateway or com port open across many requests."""
+    def __init__(self, ip, port=502, mb_timeout=1500, pi_pin_cntl=None, baudrate=9600, capture=None, transport='tcp',
+                 retries=2):
+        self.ip, self.serial_port, self._init_err = mb_poll.validate_ip(ip)
+        self.port = int(port)
+        self.mb_timeout = mb_timeout / 1000  # convert from ms to s
+        self.pi_pin_cntl = pi_pin_cntl
+        self.baudrate = baudrate
+        self.capture = capture  # mb_capture.FrameCapture that every request and reply is written to
+        self.endpoint = self.serial_port if self.serial_port is not None else str(self.ip) + ':' + str(self.port)
+        self.retries = retries  # extra sends after a udp timeout
+        if self.serial_port is not None:
+            self.transport = 'rtu'
+        elif transport in mb_poll.NET_TRANSPORTS:
+            self.transport = transport
+        else:
+            self.transport = None
+            self._init_err = mb_poll.MB_ERR_DICT[117]
+        # the rtu packet and crc code only checks whether there is a port, so rtu over tcp passes the endpoint in its
+        # place to get rtu framing
+        self._rtu_port = self.endpoint if self.transport in ('rtu', 'rtu_tcp') else None
+
+        self._tcp_conn = None
+        self._serial_conn = None
+        self._trans_id = 0
+        self._templates = {}  # (mb_id, mb_func, start_reg_zero, num_regs, val_to_write): RequestTemplate
+        self._pending_writes = {}  # mb_id: [(wrt_start_reg_zero, wrt_regs), ...]
+        self._no_fc23_ids = set()  # devices that answered function 23 with ILLEGAL FUNCTION
+        self._last_frame = None  # reply frame of the latest request, before decoding swaps its bytes
+        self._bit_datas = {}  # (mb_id, mb_func, start_reg_zero, num_bits): ModbusData, remembers the last read
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def is_connected(self):
+        return self._tcp_conn is not None or self._serial_conn is not None
+
+    def connect(self):
+        if self._init_err is not None:
+            return self._init_err
+        if self.is_connected():
+            return None
+
+        if self.serial_port is not None:  # COM port
+            self._serial_conn, error_code = mb_poll.open_serial_port(self.serial_port, self.mb_timeout,
+                                                                     self.pi_pin_cntl, self.baudrate)
+            return error_code
+
+        try:
+            if self.transport == 'udp':
+                self._tcp_conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._tcp_conn.connect((self.ip, self.port))  # only accept datagrams from the device
+            else:
+                self._tcp_conn = socket.create_connection((self.ip, self.port), timeout=self.mb_timeout)
+        except (socket.timeout, socket.error):
+            if self._tcp_conn is not None:
+                self._tcp_conn.close()
+            self._tcp_conn = None
+            return mb_poll.MB_ERR_DICT[19]
+        self._tcp_conn.setblocking(0)
+        return None
+
+    def close(self):
+        if self._tcp_conn is not None:
+            self._tcp_conn.close()
+            self._tcp_conn = None
+        if self._serial_conn is not None:
+            self._serial_conn.close()
+            self._serial_conn = None
+
+    def _recv_tcp(self):
+        # reads until the full MBAP frame for the current transaction has arrived
+        recv_packet_bytearr = bytearray()
+        end_time = time.time() + self.mb_timeout
+
+        while True:
+            time_left = end_time - time.time()
+            if time_left <= 0 or not select.select([self._tcp_conn], [], [], time_left)[0]:
+                return None, mb_poll.MB_ERR_DICT[87]  # timed out
+
+            try:
+                recv_chunk = self._tcp_conn.recv(1024)
+            except socket.error:
+                self.close()
+                return None, mb_poll.MB_ERR_DICT[87]
+            if not recv_chunk:
+                self.close()
+                return None, mb_poll.MB_ERR_DICT[106]  # socket closed by other
+            recv_packet_bytearr.extend(recv_chunk)
+
+            while len(recv_packet_bytearr) >= 6:
+                frame_len = 6 + int.from_bytes(recv_packet_bytearr[4:6], byteorder='big')
+                if len(recv_packet_bytearr) < frame_len:
+                    break
+                if int.from_bytes(recv_packet_bytearr[:2], byteorder='big') == self._trans_id:
+                    # a view instead of a copy, the buffer is new on every call so it stays valid
+                    return memoryview(recv_packet_bytearr)[:frame_len], None
+                del recv_packet_bytearr[:frame_len]  # stale reply to an earlier request that timed out
+
+    def _recv_rtu_tcp(self, exp_num_bytes_ret):
+        # reads one rtu frame from the stream, exception replies are 5 bytes long instead of exp_num_bytes_ret
+        recv_packet_bytearr = bytearray()
+        end_time = time.time() + self.mb_timeout
+
+        while True:
+            if len(recv_packet_bytearr) >= 5:
+                frame_len = 5 if recv_packet_bytearr[1] & 0x80 else exp_num_bytes_ret
+                if len(recv_packet_bytearr) >= frame_len:
+                    return bytes(recv_packet_bytearr[:frame_len]), None
+
+            time_left = end_time - time.time()
+            if time_left <= 0 or not select.select([self._tcp_conn], [], [], time_left)[0]:
+                return bytes(recv_packet_bytearr), mb_poll.MB_ERR_DICT[87]  # timed out
+
+            try:
+                recv_chunk = self._tcp_conn.recv(1024)
+            except socket.error:
+                self.close()
+                return None, mb_poll.MB_ERR_DICT[87]
+            if not recv_chunk:
+                self.close()
+                return None, mb_poll.MB_ERR_DICT[106]  # socket closed by other
+            recv_packet_bytearr.extend(recv_chunk)
+
+    def _drain(self):
+        # throws away anything left over from a request that timed out, rtu frames carry no id to tell them apart
+        try:
+            while select.select([self._tcp_conn], [], [], 0)[0]:
+                if not self._tcp_conn.recv(1024):
+                    break
+        except socket.error:
+            pass
+
+    def _transact_udp(self, req_template):
+        # every datagram is a whole frame, a request is sent again if no reply with its transaction id comes back
+        for send_iter in range(self.retries + 1):
+            try:
+                self._tcp_conn.send(req_template.get_packet(self._trans_id))
+            except socket.error:
+                self.close()
+                return None, mb_poll.MB_ERR_DICT[106]
+            if self.capture is not None:
+                self.capture.record_request('udp', self.endpoint, req_template.get_packet())
+
+            end_time = time.time() + self.mb_timeout
+            while True:
+                time_left = end_time - time.time()
+                if time_left <= 0 or not select.select([self._tcp_conn], [], [], time_left)[0]:
+                    break  # lost, try again
+                try:
+                    recv_packet_bytearr = self._tcp_conn.recv(1024)
+                except socket.error:
+                    break  # icmp port unreachable shows up here
+                # replies to an earlier send of the same request are as good as the reply to this one
+                if int.from_bytes(recv_packet_bytearr[:2], byteorder='big') == self._trans_id:
+                    return recv_packet_bytearr, None
+        return None, mb_poll.MB_ERR_DICT[87]
+
+    def get_template(self, b_write_mb, mb_id, mb_func, start_reg_zero, val_to_write, num_regs, exp_num_bytes_ret,
+                     wrt_start_reg_zero=None, wrt_regs=None):
+        # reads and single writes are compiled once and reused, multiple register writes carry new data every time
+        if wrt_regs is not None:
+            return mb_poll.RequestTemplate(self._rtu_port, b_write_mb, mb_id, mb_func, start_reg_zero, val_to_write,
+                                           num_regs, exp_num_bytes_ret, wrt_start_reg_zero, wrt_regs)
+
+        template_key = (mb_id, mb_func, start_reg_zero, num_regs, val_to_write)
+        req_template = self._templates.get(template_key)
+        if req_template is None:
+            if len(self._templates) >= 1024:
+                self._templates.clear()  # keep a client that wanders over many ranges from growing forever
+            req_template = mb_poll.RequestTemplate(self._rtu_port, b_write_mb, mb_id, mb_func, start_reg_zero,
+                                                   val_to_write, num_regs, exp_num_bytes_ret)
+            self._templates[template_key] = req_template
+        return req_template
+
+    def _transact(self, req_template):
+        self._last_frame = None
+        error_code = self.connect()
+        if error_code is not None:
+            return error_code, None
+
+        if self.serial_port is not None:  # COM port
+            mb_poll.set_rpi_pin_tx(self.pi_pin_cntl)
+            self._serial_conn.reset_input_buffer()
+            self._serial_conn.write(req_template.get_packet())
+            mb_poll.set_rpi_pin_rx(self.pi_pin_cntl)
+            if self.capture is not None:
+                self.capture.record_request('rtu', self.endpoint, req_template.get_packet())
+
+            # blocks for mb_timeout seconds
+            recv_packet_bytearr = self._serial_conn.read(req_template.exp_num_bytes_ret)
+            mb_poll.set_rpi_pin_tx(self.pi_pin_cntl)
+            if self.capture is not None:
+                self.capture.record_reply('rtu', self.endpoint, recv_packet_bytearr)
+        elif self.transport == 'rtu_tcp':
+            self._drain()
+            try:
+                self._tcp_conn.sendall(req_template.get_packet())
+            except socket.error:
+                self.close()
+                return mb_poll.MB_ERR_DICT[106], None
+            if self.capture is not None:
+                self.capture.record_request('rtu_tcp', self.endpoint, req_template.get_packet())
+
+            recv_packet_bytearr, error_code = self._recv_rtu_tcp(req_template.exp_num_bytes_ret)
+            if self.capture is not None:
+                self.capture.record_reply('rtu_tcp', self.endpoint, recv_packet_bytearr or b'')
+            if error_code is not None:
+                return error_code, None
+        elif self.transport == 'udp':
+            self._trans_id = (self._trans_id + 1) & 0xFFFF
+            recv_packet_bytearr, error_code = self._transact_udp(req_template)
+            if self.capture is not None:
+                self.capture.record_reply('udp', self.endpoint, recv_packet_bytearr or b'')
+            if error_code is not None:
+                return error_code, None
+        else:
+            self._trans_id = (self._trans_id + 1) & 0xFFFF
+            try:
+                self._tcp_conn.sendall(req_template.get_packet(self._trans_id))
+            except socket.error:
+                self.close()
+                return mb_poll.MB_ERR_DICT[106], None
+            if self.capture is not None:
+                self.capture.record_request('tcp', self.endpoint, req_template.get_packet())
+
+            recv_packet_bytearr, error_code = self._recv_tcp()
+            if self.capture is not None:
+                self.capture.record_reply('tcp', self.endpoint, recv_packet_bytearr or b'')
+            if error_code is not None:
+                return error_code, None
+
+        self._last_frame = recv_packet_bytearr
+        return mb_poll.verify_no_comm_errs(self._rtu_port, recv_packet_bytearr, None, 0)
+
+    def request(self, mb_id, mb_func, start_reg, num_vals, data_type='float', b_byteswap=False, b_wordswap=False,
+                zero_based=False, write_vals=None, write_reg=None, b_raw_bytes=False, wrt_regs=None):
+        # same arguments and return values as modbus_poller, but only a single poll over the open connection.
+        # wrt_regs can be given in place of write_vals when the registers have already been encoded
+        mb_id, error_code = mb_poll.validate_device_id(mb_id)
+        if error_code is not None:
+            return error_code
+        mb_func, error_code = mb_poll.validate_modbus_function(mb_func)
+        if error_code is not None:
+            return error_code
+        data_type, error_code = mb_poll.validate_data_type(data_type)
+        if error_code is not None:
+            return error_code
+        start_reg, error_code = mb_poll.validate_register(start_reg)
+        if error_code is not None:
+            return error_code
+
+        start_reg_zero = start_reg - (not zero_based)
+        if start_reg_zero < 0:
+            return mb_poll.MB_ERR_DICT[103]
+
+        val_to_write = None
+        wrt_start_reg_zero = None
+        if mb_func in (5, 6):
+            b_write_mb = True
+            val_to_write, error_code = mb_poll.validate_write_value(num_vals)
+            if error_code is not None:
+                return error_code
+            if mb_func == 5 and val_to_write not in (0, 1):
+                return mb_poll.MB_ERR_DICT[3]  # coils are either on or off
+            exp_num_bytes_ret, num_regs = 8, 1
+        else:
+            b_write_mb = mb_func == 16
+            if mb_func in (16, 23):
+                if write_vals is None and wrt_regs is None:
+                    return mb_poll.MB_ERR_DICT[3]
+                if mb_func == 16:
+                    write_reg = start_reg
+                elif write_reg is None:
+                    return mb_poll.MB_ERR_DICT[3]
+                wrt_start_reg_zero = write_reg - (not zero_based)
+                if wrt_start_reg_zero < 0:
+                    return mb_poll.MB_ERR_DICT[103]
+
+                if wrt_regs is None:
+                    wrt_regs, error_code = mb_poll.translate_vals_to_regs(write_vals, data_type, b_byteswap,
+                                                                          b_wordswap)
+                    if error_code is not None:
+                        return error_code
+                if len(wrt_regs) < 1 or len(wrt_regs) > (123 if mb_func == 16 else 121):
+                    return mb_poll.MB_ERR_DICT[3]
+
+            if mb_func == 16:
+                exp_num_bytes_ret, num_regs = 8, len(wrt_regs)
+            else:
+                num_vals, error_code = mb_poll.validate_num_registers(num_vals)
+                if error_code is not None:
+                    return error_code
+                exp_num_bytes_ret, num_regs = mb_poll.get_expected_num_ret_bytes(False, mb_func, num_vals, data_type)
+                if num_regs > (125 if mb_func in (3, 4, 23) else 2000):
+                    return mb_poll.MB_ERR_DICT[3]
+
+        req_template = self.get_template(b_write_mb, mb_id, mb_func, start_reg_zero, val_to_write, num_regs,
+                                         exp_num_bytes_ret, wrt_start_reg_zero, wrt_regs)
+
+        error_code, recv_packet = self._transact(req_template)
+        if error_code is not None:
+            return error_code
+
+        error_code, register_list = mb_poll.verify_no_modbus_errs(recv_packet, mb_id, mb_func, val_to_write,
+                                                                  b_write_mb, req_template.packet_write_list)
+        if error_code is not None:
+            return error_code
+        if mb_func == 16:
+            return wrt_regs
+
+        mb_data = mb_poll.ModbusData(start_reg, num_vals, b_byteswap, b_wordswap, None, data_type, mb_func,
+                                     b_raw_bytes=b_raw_bytes)
+        mb_data.translate_regs_to_vals(register_list)
+        return mb_data.get_value_array()
+
+    def poll(self, mb_id, mb_func, start_reg, num_vals, data_type='float', b_byteswap=False, b_wordswap=False,
+             zero_based=False, b_raw_bytes=False):
+        # request as a mb_result.PollResult, with the send and reply times and a view of the reply's data bytes
+        send_ns = time.time_ns()
+        otpt = self.request(mb_id, mb_func, start_reg, num_vals, data_type, b_byteswap, b_wordswap, zero_based,
+                            b_raw_bytes=b_raw_bytes)
+        recv_ns = time.time_ns()
+        raw = b''
+        if self._last_frame is not None and otpt and otpt[0] != 'Err' and mb_func in (1, 2, 3, 4):
+            frame_view = memoryview(self._last_frame)
+            # skip the MBAP header or address, function and byte count, and the crc of rtu frames
+            raw = frame_view[3:-2] if self._rtu_port is not None else frame_view[9:]
+        return mb_result.PollResult.from_otpt(mb_id, mb_func, start_reg, otpt, send_ns, recv_ns, raw)
+
+    def read_raw(self, mb_id, mb_func, start_reg_zero, num_regs):
+        # block read for precompiled plans, returns the data bytes of the reply for the caller to decode
+        if mb_func in (1, 2):
+            exp_num_data_bytes = (num_regs + 7) // 8
+        else:
+            exp_num_data_bytes = num_regs * 2
+        req_template = self.get_template(False, mb_id, mb_func, start_reg_zero, None, num_regs,
+                                         5 + exp_num_data_bytes)
+
+        error_code, recv_packet = self._transact(req_template)
+        if error_code is not None:
+            return error_code, None
+        error_code, data = mb_poll.verify_no_modbus_errs(recv_packet, mb_id, mb_func, None, False, None)
+        if error_code is None and len(data) != exp_num_data_bytes:
+            return mb_poll.MB_ERR_DICT[108], None  # a short reply would leave the decoders reading past its end
+        return error_code, data
+
+    def read_bits(self, mb_id, start_reg, num_bits, mb_func=1, zero_based=False):
+        # coils (1) or discrete inputs (2) as (error, bytes of 0 or 1 per bit, bytes of 1 where a bit changed since
+        # the last read_bits of the same range)
+        if mb_func not in (1, 2) or num_bits < 1 or num_bits > 2000:
+            return mb_poll.MB_ERR_DICT[3], None, None
+        start_reg_zero = start_reg - (not zero_based)
+        if start_reg_zero < 0:
+            return mb_poll.MB_ERR_DICT[103], None, None
+
+        error_code, data = self.read_raw(mb_id, mb_func, start_reg_zero, num_bits)
+        if error_code is not None:
+            return error_code, None, None
+        mb_data = self._bit_datas.get((mb_id, mb_func, start_reg_zero, num_bits))
+        if mb_data is None:
+            mb_data = mb_poll.ModbusData(start_reg_zero + 1, num_bits, False, False, None, 'uint16', mb_func)
+            self._bit_datas[(mb_id, mb_func, start_reg_zero, num_bits)] = mb_data
+        mb_data.translate_regs_to_vals(data)
+        return None, mb_data.get_bit_array(), mb_data.get_changed_bits()
+
+    def write(self, mb_id, write_reg, write_vals, data_type='uint16', b_byteswap=False, b_wordswap=False,
+              zero_based=False):
+        return self.request(mb_id, 16, write_reg, len(write_vals), data_type, b_byteswap, b_wordswap, zero_based,
+                            write_vals=write_vals)
+
+    def read_write(self, mb_id, start_reg, num_vals, write_reg, write_vals, data_type='float', b_byteswap=False,
+                   b_wordswap=False, zero_based=False, b_raw_bytes=False):
+        return self.request(mb_id, 23, start_reg, num_vals, data_type, b_byteswap, b_wordswap, zero_based,
+                            write_vals=write_vals, write_reg=write_reg, b_raw_bytes=b_raw_bytes)
+
+    def queue_write(self, mb_id, write_reg, write_vals, data_type='uint16', b_byteswap=False, b_wordswap=False,
+                    zero_based=False):
+        # holds a write until the next holding register read of the same device so both go out as function 23
+        mb_id, error_code = mb_poll.validate_device_id(mb_id)
+        if error_code is not None:
+            return error_code
+        write_reg, error_code = mb_poll.validate_register(write_reg)
+        if error_code is not None:
+            return error_code
+        wrt_regs, error_code = mb_poll.translate_vals_to_regs(write_vals, data_type, b_byteswap, b_wordswap)
+        if error_code is not None:
+            return error_code
+        if len(wrt_regs) < 1 or len(wrt_regs) > 121 or write_reg - (not zero_based) < 0:
+            return mb_poll.MB_ERR_DICT[3]
+
+        self._pending_writes.setdefault(mb_id, []).append((write_reg - (not zero_based), wrt_regs))
+        return None
+
+    def has_pending_writes(self, mb_id=None):
+        if mb_id is None:
+            return any(self._pending_writes.values())
+        return bool(self._pending_writes.get(mb_id))
+
+    def flush_writes(self, mb_id=None):
+        # sends any queued writes on their own with function 16, stops at the first error
+        for flush_id in ([mb_id] if mb_id is not None else list(self._pending_writes)):
+            pending = self._pending_writes.get(flush_id, [])
+            while pending:
+                wrt_start_reg_zero, wrt_regs = pending[0]
+                result = self.request(flush_id, 16, wrt_start_reg_zero, len(wrt_regs), 'uint16', zero_based=True,
+                                      wrt_regs=wrt_regs)
+                if result[0] == 'Err':
+                    return result
+                pending.pop(0)
+        return None
+
+    def read(self, mb_id, start_reg, num_vals, data_type='float', b_byteswap=False, b_wordswap=False,
+             zero_based=False, mb_func=3, b_raw_bytes=False):
+        # fuses the oldest pending write for this device into a holding register read
+        pending = self._pending_writes.get(mb_id)
+        if pending and mb_func == 3 and mb_id not in self._no_fc23_ids:
+            wrt_start_reg_zero, wrt_regs = pending[0]
+            result = self.request(mb_id, 23, start_reg, num_vals, data_type, b_byteswap, b_wordswap, zero_based,
+                                  write_reg=wrt_start_reg_zero + (not zero_based), b_raw_bytes=b_raw_bytes,
+                                  wrt_regs=wrt_regs)
+            if result != mb_poll.MB_ERR_DICT[1]:
+                if result[0] != 'Err':
+                    pending.pop(0)
+                return result
+            self._no_fc23_ids.add(mb_id)  # device does not support function 23, fall back to two requests
+
+        if pending:
+            error_code = self.flush_writes(mb_id)
+            if error_code is not None:
+                return error_code
+
+        return self.request(mb_id, mb_func, start_reg, num_vals, data_type, b_byteswap, b_wordswap, zero_based,
+                            b_raw_bytes=b_raw_bytes)
+
+
+class ClientPool:
+    """One ModbusClient per gateway, created the first time the gateway is asked for."""
+    def __init__(self, mb_timeout=1500, **client_kwargs):
+        self.mb_timeout = mb_timeout
+        self.client_kwargs = client_kwargs
+        self._clients = {}  # (ip, port, transport): ModbusClient
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_all()
+
+    def get(self, ip, port=502, transport='tcp'):
+        client = self._clients.get((ip, port, transport))
+        if client is None:
+            client = ModbusClient(ip, port, self.mb_timeout, transport=transport, **self.client_kwargs)
+            self._clients[(ip, port, transport)] = client
+        return client
+
+    def close(self, ip, port=502, transport='tcp'):
+        client = self._clients.pop((ip, port, transport), None)
+        if client is not None:
+            client.close()
+
+    def close_all(self):
+        for client in self._clients.values():
+            client.close()
+        self._clients.clear()
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+import os
+import csv
+import time
+import signal
+import threading
+from datetime import datetime
+try:
+    from mbpy import mb_client  # folder.file import
+    from mbpy import mb_pointmap
+except ImportError:
+    import mb_client  # run from inside the mbpy folder
+    import mb_pointmap
+
+
+class CsvSink:
+    """Appends one row of datetime, point name and value (or error text) per point read, flushed every
+    flush_interval s."""
+    def __init__(self, file_name, flush_interval=1):
+        self.flush_interval = flush_interval
+        self._next_flush = time.monotonic() + flush_interval
+        b_new = not os.path.exists(file_name) or not os.path.getsize(file_name)
+        self._file = open(file_name, 'a', newline='')
+        self._csv_wrtr = csv.writer(self._file)
+        if b_new:
+            self._csv_wrtr.writerow(['Datetime', 'name', 'value'])
+
+    def write(self, ts_ns, point_vals):
+        time_str = str(datetime.fromtimestamp(ts_ns / 1e9))
+        self._csv_wrtr.writerows([time_str, name, val[2] if isinstance(val, tuple) and val and val[0] == 'Err' else val]
+                                 for name, val in point_vals.items())
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        self._next_flush = time.monotonic() + self.flush_interval
+
+    def close(self):
+        self._file.close()
+
+
+class PollDaemon:
+    """Runs a point map until stopped, reloading it on SIGHUP or when the file changes.
+
+    A reload compiles the new map and diffs it against the running plan.  Blocks that did not change keep their
+    schedule, changed blocks stay on the grid of their device and interval, and connections to endpoints still in
+    the map stay open, so editing one device causes no gap or reconnect for the others.  A map that fails to load is
+    reported and the running plan carries on.  Sinks are any objects with write(ts_ns, {name: value}), flush() and
+    close().  write must not block on the disk, each sink commits on its own schedule, and the daemon only flushes
+    and closes them on the way out.
+    """
+    def __init__(self, point_map, sinks=None, max_gap=10, mb_timeout=1500, watch_interval=2, verbosity=None,
+                 **client_kwargs):
+        self.point_map = point_map
+        self.sinks = list(sinks) if sinks else []
+        self.max_gap = max_gap
+        self.watch_interval = watch_interval  # s between checks of the file, None to only reload on SIGHUP
+        self.verbosity = verbosity
+        self.poll_plan = mb_pointmap.PollPlan.from_file(point_map, max_gap)  # a bad map at start up raises
+        self.client_pool = mb_client.ClientPool(mb_timeout, **client_kwargs)
+        self._map_stamp = self._get_map_stamp()
+        self._b_stopping = False
+        self._b_reload = False
+        self.num_scans = 0
+        self.num_reloads = 0
+        self.num_reload_errs = 0
+        self.last_diff = None  # (kept, changed, added, removed) blocks of the latest reload
+
+    def _get_map_stamp(self):
+        try:
+            map_stat = os.stat(self.point_map)
+        except OSError:
+            return None
+        return map_stat.st_mtime_ns, map_stat.st_size
+
+    def request_reload(self, *args):
+        self._b_reload = True  # safe from a signal handler or another thread, done before the next scan
+
+    def stop(self, *args):
+        self._b_stopping = True  # safe from a signal handler or another thread, the loop ends within one wakeup
+
+    def reload(self):
+        # returns the (kept, changed, added, removed) block counts, or None if the map could not be loaded
+        self._map_stamp = self._get_map_stamp()
+        try:
+            new_plan = mb_pointmap.PollPlan.from_file(self.point_map, self.max_gap)
+        except Exception as err:  # whatever a half saved file raises, the running plan is still good
+            self.num_reload_errs += 1
+            print('Reload of', self.point_map, 'failed, still polling the previous map:', err)
+            return None
+
+        self.last_diff = new_plan.take_schedule(self.poll_plan)
+        for ip, port, transport in self.poll_plan.get_endpoints() - new_plan.get_endpoints():
+            self.client_pool.close(ip, port, transport)
+        self.poll_plan = new_plan
+        self.num_reloads += 1
+        print('Reloaded', self.point_map + ':', '%d kept, %d changed, %d added, %d removed blocks' % self.last_diff)
+        return self.last_diff
+
+    def _install_signals(self):
+        # only the main thread may set handlers, a daemon run from another thread relies on stop and request_reload
+        if threading.current_thread() is not threading.main_thread():
+            return {}
+        old_handlers = {signal.SIGTERM: signal.signal(signal.SIGTERM, self.stop)}
+        if hasattr(signal, 'SIGHUP'):  # not on windows
+            old_handlers[signal.SIGHUP] = signal.signal(signal.SIGHUP, self.request_reload)
+        return old_handlers
+
+    def run(self, duration=None, max_wait=0.1):
+        # scans until duration (s) runs out, stop(), SIGTERM or Ctrl-C, then flushes and closes every sink
+        end_time = None if duration is None else time.monotonic() + duration
+        next_watch = time.monotonic() + (self.watch_interval or 0)
+        old_handlers = self._install_signals()
+        self._b_stopping = False
+        try:
+            while not self._b_stopping:
+                now = time.monotonic()
+                if end_time is not None and now >= end_time:
+                    break
+                if self.watch_interval is not None and now >= next_watch:
+                    next_watch = now + self.watch_interval
+                    if self._get_map_stamp() != self._map_stamp:
+                        self._b_reload = True
+                if self._b_reload:
+                    self._b_reload = False
+                    self.reload()
+
+                next_due = self.poll_plan.get_next_due()
+                if next_due is not None and next_due <= now:
+                    point_vals = self.poll_plan.scan(self.client_pool, b_due_only=True)
+                    ts_ns = time.time_ns()
+                    for sink in self.sinks:
+                        sink.write(ts_ns, point_vals)
+                    if self.verbosity is not None:
+                        for name, val in point_vals.items():
+                            print(name, ':', val)
+                    self.num_scans += 1
+
+                # sleep until the next scan, but wake up often enough to notice a stop or reload
+                next_due = self.poll_plan.get_next_due()
+                wait_time = max_wait if next_due is None else min(max_wait, next_due - time.monotonic())
+                if wait_time > 0:
+                    time.sleep(wait_time)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for signal_num, old_handler in old_handlers.items():
+                signal.signal(signal_num, old_handler)
+            self.close()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.flush()
+            sink.close()
+        self.sinks = []
+        self.client_pool.close_all()
+
+    def get_stats(self):
+        return {'points': len(self.poll_plan.points), 'blocks': len(self.poll_plan.blocks), 'scans': self.num_scans,
+                'reloads': self.num_reloads, 'reload_errs': self.num_reload_errs}
+
+
+def main(argv=None):
+    import argparse
+    try:
+        from mbpy import mb_poll
+    except ImportError:
+        import mb_poll
+
+    parser = argparse.ArgumentParser(description='Polls a point map until stopped, reloading it on SIGHUP or when '
+                                                 'the file changes without dropping unchanged devices.')
+    parser.add_argument('point_map', type=str, help='Point map file (.json, .yaml, .yml or .csv).')
+    parser.add_argument('-fl', '--file', type=str, default=None,
+                        help='Appends every value to this csv file (datetime, name, value).')
+    parser.add_argument('-db', '--sqlite', type=str, default=None,
+                        help='Also writes every value to this SQLite historian, see python -m mbpy.mb_historian.')
+    parser.add_argument('-g', '--gap', type=int, default=10,
+                        help='Unused registers a block read may span between points. Default is 10.')
+    parser.add_argument('-to', '--timeout', type=mb_poll.timeout_bw, default=1500,
+                        help='Time in milliseconds to wait for reply message. Default is 1500.')
+    parser.add_argument('-w', '--watch', type=float, default=2,
+                        help='Seconds between checks of the point map for changes, 0 to only reload on SIGHUP. '
+                             'Default is 2.')
+    parser.add_argument('-d', '--duration', type=float, default=None,
+                        help='Seconds to run for. Default is until SIGTERM or Ctrl-C.')
+    parser.add_argument('-v', '--verbose', action='count', help='Prints every value.')
+    args = parser.parse_args(argv)
+
+    sinks = []
+    if args.file is not None:
+        sinks.append(CsvSink(args.file if args.file.endswith('.csv') else args.file + '.csv'))
+    if args.sqlite is not None:
+        try:
+            from mbpy import mb_historian
+        except ImportError:
+            import mb_historian
+        sinks.append(mb_historian.HistorianSink(args.sqlite))
+
+    daemon = PollDaemon(args.point_map, sinks, args.gap, args.timeout, args.watch or None, verbosity=args.verbose)
+    print('Polling', len(daemon.poll_plan.points), 'points in', len(daemon.poll_plan.blocks), 'blocks, pid',
+          os.getpid(), '(kill -HUP to reload).')
+    daemon.run(args.duration)
+    print(daemon.get_stats())
+
+
+if __name__ == '__main__':
+    main()
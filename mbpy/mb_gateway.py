@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+
+import time
+import json
+import queue
+import threading
+try:
+    from mbpy import mb_poll  # folder.file import
+    from mbpy import mb_client
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+    import mb_client
+
+
+# error numbers that mean the endpoint or the bus behind it is overloaded rather than the request being wrong
+OVERLOAD_ERRS = (6, 10, 11, 87, 226)
+
+
+class GatewayPolicy:
+    """How hard one endpoint may be driven."""
+    __slots__ = ('max_in_flight', 'max_connections', 'min_gap')
+
+    def __init__(self, max_in_flight=1, max_connections=1, min_gap=0):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_connections = max(1, int(max_connections))
+        self.min_gap = max(0, min_gap)  # ms between the starts of two requests, lets an rtu bus turn around
+
+    def get_concurrency(self):
+        # clients send one request at a time, so every request in flight needs its own connection
+        return min(self.max_in_flight, self.max_connections)
+
+    def to_dict(self):
+        return {'max_in_flight': self.max_in_flight, 'max_connections': self.max_connections, 'min_gap': self.min_gap}
+
+    @classmethod
+    def from_dict(cls, policy_dict):
+        unknown_keys = set(policy_dict) - set(cls.__slots__)
+        if unknown_keys:
+            raise ValueError('Unknown gateway policy keys: ' + ', '.join(sorted(unknown_keys)))
+        return cls(**policy_dict)
+
+
+def parse_endpoint(endpoint):
+    # 'ip:port' or 'ip' to (ip, port)
+    ip, sep, port = endpoint.rpartition(':')
+    if not sep:
+        return endpoint, 502
+    return ip, int(port)
+
+
+def load_policies(file_name):
+    # json file of {"ip:port": {"max_in_flight": 1, "max_connections": 1, "min_gap": 0}, ...}
+    with open(file_name) as policy_file:
+        raw_policies = json.load(policy_file)
+    return {parse_endpoint(endpoint): GatewayPolicy.from_dict(policy_dict)
+            for endpoint, policy_dict in raw_policies.items()}
+
+
+def save_policies(file_name, policies):
+    with open(file_name, 'w') as policy_file:
+        json.dump({ip + ':' + str(port): policy.to_dict() for (ip, port), policy in sorted(policies.items())},
+                  policy_file, indent=2)
+
+
+class GatewayLimiter:
+    """The connections to one endpoint, handed out so that no more requests than the policy allows are busy at once."""
+    def __init__(self, ip, port=502, policy=None, mb_timeout=1500, transport='tcp', **client_kwargs):
+        self.ip = ip
+        self.port = port
+        self.transport = transport
+        # TCP-to-RTU gateways share one bus behind every device id, so one request at a time is the safe default
+        self.policy = policy if policy is not None else GatewayPolicy()
+        self._clients = [mb_client.ModbusClient(ip, port, mb_timeout, transport=transport, **client_kwargs)
+                         for client_iter in range(self.policy.get_concurrency())]
+        self._idle_clients = list(self._clients)
+        self._idle_cond = threading.Condition()
+        self._gap_lock = threading.Lock()
+        self._next_send_time = 0
+        self.num_requests = 0
+        self.num_overloads = 0
+
+    def acquire(self):
+        # blocks until a connection is free and the minimum gap since the last request has passed
+        with self._idle_cond:
+            while not self._idle_clients:
+                self._idle_cond.wait()
+            client = self._idle_clients.pop()
+        if self.policy.min_gap:
+            with self._gap_lock:
+                wait_time = self._next_send_time - time.monotonic()
+                if wait_time > 0:
+                    time.sleep(wait_time)
+                self._next_send_time = time.monotonic() + self.policy.min_gap / 1000
+        return client
+
+    def release(self, client):
+        with self._idle_cond:
+            self._idle_clients.append(client)
+            self._idle_cond.notify()
+
+    def request(self, *args, **kwargs):
+        # same arguments and return values as ModbusClient.request, safe to call from any number of threads
+        client = self.acquire()
+        try:
+            otpt = client.request(*args, **kwargs)
+        finally:
+            self.release(client)
+        self.num_requests += 1
+        if otpt and otpt[0] == 'Err' and otpt[1] in OVERLOAD_ERRS:
+            self.num_overloads += 1
+        return otpt
+
+    def close(self):
+        for client in self._clients:
+            client.close()
+
+
+class GatewayPool:
+    """Thread safe ClientPool that drives every endpoint as hard as its GatewayPolicy allows and no harder."""
+    def __init__(self, policies=None, default_policy=None, mb_timeout=1500, **client_kwargs):
+        self.policies = policies if policies is not None else {}  # (ip, port): GatewayPolicy
+        self.default_policy = default_policy if default_policy is not None else GatewayPolicy()
+        self.mb_timeout = mb_timeout
+        self.client_kwargs = client_kwargs
+        self._limiters = {}  # (ip, port, transport): GatewayLimiter
+        self._limiters_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_all()
+
+    def get(self, ip, port=502, transport='tcp'):
+        with self._limiters_lock:
+            limiter = self._limiters.get((ip, port, transport))
+            if limiter is None:
+                limiter = GatewayLimiter(ip, port, self.policies.get((ip, port), self.default_policy),
+                                         self.mb_timeout, transport, **self.client_kwargs)
+                self._limiters[(ip, port, transport)] = limiter
+            return limiter
+
+    def request(self, ip, port, *args, **kwargs):
+        return self.get(ip, port).request(*args, **kwargs)
+
+    def run(self, requests):
+        # requests are dicts of ip, optional port and transport, then any ModbusClient.request arguments by name.
+        # Every endpoint gets exactly as many threads as it may have requests in flight, so a slow gateway never holds
+        # up the rest.  Returns the outputs in the order of requests.
+        otpts = [None] * len(requests)
+        for req_iter, otpt in self.run_unordered(requests):
+            otpts[req_iter] = otpt
+        return otpts
+
+    def run_unordered(self, requests):
+        # same as run, but yields (index in requests, output) as each request finishes, output is None for a request
+        # that raised
+        endpoint_reqs = {}
+        for req_iter, request in enumerate(requests):
+            endpoint_reqs.setdefault((request['ip'], request.get('port', 502), request.get('transport', 'tcp')),
+                                     []).append(req_iter)
+        done_queue = queue.Queue()
+
+        def work_endpoint(limiter, req_iters, req_lock):
+            while True:
+                with req_lock:
+                    if not req_iters:
+                        return
+                    req_iter = req_iters.pop()
+                request_kwargs = {key: val for key, val in requests[req_iter].items()
+                                  if key not in ('ip', 'port', 'transport')}
+                try:
+                    otpt = limiter.request(**request_kwargs)
+                except Exception:
+                    otpt = None  # a request that raised, the thread carries on with the endpoint's other requests
+                done_queue.put((req_iter, otpt))
+
+        threads = []
+        for (ip, port, transport), req_iters in endpoint_reqs.items():
+            limiter = self.get(ip, port, transport)
+            req_iters.reverse()  # pop from the end, still in order
+            req_lock = threading.Lock()
+            for thread_iter in range(min(limiter.policy.get_concurrency(), len(req_iters))):
+                threads.append(threading.Thread(target=work_endpoint, args=(limiter, req_iters, req_lock),
+                                                daemon=True))
+        for thread in threads:
+            thread.start()
+        for req_iter in range(len(requests)):
+            yield done_queue.get()
+        for thread in threads:
+            thread.join()
+
+    def close(self, ip, port=502, transport='tcp'):
+        with self._limiters_lock:
+            limiter = self._limiters.pop((ip, port, transport), None)
+        if limiter is not None:
+            limiter.close()
+
+    def close_all(self):
+        with self._limiters_lock:
+            for limiter in self._limiters.values():
+                limiter.close()
+            self._limiters.clear()
+
+
+def measure_policy(ip, port, policy, num_requests, mb_timeout, request_kwargs):
+    # (good replies per second, share of replies that were overloads, first error that was not an overload)
+    with GatewayPool({(ip, port): policy}, mb_timeout=mb_timeout) as gateway_pool:
+        start_time = time.monotonic()
+        otpts = gateway_pool.run([dict(request_kwargs, ip=ip, port=port) for req_iter in range(num_requests)])
+        run_time = time.monotonic() - start_time
+    otpts = [mb_poll.MB_ERR_DICT[114] if otpt is None else otpt for otpt in otpts]  # a request that raised
+    num_good = sum(1 for otpt in otpts if not otpt or otpt[0] != 'Err')
+    num_overloads = sum(1 for otpt in otpts if otpt and otpt[0] == 'Err' and otpt[1] in OVERLOAD_ERRS)
+    other_errs = [otpt for otpt in otpts if otpt and otpt[0] == 'Err' and otpt[1] not in OVERLOAD_ERRS]
+    return num_good / run_time, num_overloads / num_requests, other_errs[0] if other_errs else None
+
+
+def probe_gateway(ip, port=502, max_connections=8, num_requests=50, max_overload_rate=0.02, mb_timeout=1500,
+                  verbosity=None, **request_kwargs):
+    # finds the most concurrent requests an endpoint answers without overloading.  Doubles the connections while the
+    # replies per second keep growing by at least 10 % and stay clean, then adds a gap between requests if even one
+    # at a time overloads it.  request_kwargs are the ModbusClient.request arguments of a harmless read, plus
+    # transport if the endpoint does not speak Modbus TCP.
+    # Returns (GatewayPolicy, None) or (None, error tuple) if the read itself is wrong.
+    best_policy = None
+    best_rate = 0
+    num_connections = 1
+    while num_connections <= max_connections:
+        policy = GatewayPolicy(num_connections, num_connections, 0)
+        rate, overload_rate, error_code = measure_policy(ip, port, policy, num_requests, mb_timeout, request_kwargs)
+        if error_code is not None:
+            return None, error_code
+        if verbosity is not None:
+            print(num_connections, 'connections:', round(rate, 1), 'replies per second,',
+                  round(overload_rate * 100, 1), '% overloaded')
+        if overload_rate > max_overload_rate or rate < best_rate * 1.1:
+            break  # the gateway or the bus behind it is saturated
+        best_policy, best_rate = policy, rate
+        num_connections *= 2
+    if best_policy is not None:
+        return best_policy, None
+
+    for min_gap in (10, 20, 50, 100, 200):
+        policy = GatewayPolicy(1, 1, min_gap)
+        rate, overload_rate, error_code = measure_policy(ip, port, policy, num_requests, mb_timeout, request_kwargs)
+        if verbosity is not None:
+            print('1 connection,', min_gap, 'ms gap:', round(rate, 1), 'replies per second,',
+                  round(overload_rate * 100, 1), '% overloaded')
+        if overload_rate <= max_overload_rate:
+            return policy, None
+    return GatewayPolicy(1, 1, 200), None
+
+
+def main(argv=None):
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description='Probes how many concurrent requests a gateway can take.')
+    parser.add_argument('ip', type=str, help='The IP address of the gateway.')
+    parser.add_argument('dev', type=mb_poll.device_bw, help='Id of a device behind the gateway to read from.')
+    parser.add_argument('srt', type=mb_poll.register_bw, help='Register to read, it should be safe to read often.')
+    parser.add_argument('lng', type=int, help='Number of values to read.')
+    parser.add_argument('-pt', '--port', type=int, default=502, help='Set port to communicate over.  Default is 502.')
+    parser.add_argument('-tr', '--transport', type=str, default='tcp', choices=mb_poll.NET_TRANSPORTS,
+                        help='Framing used on the network. Default is tcp.')
+    parser.add_argument('-f', '--func', type=int, default=3, choices=(1, 2, 3, 4),
+                        help='Modbus function to read with. Default is 3.')
+    parser.add_argument('-t', '--typ', type=str, default='uint16', choices=mb_poll.DATA_TYPE_LIST,
+                        help='The type to read. Default is uint16.')
+    parser.add_argument('-c', '--connections', type=int, default=8,
+                        help='Most connections to try. Default is 8.')
+    parser.add_argument('-n', '--requests', type=int, default=50,
+                        help='Requests sent at every step. Default is 50.')
+    parser.add_argument('-to', '--timeout', type=mb_poll.timeout_bw, default=1500,
+                        help='Time in milliseconds to wait for reply message. Default is 1500.')
+    parser.add_argument('-o', '--policies', type=str, default=None,
+                        help='Adds the result to this json policy file, creating it if needed.')
+    args = parser.parse_args(argv)
+
+    policy, error_code = probe_gateway(args.ip, args.port, args.connections, args.requests, mb_timeout=args.timeout,
+                                       verbosity=1, mb_id=args.dev, mb_func=args.func, start_reg=args.srt,
+                                       num_vals=args.lng, data_type=args.typ, transport=args.transport)
+    if error_code is not None:
+        print(error_code)
+        return
+
+    print(args.ip + ':' + str(args.port), json.dumps(policy.to_dict()))
+    if args.policies is not None:
+        policies = load_policies(args.policies) if os.path.exists(args.policies) else {}
+        policies[(args.ip, args.port)] = policy
+        save_policies(args.policies, policies)
+
+
+if __name__ == '__main__':
+    main()
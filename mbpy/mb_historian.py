@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+
+import os
+import time
+import queue
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+
+# pragmas of every connection, WAL lets readers run while the writer commits and NORMAL only syncs at checkpoints
+WRITER_PRAGMAS = ('PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL', 'PRAGMA busy_timeout=5000')
+CATALOG_SQL = ('CREATE TABLE IF NOT EXISTS points (point_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)',
+               'CREATE TABLE IF NOT EXISTS partitions (name TEXT PRIMARY KEY, start_ns INTEGER NOT NULL, '
+               'end_ns INTEGER NOT NULL)')
+# no declared type on value so ints, floats and text are kept as they were decoded.  The key clusters each
+# partition by point and time, so a point's time range is one index range scan
+PARTITION_SQL = 'CREATE TABLE IF NOT EXISTS %s (point_id INTEGER NOT NULL, ts_ns INTEGER NOT NULL, value, ' \
+                'PRIMARY KEY (point_id, ts_ns)) WITHOUT ROWID'
+INSERT_SQL = 'INSERT OR REPLACE INTO %s (point_id, ts_ns, value) VALUES (?, ?, ?)'
+
+
+def get_partition_name(start_ns):
+    # samples_YYYYMMDD_HHMM of the partition's start in utc
+    return datetime.fromtimestamp(start_ns // 1000000000, timezone.utc).strftime('samples_%Y%m%d_%H%M')
+
+
+def to_db_value(val):
+    # error tuples are stored as NULL so gaps show up in queries.  SQLite integers are 64 bit signed, larger uint64
+    # and engy values are stored as text so they keep every digit
+    if isinstance(val, tuple):
+        return None
+    if isinstance(val, int) and not -0x8000000000000000 <= val <= 0x7FFFFFFFFFFFFFFF:
+        return str(val)
+    return val
+
+
+class HistorianSink:
+    """Writes polled values to a SQLite database from its own thread.
+
+    Rows are narrow (point_id, ts_ns, value) and go to one table per partition_size s of time, listed in the
+    partitions table, so old data is dropped a table at a time and a time range only touches the tables it overlaps.
+    write only queues the values.  The writer thread gathers up to batch_size rows or batch_period s of them and
+    inserts them with one executemany per partition inside a single transaction, so it commits on its own schedule
+    and callers never wait for the disk.  Has the write(ts_ns, {name: value}), flush() and close() of a mb_daemon
+    sink.
+    """
+    def __init__(self, file_name, partition_size=86400, batch_size=5000, batch_period=0.5, max_pending=10000):
+        self.file_name = file_name
+        self.partition_ns = int(partition_size * 1e9)  # convert from s to ns
+        self.batch_size = batch_size
+        self.batch_period = batch_period
+        self._queue = queue.Queue(max_pending)  # scans waiting for the writer, write blocks when it is full
+        self.num_rows = 0
+        self.num_batches = 0
+        self.num_errs = 0
+        self.write_time = 0  # s the writer spent inside transactions
+
+        # the schema is made here so a bad file fails in the caller instead of the thread
+        with sqlite3.connect(file_name) as db_conn:
+            for pragma in WRITER_PRAGMAS:
+                db_conn.execute(pragma)
+            for catalog_sql in CATALOG_SQL:
+                db_conn.execute(catalog_sql)
+        db_conn.close()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _is_writing(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _put(self, item):
+        # queues item, returns False instead of blocking forever if the writer thread is gone
+        while self._is_writing():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def write(self, ts_ns, point_vals):
+        if point_vals and not self._put((ts_ns, point_vals)):
+            self.num_errs += 1  # writer is gone, the scan is dropped
+
+    def flush(self):
+        # blocks until everything written so far is committed, or the writer thread is gone
+        flushed = threading.Event()
+        if not self._put(flushed):
+            return
+        while not flushed.wait(0.1):
+            if not self._is_writing():
+                return
+
+    def close(self):
+        if self._thread is not None:
+            self._put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        # sqlite connections belong to the thread that made them, so the writer has its own
+        db_conn = sqlite3.connect(self.file_name, isolation_level=None)  # transactions are begun by hand
+        for pragma in WRITER_PRAGMAS:
+            db_conn.execute(pragma)
+        point_ids = dict((name, point_id) for point_id, name in db_conn.execute('SELECT point_id, name FROM points'))
+        partitions = set(name for name, in db_conn.execute('SELECT name FROM partitions'))
+
+        b_closing = False
+        while not b_closing:
+            scans = []
+            num_rows = 0
+            flush_events = []
+            item = self._queue.get()
+            end_time = time.monotonic() + self.batch_period
+            while True:
+                if item is None:
+                    b_closing = True
+                elif isinstance(item, threading.Event):
+                    flush_events.append(item)
+                else:
+                    scans.append(item)
+                    num_rows += len(item[1])
+                if b_closing or flush_events or num_rows >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0, end_time - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            if scans:
+                self._write_batch(db_conn, scans, point_ids, partitions)
+            for flushed in flush_events:
+                flushed.set()
+        db_conn.close()
+
+    def _write_batch(self, db_conn, scans, point_ids, partitions):
+        start_time = time.perf_counter()
+        new_ids = {}
+        new_partitions = set()
+        try:
+            db_conn.execute('BEGIN')
+            partition_rows = {}  # table name: [(point_id, ts_ns, value), ...]
+            for ts_ns, point_vals in scans:
+                start_ns = ts_ns - ts_ns % self.partition_ns
+                table_name = get_partition_name(start_ns)
+                rows = partition_rows.get(table_name)
+                if rows is None:
+                    rows = partition_rows[table_name] = []
+                    if table_name not in partitions:
+                        db_conn.execute(PARTITION_SQL % table_name)
+                        db_conn.execute('INSERT OR IGNORE INTO partitions (name, start_ns, end_ns) VALUES (?, ?, ?)',
+                                        (table_name, start_ns, start_ns + self.partition_ns))
+                        new_partitions.add(table_name)
+                for name, val in point_vals.items():
+                    point_id = point_ids.get(name) or new_ids.get(name)
+                    if point_id is None:
+                        point_id = db_conn.execute('INSERT INTO points (name) VALUES (?)', (name,)).lastrowid
+                        new_ids[name] = point_id
+                    rows.append((point_id, ts_ns, to_db_value(val)))
+
+            for table_name, rows in partition_rows.items():
+                db_conn.executemany(INSERT_SQL % table_name, rows)
+            db_conn.execute('COMMIT')
+        except Exception as err:
+            # the batch is lost but the writer carries on, so a full disk or a bad value does not stop polling
+            if db_conn.in_transaction:
+                db_conn.execute('ROLLBACK')
+            self.num_errs += 1
+            partitions.clear()  # in case a partition was dropped under the writer, they are made again if needed
+            print('Historian write of', len(scans), 'scans failed:', err)
+            return
+        point_ids.update(new_ids)  # only ids that were committed
+        partitions.update(new_partitions)
+        self.num_rows += sum(len(rows) for rows in partition_rows.values())
+        self.num_batches += 1
+        self.write_time += time.perf_counter() - start_time
+
+    def get_stats(self):
+        return {'rows': self.num_rows, 'batches': self.num_batches, 'errs': self.num_errs,
+                'pending': self._queue.qsize(), 'write_time': self.write_time}
+
+
+def get_partitions(db_conn, start_ns=None, end_ns=None):
+    # [(table name, start_ns, end_ns), ...] of the partitions overlapping [start_ns, end_ns], oldest first
+    return db_conn.execute('SELECT name, start_ns, end_ns FROM partitions WHERE end_ns > ? AND start_ns <= ? '
+                           'ORDER BY start_ns', (start_ns if start_ns is not None else -2 ** 63,
+                                                 end_ns if end_ns is not None else 2 ** 63 - 1)).fetchall()
+
+
+def read_range(file_name, names=None, start_ns=None, end_ns=None):
+    # yields (name, ts_ns, value) of the given points (every point if None) between start_ns and end_ns inclusive,
+    # by partition, then point, then time.  Safe while a HistorianSink is writing
+    db_conn = sqlite3.connect('file:' + file_name + '?mode=ro', uri=True)
+    try:
+        point_names = dict(db_conn.execute('SELECT point_id, name FROM points'))
+        if names is not None:
+            names = set(names)
+            point_ids = [point_id for point_id, name in point_names.items() if name in names]
+            if not point_ids:
+                return
+            id_filter = ' AND point_id IN (' + ','.join('?' * len(point_ids)) + ')'
+        else:
+            point_ids = []
+            id_filter = ''
+        first_ns = start_ns if start_ns is not None else -2 ** 63
+        last_ns = end_ns if end_ns is not None else 2 ** 63 - 1
+        for table_name, part_start_ns, part_end_ns in get_partitions(db_conn, start_ns, end_ns):
+            for point_id, ts_ns, val in db_conn.execute(
+                    'SELECT point_id, ts_ns, value FROM ' + table_name + ' WHERE ts_ns >= ? AND ts_ns <= ?' +
+                    id_filter + ' ORDER BY point_id, ts_ns', [first_ns, last_ns] + point_ids):
+                yield point_names[point_id], ts_ns, val
+    finally:
+        db_conn.close()
+
+
+def drop_partitions(file_name, before_ns):
+    # drops every partition that ended by before_ns, returns how many were dropped
+    db_conn = sqlite3.connect(file_name, isolation_level=None)
+    try:
+        db_conn.execute('PRAGMA busy_timeout=5000')
+        old_partitions = db_conn.execute('SELECT name FROM partitions WHERE end_ns <= ?', (before_ns,)).fetchall()
+        db_conn.execute('BEGIN IMMEDIATE')
+        for table_name, in old_partitions:
+            db_conn.execute('DROP TABLE IF EXISTS ' + table_name)
+            db_conn.execute('DELETE FROM partitions WHERE name = ?', (table_name,))
+        db_conn.execute('COMMIT')
+    finally:
+        db_conn.close()
+    return len(old_partitions)
+
+
+def main(argv=None):
+    import csv
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Reads values from a historian database written by mb_daemon '
+                                                 '--sqlite.')
+    parser.add_argument('db', type=str, help='SQLite historian file.')
+    parser.add_argument('-n', '--names', type=str, default=None, help='Comma separated point names. Default is all.')
+    parser.add_argument('-s', '--start', type=str, default=None,
+                        help='First time to read, as YYYY-MM-DD[ HH:MM[:SS]]. Default is the oldest value.')
+    parser.add_argument('-e', '--end', type=str, default=None, help='Last time to read. Default is the newest value.')
+    parser.add_argument('-fl', '--file', type=str, default=None,
+                        help='Writes the rows to this csv file instead of printing them.')
+    parser.add_argument('--drop_before', type=str, default=None,
+                        help='Drops every partition that ended by this time, then exits.')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print the size of the database.')
+    args = parser.parse_args(argv)
+
+    if args.drop_before is not None:
+        before_ns = int(datetime.fromisoformat(args.drop_before).timestamp() * 1e9)
+        print('Dropped', drop_partitions(args.db, before_ns), 'partitions.')
+        return
+
+    start_ns = int(datetime.fromisoformat(args.start).timestamp() * 1e9) if args.start else None
+    end_ns = int(datetime.fromisoformat(args.end).timestamp() * 1e9) if args.end else None
+    with sqlite3.connect('file:' + args.db + '?mode=ro', uri=True) as db_conn:
+        num_points = db_conn.execute('SELECT COUNT(*) FROM points').fetchone()[0]
+        partitions = get_partitions(db_conn)
+    db_conn.close()
+    print(args.db, ':', num_points, 'points in', len(partitions), 'partitions,', os.path.getsize(args.db), 'bytes',
+          file=sys.stderr)
+    if args.quiet:
+        return
+
+    csv_file = None
+    if args.file is not None:
+        csv_file = open(args.file if args.file.endswith('.csv') else args.file + '.csv', 'w', newline='')
+        csv_file_wrtr = csv.writer(csv_file)
+        csv_file_wrtr.writerow(['Datetime', 'name', 'value'])
+    names = args.names.split(',') if args.names else None
+    for name, ts_ns, val in read_range(args.db, names, start_ns, end_ns):
+        if csv_file is not None:
+            csv_file_wrtr.writerow([str(datetime.fromtimestamp(ts_ns / 1e9)), name, val])
+        else:
+            print(datetime.fromtimestamp(ts_ns / 1e9), name, ':', val)
+    if csv_file is not None:
+        csv_file.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+
+import time
+import json
+import threading
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    from mbpy import mb_poll  # folder.file import
+    from mbpy import mb_pointmap
+    from mbpy import mb_gateway
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+    import mb_pointmap
+    import mb_gateway
+
+
+class PointCache:
+    """Read through cache of the points of a poll plan.
+
+    A point is answered from memory while its last read is younger than its ttl (the point's interval if no ttl is
+    given).  A miss reads the point's whole block, so every point of that block is refreshed at once, and callers that
+    miss the same block while it is being read wait for that one read.  Errors are kept for the ttl too, so a dead
+    device is not asked again by every caller.  Safe to call from any number of threads.
+    """
+    def __init__(self, poll_plan, gateway_pool):
+        self.poll_plan = poll_plan
+        self.gateway_pool = gateway_pool
+        self.points = {point['name']: point for point in poll_plan.points}
+        self._ttls = {point['name']: (point['interval'] if point['ttl'] is None else point['ttl']) / 1000
+                      for point in poll_plan.points}  # convert from ms to s
+        self._point_blocks = {}  # name: index of its block
+        for block_iter, block in enumerate(poll_plan.blocks):
+            for name in block.point_names:
+                self._point_blocks[name] = block_iter
+        self._values = {}  # name: (value or error tuple, ts_ns, monotonic time of the read)
+        self._flights = {}  # block index: Event set once the read in progress is done, later callers wait on it
+        self._lock = threading.Lock()
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_reads = 0  # block reads sent to devices
+        self.num_shared = 0  # misses answered by a read another caller had already started
+
+    def _is_fresh(self, name, now, max_age):
+        cached = self._values.get(name)
+        if cached is None:
+            return False
+        ttl = self._ttls[name] if max_age is None else min(self._ttls[name], max_age / 1000)
+        return now - cached[2] <= ttl
+
+    def _read_block(self, block_iter, flight):
+        block = self.poll_plan.blocks[block_iter]
+        limiter = self.gateway_pool.get(block.ip, block.port, block.transport)
+        client = limiter.acquire()
+        try:
+            point_vals = self.poll_plan.scan_block(block, client)
+        except Exception:
+            # cached like any other error, so waiters and clients get an answer and the device is not asked again
+            point_vals = [(name, mb_poll.MB_ERR_DICT[114]) for name in block.point_names]
+        finally:
+            limiter.release(client)
+        ts_ns = time.time_ns()
+        read_time = time.monotonic()
+        with self._lock:
+            for name, val in point_vals:
+                self._values[name] = (val, ts_ns, read_time)
+            self.num_reads += 1
+            del self._flights[block_iter]
+        flight.set()
+
+    def _read_blocks(self, block_iters):
+        # reads the blocks nobody else is reading, one thread per gateway, then waits for the ones already in flight
+        own_flights = {}
+        other_flights = []
+        with self._lock:
+            for block_iter in block_iters:
+                flight = self._flights.get(block_iter)
+                if flight is None:
+                    flight = threading.Event()
+                    self._flights[block_iter] = flight
+                    own_flights[block_iter] = flight
+                else:
+                    other_flights.append(flight)
+                    self.num_shared += 1
+
+        gateway_blocks = {}
+        for block_iter in own_flights:
+            block = self.poll_plan.blocks[block_iter]
+            gateway_blocks.setdefault((block.ip, block.port, block.transport), []).append(block_iter)
+
+        def read_gateway(gateway_block_iters):
+            for block_iter in gateway_block_iters:
+                self._read_block(block_iter, own_flights[block_iter])
+
+        gateway_block_lists = list(gateway_blocks.values())
+        threads = [threading.Thread(target=read_gateway, args=(gateway_block_iters,), daemon=True)
+                   for gateway_block_iters in gateway_block_lists[1:]]
+        for thread in threads:
+            thread.start()
+        if gateway_block_lists:
+            read_gateway(gateway_block_lists[0])  # the first gateway on this thread
+        for thread in threads:
+            thread.join()
+        for flight in other_flights:
+            flight.wait()
+
+    def get_many(self, names=None, max_age=None):
+        # {name: (value or error tuple, ts_ns, age in s)} of the given points, or of every point.  max_age in ms asks
+        # for values younger than the ttl.  Raises KeyError with the unknown names.
+        names = list(self.points) if names is None else names
+        unknown_names = [name for name in names if name not in self.points]
+        if unknown_names:
+            raise KeyError(', '.join(unknown_names))
+
+        now = time.monotonic()
+        with self._lock:
+            stale_blocks = {self._point_blocks[name] for name in names if not self._is_fresh(name, now, max_age)}
+            num_stale = sum(1 for name in names if self._point_blocks[name] in stale_blocks)
+            self.num_misses += num_stale
+            self.num_hits += len(names) - num_stale
+        if stale_blocks:
+            self._read_blocks(sorted(stale_blocks))
+
+        now = time.monotonic()
+        with self._lock:
+            if any(name not in self._values for name in names):
+                raise RuntimeError('Block read failed without an error tuple.')
+            return {name: self._values[name][:2] + (now - self._values[name][2],) for name in names}
+
+    def get(self, name, max_age=None):
+        return self.get_many([name], max_age)[name]
+
+    def get_ttl(self, name):
+        return self._ttls[name] * 1000
+
+    def get_stats(self):
+        return {'points': len(self.points), 'blocks': len(self.poll_plan.blocks), 'hits': self.num_hits,
+                'misses': self.num_misses, 'reads': self.num_reads, 'shared': self.num_shared}
+
+
+def to_json_value(name, cached):
+    val, ts_ns, age = cached
+    if isinstance(val, tuple) and val and val[0] == 'Err':
+        return {'name': name, 'value': None, 'error': [val[1], val[2]], 'ts': ts_ns, 'age': round(age * 1000, 1)}
+    return {'name': name, 'value': val, 'error': None, 'ts': ts_ns, 'age': round(age * 1000, 1)}
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints over a PointCache.
+
+    GET  /points                       every point and its ttl in ms
+    GET  /values/NAME[?max_age=MS]     one point
+    GET  /values[?names=A,B&max_age=]  many points in one response, every point if names is left out
+    POST /values                       {"names": [...], "max_age": MS} or a list of names
+    GET  /stats                        hits, misses and device reads
+    """
+    server_version = 'mbpy-httpcache'
+
+    def send_json(self, status, body):
+        body_bytes = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body_bytes)))
+        self.end_headers()
+        self.wfile.write(body_bytes)
+
+    def send_values(self, names, max_age, b_single=False):
+        try:
+            cached_vals = self.server.cache.get_many(names, max_age)
+        except KeyError as err:
+            self.send_json(404, {'error': 'unknown points: ' + err.args[0]})
+            return
+        except RuntimeError as err:
+            self.send_json(502, {'error': str(err)})
+            return
+        if b_single:
+            self.send_json(200, to_json_value(names[0], cached_vals[names[0]]))
+        else:
+            self.send_json(200, {name: to_json_value(name, cached) for name, cached in cached_vals.items()})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip('/')
+        try:
+            max_age = float(query['max_age'][0]) if 'max_age' in query else None
+        except ValueError:
+            self.send_json(400, {'error': 'max_age must be a number of ms'})
+            return
+
+        cache = self.server.cache
+        if path == '/points':
+            self.send_json(200, [{'name': name, 'ip': point['ip'], 'port': point['port'], 'mb_id': point['mb_id'],
+                                  'register': point['register'], 'function': point['function'], 'type': point['type'],
+                                  'ttl': cache.get_ttl(name)} for name, point in cache.points.items()])
+        elif path == '/values':
+            names = [name for names in query.get('names', []) for name in names.split(',') if name] or None
+            self.send_values(names, max_age)
+        elif path.startswith('/values/'):
+            self.send_values([unquote(path[len('/values/'):])], max_age, b_single=True)
+        elif path == '/stats':
+            self.send_json(200, cache.get_stats())
+        else:
+            self.send_json(404, {'error': 'unknown path ' + url.path})
+
+    def do_POST(self):
+        if urlsplit(self.path).path.rstrip('/') != '/values':
+            self.send_json(404, {'error': 'unknown path ' + self.path})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if isinstance(body, list):
+                names, max_age = body, None
+            else:
+                names, max_age = body.get('names'), body.get('max_age')
+            if names is not None and (not isinstance(names, list) or
+                                      not all(isinstance(name, str) for name in names)):
+                raise ValueError('names must be a list of strings')
+            if max_age is not None:
+                max_age = float(max_age)
+        except (ValueError, TypeError, AttributeError):
+            self.send_json(400, {'error': 'body must be a list of names or {"names": [...], "max_age": MS}'})
+            return
+        self.send_values(names, max_age)
+
+    def log_message(self, format, *args):
+        if self.server.verbosity is not None:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class CacheServer(ThreadingHTTPServer):
+    """HTTP server answering every client from one PointCache, so devices see at most one read per block per ttl."""
+    daemon_threads = True
+
+    def __init__(self, server_address, cache, verbosity=None):
+        ThreadingHTTPServer.__init__(self, server_address, CacheRequestHandler)
+        self.cache = cache
+        self.verbosity = verbosity
+
+
+def main(argv=None):
+    import argparse
+    try:
+        from mbpy import mb_poll
+    except ImportError:
+        import mb_poll
+
+    parser = argparse.ArgumentParser(description='Serves the points of a point map over HTTP from a read through '
+                                                 'cache.')
+    parser.add_argument('point_map', type=str, help='Point map file (.json, .yaml, .yml or .csv).')
+    parser.add_argument('-b', '--bind', type=str, default='127.0.0.1',
+                        help='Address to listen on. Default is 127.0.0.1, use 0.0.0.0 for every interface.')
+    parser.add_argument('-pt', '--port', type=int, default=8502, help='HTTP port to listen on. Default is 8502.')
+    parser.add_argument('-g', '--gap', type=int, default=10,
+                        help='Unused registers a block read may span between points. Default is 10.')
+    parser.add_argument('-to', '--timeout', type=mb_poll.timeout_bw, default=1500,
+                        help='Time in milliseconds to wait for reply message. Default is 1500.')
+    parser.add_argument('-o', '--policies', type=str, default=None,
+                        help='Json gateway policy file from python -m mbpy.mb_gateway, default is one request at a '
+                             'time per gateway.')
+    parser.add_argument('-v', '--verbose', action='count', help='Logs every HTTP request.')
+    args = parser.parse_args(argv)
+
+    poll_plan = mb_pointmap.PollPlan.from_file(args.point_map, args.gap)
+    policies = mb_gateway.load_policies(args.policies) if args.policies is not None else None
+    with mb_gateway.GatewayPool(policies, mb_timeout=args.timeout) as gateway_pool:
+        cache = PointCache(poll_plan, gateway_pool)
+        with CacheServer((args.bind, args.port), cache, args.verbose) as server:
+            print('Serving', len(cache.points), 'points in', len(poll_plan.blocks), 'blocks on http://' + args.bind +
+                  ':' + str(args.port))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    print(cache.get_stats())
+
+
+if __name__ == '__main__':
+    main()
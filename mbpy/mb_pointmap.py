@@ -0,0 +1,418 @@
+#!/usr/bin/python3
+
+import os
+import time
+from struct import Struct, pack, unpack
+try:
+    from mbpy import mb_poll  # folder.file import
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+
+
+# columns of a point map, name, ip, mb_id and register have to be given and the rest fall back to these
+POINT_DEFAULTS = {'port': 502, 'transport': 'tcp', 'function': 3, 'type': 'float', 'byte_swap': False,
+                  'word_swap': False, 'zero_based': False, 'scale': 1, 'offset': 0, 'interval': 1000, 'bit': None,
+                  'byte': None, 'ttl': None}
+POINT_REQUIRED = ('name', 'ip', 'mb_id', 'register')
+BOOL_FIELDS = ('byte_swap', 'word_swap', 'zero_based')
+INT_FIELDS = ('port', 'function', 'mb_id', 'register', 'bit', 'byte')
+FLOAT_FIELDS = ('scale', 'offset', 'interval', 'ttl')
+
+MAX_BLOCK_REGS = {1: 2000, 2: 2000, 3: 125, 4: 125}  # most registers or coils one request may ask for
+NON_NUMERIC_FORMATS = ('hex', 'bin', 'ascii')  # scale and offset do not apply
+
+
+def regs_per_val(data_type):
+    if data_type in mb_poll.FOUR_BYTE_FORMATS:
+        return 2
+    elif data_type in mb_poll.SIX_BYTE_FORMATS:
+        return 3
+    elif data_type in mb_poll.EIGHT_BYTE_FORMATS:
+        return 4
+    return 1
+
+
+def parse_bool(val):
+    if isinstance(val, str):
+        return val.strip().lower() in ('1', 'true', 'yes', 'y', 't')
+    return bool(val)
+
+
+def make_point(raw_point, defaults=None):
+    # fills in defaults, converts text from csv files and checks one point, raises ValueError if it is unusable
+    point = dict(POINT_DEFAULTS)
+    if defaults:
+        point.update(defaults)
+    point.update({key: val for key, val in raw_point.items() if val is not None and val != ''})
+
+    missing_keys = [key for key in POINT_REQUIRED if key not in point]
+    unknown_keys = set(point) - set(POINT_DEFAULTS) - set(POINT_REQUIRED)
+    if missing_keys or unknown_keys:
+        raise ValueError('Point ' + str(point.get('name')) + ' is missing: ' + ', '.join(missing_keys) +
+                         ' has unknown: ' + ', '.join(sorted(unknown_keys)))
+
+    point['name'] = str(point['name'])
+    try:
+        for key in BOOL_FIELDS:
+            point[key] = parse_bool(point[key])
+        for key in INT_FIELDS:
+            if point[key] is not None:
+                point[key] = int(point[key], 0) if isinstance(point[key], str) else int(point[key])
+        for key in FLOAT_FIELDS:
+            if point[key] is not None:
+                point[key] = float(point[key])
+    except ValueError:
+        raise ValueError('Point ' + point['name'] + ' has a value that is not a number.')
+
+    error_code = None
+    if mb_poll.validate_device_id(point['mb_id'])[1] is not None:
+        error_code = 'mb_id must be in [0, 255]'
+    elif mb_poll.validate_register(point['register'])[1] is not None or \
+            point['register'] - (not point['zero_based']) < 0:
+        error_code = 'invalid register'
+    elif point['transport'] not in mb_poll.NET_TRANSPORTS:
+        error_code = 'transport must be one of ' + ', '.join(mb_poll.NET_TRANSPORTS)
+    elif point['function'] not in MAX_BLOCK_REGS:
+        error_code = 'only functions 1, 2, 3 and 4 can be polled'
+    elif point['function'] in (3, 4) and point['type'] not in mb_poll.DATA_TYPE_LIST:
+        error_code = 'invalid type ' + str(point['type'])
+    elif point['bit'] is not None and (point['bit'] < 0 or point['bit'] > 15 or
+                                       point['type'] not in mb_poll.TWO_BYTE_FORMATS):
+        error_code = 'bit must be in [0, 15] and needs a 16 bit type'
+    elif point['byte'] is not None and (point['byte'] not in (0, 1) or
+                                        point['type'] not in mb_poll.ONE_BYTE_FORMATS):
+        error_code = 'byte must be 0 (high) or 1 (low) and needs an 8 bit type'
+    elif point['interval'] <= 0:
+        error_code = 'interval must be positive'
+    elif point['ttl'] is not None and point['ttl'] < 0:
+        error_code = 'ttl can not be negative'
+    if error_code is not None:
+        raise ValueError('Point ' + point['name'] + ': ' + error_code)
+
+    if point['function'] in (1, 2):
+        point['type'] = 'bit'
+    return point
+
+
+def make_points(raw_points, defaults=None):
+    points = [make_point(raw_point, defaults) for raw_point in raw_points]
+    names = [point['name'] for point in points]
+    if len(set(names)) != len(names):
+        raise ValueError('Point names must be unique.')
+    return points
+
+
+def load_point_map(file_name):
+    # json and yaml files hold either a list of points or {'defaults': {...}, 'points': [...]}, csv files have a
+    # header row with the column names.  A file that can not be parsed or has the wrong shape raises ValueError
+    file_ext = os.path.splitext(file_name)[1].lower()
+    with open(file_name, newline='') as map_file:
+        if file_ext == '.csv':
+            import csv
+            try:
+                return make_points(csv.DictReader(map_file))
+            except csv.Error as err:
+                raise ValueError(file_name + ' is not a valid csv file: ' + str(err))
+        elif file_ext in ('.yaml', '.yml'):
+            import yaml  # optional, pip install PyYAML
+            try:
+                map_data = yaml.safe_load(map_file)
+            except yaml.YAMLError as err:
+                raise ValueError(file_name + ' is not a valid yaml file: ' + str(err))
+        else:
+            import json
+            map_data = json.load(map_file)  # JSONDecodeError is a ValueError
+
+    raw_points, defaults = map_data, None
+    if isinstance(map_data, dict):
+        raw_points, defaults = map_data.get('points', []), map_data.get('defaults')
+    if not isinstance(raw_points, list) or not all(isinstance(raw_point, dict) for raw_point in raw_points) or \
+            not isinstance(defaults, (dict, type(None))):
+        raise ValueError(file_name + ' must hold a list of points or {"defaults": {...}, "points": [...]}.')
+    return make_points(raw_points, defaults)
+
+
+def make_regs_converter(data_type, bit=None, byte=None):
+    # returns a function turning registers (low word first) into one value, matching ModbusData
+    if bit is not None:
+        return lambda regs: (regs[0] >> bit) & 0x1
+    elif data_type in ('uint16', 'hex', 'bin'):
+        convert_funcs = {'uint16': int, 'hex': hex, 'bin': bin}
+        return lambda regs, convert_func=convert_funcs[data_type]: convert_func(regs[0])
+    elif data_type == 'sint16':
+        return lambda regs: regs[0] - 0x10000 if regs[0] & 0x8000 else regs[0]
+    elif data_type == 'ascii':
+        return lambda regs: bytes([regs[0] >> 8, regs[0] & 0xff]).decode('ascii', 'ignore')
+    elif data_type in ('uint8', 'sint8'):
+        byte_shift = 0 if byte == 1 else 8
+        if data_type == 'uint8':
+            return lambda regs: (regs[0] >> byte_shift) & 0xff
+        return lambda regs: unpack('b', pack('B', (regs[0] >> byte_shift) & 0xff))[0]
+    elif data_type in ('float', 'dbl', 'sint32', 'sint64'):
+        num_regs = regs_per_val(data_type)
+        val_struct = Struct('<' + {'float': 'f', 'dbl': 'd', 'sint32': 'i', 'sint64': 'q'}[data_type])
+        regs_struct = Struct('<' + 'H' * num_regs)
+        return lambda regs: val_struct.unpack(regs_struct.pack(*regs))[0]
+    elif data_type in ('uint32', 'uint48', 'uint64'):
+        regs_struct = Struct('<' + 'H' * regs_per_val(data_type))
+        return lambda regs: int.from_bytes(regs_struct.pack(*regs), byteorder='little')
+    elif data_type == 'engy':
+        # 48 bit mantissa with a signed power of ten exponent in the high byte of the last register
+        return lambda regs: (((regs[2] << 32) | (regs[1] << 16) | regs[0]) *
+                             (10 ** unpack('b', pack('B', regs[3] >> 8))[0]))
+    else:  # mod 1000 and mod 10000 types, signed versions keep the sign in the top bit of the highest register
+        mod = 10000 if 'm10k' in data_type else 1000
+        b_signed = data_type.startswith('s')
+
+        def mod_regs_to_val(regs):
+            val = 0
+            for reg_iter in range(len(regs) - 1, -1, -1):
+                reg = regs[reg_iter]
+                if b_signed and reg_iter == len(regs) - 1:
+                    reg &= 0x7fff
+                val = val * mod + reg
+            if b_signed and regs[-1] >> 15:
+                return -val
+            return val
+        return mod_regs_to_val
+
+
+def make_value_decoder(data_type, byte_swap=False, word_swap=False, bit=None, byte=None):
+    # returns decode(data, byte_offset) reading one value straight out of the data bytes of a reply
+    num_regs = regs_per_val(data_type)
+    unpack_regs = Struct(('<' if byte_swap else '>') + 'H' * num_regs).unpack_from
+    regs_to_val = make_regs_converter(data_type, bit, byte)
+
+    if word_swap and num_regs > 1:
+        return lambda data, byte_offset: regs_to_val(unpack_regs(data, byte_offset)[::-1])
+    return lambda data, byte_offset: regs_to_val(unpack_regs(data, byte_offset))
+
+
+class PointBlock:
+    """One request covering several points of a device, with each point's place in the reply worked out."""
+    __slots__ = ('ip', 'port', 'transport', 'mb_id', 'mb_func', 'interval', 'start_reg_zero', 'num_regs', 'point_names',
+                 'decoders', 'next_due')
+
+    def __init__(self, ip, port, transport, mb_id, mb_func, interval, block_points):
+        self.ip = ip
+        self.port = port
+        self.transport = transport
+        self.mb_id = mb_id
+        self.mb_func = mb_func
+        self.interval = interval / 1000  # convert from ms to s
+        self.start_reg_zero = min(start_reg_zero for start_reg_zero, point in block_points)
+        self.num_regs = max(start_reg_zero + (regs_per_val(point['type']) if mb_func in (3, 4) else 1)
+                            for start_reg_zero, point in block_points) - self.start_reg_zero
+        self.point_names = [point['name'] for start_reg_zero, point in block_points]
+        self.next_due = 0
+
+        # (name, byte or bit offset, decode, scale, offset), decode is None for coils and discrete inputs
+        self.decoders = []
+        for start_reg_zero, point in block_points:
+            if mb_func in (1, 2):
+                self.decoders.append((point['name'], start_reg_zero - self.start_reg_zero, None, 1, 0))
+                continue
+
+            decode = make_value_decoder(point['type'], point['byte_swap'], point['word_swap'], point['bit'],
+                                        point['byte'])
+            b_scaled = point['type'] not in NON_NUMERIC_FORMATS and point['bit'] is None and \
+                (point['scale'] != 1 or point['offset'] != 0)
+            self.decoders.append((point['name'], (start_reg_zero - self.start_reg_zero) * 2, decode,
+                                  point['scale'] if b_scaled else 1, point['offset'] if b_scaled else 0))
+
+    def decode(self, data):
+        # single pass over the reply data, returns [(name, value), ...]
+        point_vals = []
+        for name, data_offset, decode, scale, offset in self.decoders:
+            if decode is None:
+                point_vals.append((name, (data[data_offset >> 3] >> (data_offset & 0x7)) & 0x1))
+            elif scale != 1 or offset != 0:
+                point_vals.append((name, decode(data, data_offset) * scale + offset))
+            else:
+                point_vals.append((name, decode(data, data_offset)))
+        return point_vals
+
+
+def compile_blocks(points, max_gap=10):
+    # groups points of the same device, function and interval into as few block reads as possible, reading across
+    # unused gaps of up to max_gap registers
+    groups = {}
+    for point in points:
+        group_key = (point['ip'], point['port'], point['transport'], point['mb_id'], point['function'],
+                     point['interval'])
+        start_reg_zero = point['register'] - (not point['zero_based'])
+        groups.setdefault(group_key, []).append((start_reg_zero, point))
+
+    blocks = []
+    for (ip, port, transport, mb_id, mb_func, interval), group_points in sorted(groups.items(),
+                                                                                key=lambda group: str(group[0])):
+        group_points.sort(key=lambda group_point: group_point[0])
+        block_points = []
+        block_start = block_end = 0
+        for start_reg_zero, point in group_points:
+            point_end = start_reg_zero + (regs_per_val(point['type']) if mb_func in (3, 4) else 1)
+            if block_points and start_reg_zero - block_end <= max_gap and \
+                    max(block_end, point_end) - block_start <= MAX_BLOCK_REGS[mb_func]:
+                block_end = max(block_end, point_end)
+            else:
+                if block_points:
+                    blocks.append(PointBlock(ip, port, transport, mb_id, mb_func, interval, block_points))
+                block_points = []
+                block_start, block_end = start_reg_zero, point_end
+            block_points.append((start_reg_zero, point))
+        blocks.append(PointBlock(ip, port, transport, mb_id, mb_func, interval, block_points))
+    return blocks
+
+
+def get_group_key(block):
+    # blocks with the same group key are read from the same device on the same schedule
+    return block.ip, block.port, block.transport, block.mb_id, block.mb_func, block.interval
+
+
+class PollPlan:
+    """A point map compiled into block reads that are scanned on each block's own interval."""
+    def __init__(self, points, max_gap=10):
+        self.points = points
+        self.max_gap = max_gap
+        self.blocks = compile_blocks(points, max_gap)
+        self._points_by_name = {point['name']: point for point in points}
+
+    @classmethod
+    def from_file(cls, file_name, max_gap=10):
+        return cls(load_point_map(file_name), max_gap)
+
+    def get_next_due(self):
+        return min(block.next_due for block in self.blocks) if self.blocks else None
+
+    def get_endpoints(self):
+        return {(block.ip, block.port, block.transport) for block in self.blocks}
+
+    def get_block_key(self, block):
+        # equal keys read the same registers and decode them into the same points
+        return (block.ip, block.port, block.transport, block.mb_id, block.mb_func, block.interval,
+                block.start_reg_zero, block.num_regs,
+                tuple(tuple(sorted(self._points_by_name[name].items())) for name in block.point_names))
+
+    def take_schedule(self, old_plan):
+        # carries the scan times of old_plan over after a reload.  Unchanged blocks keep their next scan, changed
+        # blocks of a device, function and interval that was already polled stay on that group's grid and only new
+        # groups are due at once.  Returns the number of (kept, changed, added, removed) blocks.
+        old_blocks = {old_plan.get_block_key(block): block for block in old_plan.blocks}
+        old_groups = {}  # group key: earliest next scan of the group
+        for block in old_plan.blocks:
+            group_key = get_group_key(block)
+            old_groups[group_key] = min(old_groups.get(group_key, block.next_due), block.next_due)
+
+        num_kept = num_changed = num_added = 0
+        for block in self.blocks:
+            old_block = old_blocks.pop(self.get_block_key(block), None)
+            if old_block is not None:
+                block.next_due = old_block.next_due
+                num_kept += 1
+            elif get_group_key(block) in old_groups:
+                block.next_due = old_groups[get_group_key(block)]
+                num_changed += 1
+            else:
+                num_added += 1
+        new_groups = {get_group_key(block) for block in self.blocks}
+        num_removed = sum(1 for block in old_blocks.values() if get_group_key(block) not in new_groups)
+        return num_kept, num_changed, num_added, num_removed
+
+    def scan_block(self, block, client):
+        # returns [(name, value), ...], every point of the block gets the error tuple if the read failed
+        error_code, data = client.read_raw(block.mb_id, block.mb_func, block.start_reg_zero, block.num_regs)
+        if error_code is not None:
+            return [(name, error_code) for name in block.point_names]
+        return block.decode(bytes(data))
+
+    def scan(self, client_pool, b_due_only=False):
+        # reads every block (or only the blocks that are due) through a mb_client.ClientPool, returns {name: value}
+        point_vals = {}
+        for block in self.blocks:
+            scan_time = time.monotonic()
+            if b_due_only and block.next_due > scan_time:
+                continue
+            point_vals.update(self.scan_block(block, client_pool.get(block.ip, block.port, block.transport)))
+            # stay on the interval grid, but skip ahead instead of bursting if a scan overran
+            block.next_due = max(block.next_due + block.interval, scan_time) if block.next_due else \
+                scan_time + block.interval
+        return point_vals
+
+
+def main(argv=None):
+    import argparse
+    try:
+        from mbpy import mb_client
+    except ImportError:
+        import mb_client
+
+    parser = argparse.ArgumentParser(description='Polls every point of a point map with as few reads as possible.')
+    parser.add_argument('point_map', type=str, help='Point map file (.json, .yaml, .yml or .csv).')
+    parser.add_argument('-p', '--poll', type=int, default=1, help='The number of scans. Default is 1, 0 is forever.')
+    parser.add_argument('-g', '--gap', type=int, default=10,
+                        help='Unused registers a block read may span between points. Default is 10.')
+    parser.add_argument('-to', '--timeout', type=mb_poll.timeout_bw, default=1500,
+                        help='Time in milliseconds to wait for reply message. Default is 1500.')
+    parser.add_argument('--plan', action='store_true', help='Print the block reads and exit.')
+    parser.add_argument('--shm', type=str, default=None,
+                        help='Also publish the latest values to a shared memory table with this name.')
+    parser.add_argument('--capture', type=str, default=None,
+                        help='Appends every request and reply frame to this file, see python -m mbpy.mb_capture.')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not print values.')
+    args = parser.parse_args(argv)
+
+    try:
+        poll_plan = PollPlan.from_file(args.point_map, args.gap)
+    except ValueError as err:
+        parser.error(str(err))
+    if not poll_plan.blocks:
+        parser.error(args.point_map + ' has no points to poll.')
+    if args.plan:
+        for block in poll_plan.blocks:
+            print(block.ip + ':' + str(block.port), block.transport, 'dev', block.mb_id, 'func', block.mb_func, 'start',
+                  block.start_reg_zero, 'regs', block.num_regs, 'every', block.interval, 's:',
+                  ', '.join(block.point_names))
+        return
+
+    value_table = None
+    if args.shm is not None:
+        try:
+            from mbpy import mb_shm
+        except ImportError:
+            import mb_shm
+        try:
+            value_table = mb_shm.SharedValueTable.from_poll_plan(poll_plan, args.shm)
+        except ValueError as err:
+            parser.error(str(err))
+
+    capture = None
+    if args.capture is not None:
+        try:
+            from mbpy import mb_capture
+        except ImportError:
+            import mb_capture
+        capture = mb_capture.FrameCapture(args.capture)
+
+    cur_poll = 0
+    with mb_client.ClientPool(args.timeout, capture=capture) as client_pool:
+        try:
+            while args.poll < 1 or cur_poll < args.poll:
+                time.sleep(max(0, poll_plan.get_next_due() - time.monotonic()))
+                point_vals = poll_plan.scan(client_pool, b_due_only=True)
+                if value_table is not None:
+                    value_table.publish(point_vals)
+                if not args.quiet:
+                    for name, val in point_vals.items():
+                        print(name, ':', val)
+                cur_poll += 1
+        except KeyboardInterrupt:
+            pass
+
+    if value_table is not None:
+        value_table.close()
+    if capture is not None:
+        capture.close()
+
+
+if __name__ == '__main__':
+    main()
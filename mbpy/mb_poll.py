@@ -1,29 +1,19 @@
 #!/usr/bin/python3
 
 import time
-import select
-import socket
-import argparse
-import csv
 import os
 # import fcntl
-import serial
-import serial.tools.list_ports
 from math import log10
 # import sys
 # from mbpy import mbcrc  # from folder import file
-from struct import pack, unpack
+from struct import Struct, pack, unpack, pack_into
 from datetime import datetime
-try:
-    import RPi.GPIO as GPIO
-except ImportError:
-    B_RPI_GPIO_EXISTS = False
-except RuntimeError:
-    B_RPI_GPIO_EXISTS = False
-else:
-    GPIO.setmode(GPIO.BOARD)
-    B_RPI_GPIO_EXISTS = True
-    # print('does exist')
+# socket, select, serial, csv, argparse and RPi.GPIO are imported where they are first used so that importing this
+# module stays fast and does not touch any hardware
+
+# RPi.GPIO module and whether it exists, both filled in by get_rpi_gpio() the first time a control pin is used
+GPIO = None
+B_RPI_GPIO_EXISTS = None
 
 
 ERASE_LINE = '\x1b[2K'
@@ -37,6 +27,12 @@ EIGHT_BYTE_FORMATS = ('uint64', 'sint64', 'um1k64', 'sm1k64', 'um10k64', 'sm10k6
 
 DATA_TYPE_LIST = ONE_BYTE_FORMATS + TWO_BYTE_FORMATS + FOUR_BYTE_FORMATS + SIX_BYTE_FORMATS + EIGHT_BYTE_FORMATS
 
+# network transports, a com port is always rtu
+#   tcp:     Modbus TCP, MBAP header and no crc
+#   rtu_tcp: rtu frames (address, pdu, crc) over a tcp connection, as spoken by most serial device servers
+#   udp:     Modbus TCP framing in datagrams, lost requests or replies are sent again
+NET_TRANSPORTS = ('tcp', 'rtu_tcp', 'udp')
+
 # set flag to determine if from commandline or called function
 B_CMD_LINE = False
 
@@ -69,6 +65,9 @@ MB_ERR_DICT = {1: ('Err', 1, 'ILLEGAL FUNCTION'),
                114: ('Err', 114, 'UNEXPECTED ERROR NUMBER'),
                115: ('Err', 115, 'UNABLE TO OPEN SERIAL PORT'),
                116: ('Err', 116, 'INVALID RASPBERRY PI GPIO PIN'),
+               117: ('Err', 117, 'INVALID TRANSPORT'),
+               118: ('Err', 118, 'INVALID AGGREGATE WINDOW'),
+               119: ('Err', 119, 'INVALID TIME SERIES LOG'),
                224: ('Err', 224, 'GATEWAY: INVALID SLAVE ID'),
                225: ('Err', 225, 'GATEWAY: RETURNED FUNCTION DOES NOT MATCH'),
                226: ('Err', 226, 'GATEWAY: GATEWAY TIMEOUT'),
@@ -140,11 +139,35 @@ def calc_crc_byte_array(st, start_crc=0xFFFF):
     return crcb
 
 
+def get_rpi_gpio():
+    # loads RPi.GPIO on first use, returns None if this is not a Raspberry Pi
+    global GPIO, B_RPI_GPIO_EXISTS
+    if B_RPI_GPIO_EXISTS is None:
+        try:
+            import RPi.GPIO as GPIO
+        except (ImportError, RuntimeError):
+            B_RPI_GPIO_EXISTS = False
+        else:
+            GPIO.setmode(GPIO.BOARD)
+            B_RPI_GPIO_EXISTS = True
+    return GPIO if B_RPI_GPIO_EXISTS else None
+
+
+def get_terminal_columns():
+    import shutil
+    return shutil.get_terminal_size().columns
+
+
+def argument_type_error(msg):
+    import argparse  # only needed when parsing the command line
+    return argparse.ArgumentTypeError(msg)
+
+
 # bandwidth checks for input variables:
 def device_bw(x):
     x = int(x)
     if x < 0 or x > 255:
-        raise argparse.ArgumentTypeError("Device ID must be between [0, 255].")
+        raise argument_type_error("Device ID must be between [0, 255].")
     return x
 
 
@@ -158,7 +181,7 @@ def validate_device_id(dev):
 def register_bw(x):
     x = int(x)
     if x < 0 or x > 99990:
-        raise argparse.ArgumentTypeError("Starting address must be in [0, 99990].")
+        raise argument_type_error("Starting address must be in [0, 99990].")
     return x
 
 
@@ -172,7 +195,7 @@ def validate_register(reg):
 def num_regs_bw(x):
     x = int(x)
     if x < 1 or x > 9999:
-        raise argparse.ArgumentTypeError("Length of addresses must be in [1, 9999].")
+        raise argument_type_error("Length of addresses must be in [1, 9999].")
     return x
 
 
@@ -186,7 +209,7 @@ def validate_num_registers(num_regs):
 def write_reg_bw(x):
     x = int(x)
     if x != (x & 0xFFFF):
-        raise argparse.ArgumentTypeError('Value to write must be in [0, 65535]')
+        raise argument_type_error('Value to write must be in [0, 65535]')
     return x
 
 
@@ -197,10 +220,17 @@ def validate_write_value(wrt_val):
     return wrt_val, None
 
 
+def write_vals_bw(x):
+    write_vals = [val.strip() for val in x.split(',') if val.strip()]
+    if not 1 <= len(write_vals) <= 121:
+        raise argument_type_error('Between 1 and 121 values can be written.')
+    return write_vals
+
+
 def timeout_bw(x):
     x = int(x)
     if x < 1 or x > 10000:
-        raise argparse.ArgumentTypeError("Timeout should be less than 10000 ms.")
+        raise argument_type_error("Timeout should be less than 10000 ms.")
     return x
 
 
@@ -213,14 +243,14 @@ def validate_timeout(timeout):
 
 def modbus_func_bw(x):
     x = int(x)
-    if x not in (1, 2, 3, 4, 5, 6, 16):  # still need to add reading coils
-        raise argparse.ArgumentTypeError("ILLEGAL MODBUS FUNCTION")
+    if x not in (1, 2, 3, 4, 5, 6, 16, 23):  # still need to add reading coils
+        raise argument_type_error("ILLEGAL MODBUS FUNCTION")
     return x
 
 
 def validate_modbus_function(func):
     func = int(func)
-    if func not in (1, 2, 3, 4, 5, 6, 16):
+    if func not in (1, 2, 3, 4, 5, 6, 16, 23):
         return None, MB_ERR_DICT[1]  # illegal function
     return func, None
 
@@ -229,7 +259,7 @@ def pin_cntl_bw(x):
     if x is not None:
         x = int(x)
         if x not in (3, 5, 7, 11, 12, 13, 15, 16, 18, 19, 21, 22, 23, 24, 26, 29, 31, 32, 33, 35, 36, 37, 38, 40):
-            raise argparse.ArgumentTypeError('Illegal Raspberr Pi pin.')
+            raise argument_type_error('Illegal Raspberr Pi pin.')
     return x
 
 
@@ -260,6 +290,7 @@ def validate_ip(ip):
         if len(ip_arr) != 4:
             if os.name == 'nt':
                 if len(ip_arr) == 1:
+                    import serial.tools.list_ports
                     com_ports = list(serial.tools.list_ports.comports())
                     ip_upper = ip_func.upper()
 
@@ -321,6 +352,115 @@ def print_errs_prog_bar(verbosity, poll_iter, row_len, b_poll_forever, valid_pol
                 print()
 
 
+# the 8 bits of every byte value as bytes of 0 or 1, lowest bit first the way coils and inputs are packed
+BYTE_BITS = tuple(bytes((byte >> bit) & 0x1 for bit in range(8)) for byte in range(256))
+
+
+def unpack_bits(packed, num_bits):
+    # coil or input reply data to one byte of 0 or 1 per bit, a table lookup per byte instead of a loop per bit
+    return b''.join([BYTE_BITS[byte] for byte in packed])[:num_bits]
+
+
+def get_changed_bits(packed, prev_packed, num_bits):
+    # one byte of 0 or 1 per bit, 1 where the bit differs from the previous read, every bit is new without one
+    if prev_packed is None or len(prev_packed) != len(packed):
+        return b'\x01' * num_bits
+    changed = int.from_bytes(packed, byteorder='little') ^ int.from_bytes(prev_packed, byteorder='little')
+    if not changed:
+        return bytes(num_bits)
+    return unpack_bits(changed.to_bytes(len(packed), byteorder='little'), num_bits)
+
+
+# struct codes of the types that unpack straight from big endian bytes, the rest are built from their 16 bit words
+DIRECT_CODES = {'uint8': 'B', 'sint8': 'b', 'uint16': 'H', 'sint16': 'h', 'bin': 'H', 'hex': 'H', 'uint32': 'I',
+                'sint32': 'i', 'float': 'f', 'uint64': 'Q', 'sint64': 'q', 'dbl': 'd'}
+MOD_TYPES = {'um1k32': 1000, 'sm1k32': 1000, 'um10k32': 10000, 'sm10k32': 10000, 'um1k48': 1000, 'sm1k48': 1000,
+             'um10k48': 10000, 'sm10k48': 10000, 'um1k64': 1000, 'sm1k64': 1000, 'um10k64': 10000, 'sm10k64': 10000,
+             'sm1k16': 0, 'sm10k16': 0, 'uint48': 0x10000, 'engy': 0}
+
+
+class RegisterDecoder:
+    """Decodes the data bytes of a reply in place, the same values as ModbusData without printing or raw bytes.
+
+    A value's registers come low word first unless word swapped, with the high byte first unless byte swapped.  A
+    few slice copies, one per byte of a value, put every value of the reply into big endian order in a scratch buffer
+    kept between polls, and one struct call unpacks them all.  When the order is already big endian (16 bit types,
+    or word swapped 32 and 64 bit types) the reply is unpacked where it lies.
+    """
+    def __init__(self, data_type, byte_swap=False, word_swap=False):
+        self.data_type = data_type
+        if data_type in FOUR_BYTE_FORMATS:
+            num_words = 2
+        elif data_type in SIX_BYTE_FORMATS:
+            num_words = 3
+        elif data_type in EIGHT_BYTE_FORMATS:
+            num_words = 4
+        else:
+            num_words = 1
+        self.num_words = num_words
+        self.val_size = 2 * num_words
+        # offset in the reply of each byte of a value in big endian order
+        self.byte_order = []
+        for byte_iter in range(self.val_size):
+            reg_iter = byte_iter // 2 if word_swap else num_words - 1 - byte_iter // 2
+            self.byte_order.append(2 * reg_iter + ((byte_iter & 0x1) ^ bool(byte_swap)))
+        self.b_in_place = self.byte_order == list(range(self.val_size))
+        if data_type in ONE_BYTE_FORMATS:
+            self.code, self.code_size = DIRECT_CODES[data_type], 1
+        elif data_type in DIRECT_CODES:
+            self.code, self.code_size = DIRECT_CODES[data_type], self.val_size
+        else:
+            self.code, self.code_size = 'H' * num_words, self.val_size  # ascii, mod types, uint48 and engy
+        self._scratch = bytearray()
+        self._structs = {}  # data length: Struct
+
+    def decode(self, data):
+        num_bytes = len(data) - len(data) % self.val_size
+        if self.b_in_place:
+            buf = data
+        else:
+            if len(self._scratch) < num_bytes:
+                self._scratch = bytearray(num_bytes)
+            buf = self._scratch
+            for dst_iter, src_iter in enumerate(self.byte_order):
+                buf[dst_iter:num_bytes:self.val_size] = data[src_iter:num_bytes:self.val_size]
+
+        unpack_vals = self._structs.get(num_bytes)
+        if unpack_vals is None:
+            unpack_vals = Struct('>' + self.code * (num_bytes // self.code_size)).unpack_from
+            self._structs[num_bytes] = unpack_vals
+        vals = unpack_vals(buf)
+
+        data_type = self.data_type
+        if data_type in DIRECT_CODES:
+            if data_type == 'bin':
+                return [bin(val) for val in vals]
+            elif data_type == 'hex':
+                return [hex(val) for val in vals]
+            return list(vals)
+        elif data_type == 'ascii':
+            return [bytes(buf[byte_iter:byte_iter + 2]).decode('ascii', 'ignore')
+                    for byte_iter in range(0, num_bytes, 2)]
+        elif data_type in ('sm1k16', 'sm10k16'):
+            return [-(val & 0x7fff) if val >> 15 else val for val in vals]
+        elif data_type == 'engy':
+            # signed power of ten in the high byte of the top word, 48 bit mantissa in the other three words
+            return [((r2 << 32) | (r1 << 16) | r0) * (10 ** (((r3 >> 8) ^ 0x80) - 0x80))
+                    for r3, r2, r1, r0 in zip(vals[::4], vals[1::4], vals[2::4], vals[3::4])]
+
+        # words of each value come highest first, signed mod types keep the sign in the top bit of the highest word
+        mod = MOD_TYPES[data_type]
+        b_signed = data_type.startswith('s')
+        otpt = []
+        for val_iter in range(0, len(vals), self.num_words):
+            high_word = vals[val_iter]
+            val = high_word & 0x7fff if b_signed else high_word
+            for word in vals[val_iter + 1:val_iter + self.num_words]:
+                val = val * mod + word
+            otpt.append(-val if b_signed and high_word >> 15 else val)
+        return otpt
+
+
 class ModbusData:
     def __init__(self, start_reg, num_vals, byte_swap, word_swap, b_print, data_type, mb_func, b_raw_bytes=False):
         self.mb_func = mb_func
@@ -341,7 +481,7 @@ class ModbusData:
             self.start_reg = start_reg
         elif self.mb_func in (2, 5):
             self.start_reg = start_reg + 1 * 10 ** num_digits
-        elif self.mb_func in (3, 6):
+        elif self.mb_func in (3, 6, 23):
             self.start_reg = start_reg + 4 * 10 ** num_digits
         elif self.mb_func == 4:
             self.start_reg = start_reg + 3 * 10 ** num_digits
@@ -355,8 +495,36 @@ class ModbusData:
         self.data_type = data_type
         self._value_array = []
         self.b_raw_bytes = b_raw_bytes
+        self._bit_array = b''  # coils and inputs of the latest read as bytes of 0 or 1
+        self._prev_packed = None
+        self._changed_bits = b''
+        # register reads that are neither printed nor kept raw are decoded straight from the reply buffer
+        if mb_func in (3, 4, 23) and not b_raw_bytes and b_print is None and \
+                (data_type in DIRECT_CODES or data_type in MOD_TYPES or data_type == 'ascii'):
+            self._decoder = RegisterDecoder(data_type, byte_swap, word_swap)
+        else:
+            self._decoder = None
 
     def translate_regs_to_vals(self, recv_packet):
+        # recv_packet is the data bytes of the reply as a list, bytes or a memoryview into the receive buffer
+        if self._decoder is not None:
+            self._value_array = self._decoder.decode(recv_packet)
+            return
+
+        if self.mb_func in (1, 2) and not self.b_raw_bytes and self.b_print is None:
+            packed = bytes(recv_packet)
+            if self.byte_swap:
+                swapped = bytearray(packed)
+                swapped[::2], swapped[1::2] = packed[1::2], packed[::2]
+                packed = bytes(swapped)
+            self._bit_array = unpack_bits(packed, self.num_vals)
+            self._changed_bits = get_changed_bits(packed, self._prev_packed, self.num_vals)
+            self._prev_packed = packed
+            self._value_array = list(self._bit_array)
+            return
+
+        if not isinstance(recv_packet, list):
+            recv_packet = list(recv_packet)
         self._value_array = []
 
         if self.b_raw_bytes:
@@ -537,7 +705,7 @@ class ModbusData:
                         iter_reg += 2
         elif self.data_type in SIX_BYTE_FORMATS:  # ('uint48', 'sint48', 'um1k48', 'sm1k48', 'um10k48', 'sm10k48'):
             if self.word_swap:
-                raw_regs[::3], raw_regs[2::3] = raw_regs[2:3], raw_regs[::3]
+                raw_regs[::3], raw_regs[2::3] = raw_regs[2::3], raw_regs[::3]
 
             if self.b_raw_bytes:
                 for mb_reg in raw_regs:
@@ -645,6 +813,121 @@ class ModbusData:
     def get_value_array(self):
         return self._value_array
 
+    def get_bit_array(self):
+        # coils or inputs of the latest read, one byte of 0 or 1 each
+        return self._bit_array
+
+    def get_changed_bits(self):
+        # 1 for each coil or input that changed since the read before, all 1 after the first read
+        return self._changed_bits
+
+
+def coerce_write_value(val, data_type):
+    # values from the command line arrive as strings, convert them to match the data type
+    if not isinstance(val, str) or data_type == 'ascii':
+        return val
+    if data_type in ('float', 'dbl', 'engy'):
+        return float(val)
+    return int(val, 0)  # allows 0x and 0b prefixes for hex and bin
+
+
+def encode_val_to_regs(val, data_type):
+    # returns registers for a single value with the low word first, the inverse of translate_regs_to_vals
+    if data_type in ('bin', 'hex', 'uint16'):
+        if val != (val & 0xFFFF):
+            return None
+        return [val]
+    elif data_type == 'sint16':
+        if val < -0x8000 or val > 0x7FFF:
+            return None
+        return [val & 0xFFFF]
+    elif data_type == 'ascii':
+        chars = val.encode('ascii', 'ignore')[:2].ljust(2, b'\x00')
+        return [(chars[0] << 8) | chars[1]]
+    elif data_type == 'float':
+        val = unpack('I', pack('f', val))[0]
+        return [val & 0xFFFF, val >> 16]
+    elif data_type == 'dbl':
+        val = unpack('Q', pack('d', val))[0]
+        return [val & 0xFFFF, (val >> 16) & 0xFFFF, (val >> 32) & 0xFFFF, val >> 48]
+    elif data_type in ('uint32', 'sint32', 'uint48', 'uint64', 'sint64'):
+        num_regs = int(data_type[4:]) // 16
+        if data_type.startswith('s'):
+            if val < -(1 << (num_regs * 16 - 1)) or val >= (1 << (num_regs * 16 - 1)):
+                return None
+            val &= (1 << (num_regs * 16)) - 1
+        elif val < 0 or val >= (1 << (num_regs * 16)):
+            return None
+        return [(val >> (16 * reg_iter)) & 0xFFFF for reg_iter in range(num_regs)]
+    elif data_type == 'engy':
+        # 48 bit mantissa with a signed power of ten exponent in the high byte of the last register
+        engr = 0
+        while val != int(val) and engr > -9:
+            val *= 10
+            engr -= 1
+        val = int(round(val))
+        if val < 0 or val >= (1 << 48):
+            return None
+        return [val & 0xFFFF, (val >> 16) & 0xFFFF, (val >> 32) & 0xFFFF, (engr & 0xFF) << 8]
+    elif 'm1' in data_type:
+        # mod 1000 and mod 10000 formats, signed versions carry the sign in the top bit of the highest register
+        mod = 10000 if 'm10k' in data_type else 1000
+        num_regs = int(data_type[-2:]) // 16
+        sign_bit = 0
+        if data_type.startswith('s') and val < 0:
+            sign_bit = 0x8000
+            val = -val
+        elif val < 0:
+            return None
+        regs = []
+        for reg_iter in range(num_regs - 1):
+            regs.append(val % mod)
+            val //= mod
+        if (data_type.startswith('s') and val > 0x7FFF) or val > 0xFFFF:
+            return None
+        regs.append(val | sign_bit)
+        return regs
+    return None
+
+
+def translate_vals_to_regs(vals, data_type, byte_swap=False, word_swap=False):
+    # turns a list of typed values into the registers to send, applying word and byte swaps like the read side
+    if data_type not in DATA_TYPE_LIST:
+        return None, MB_ERR_DICT[102]  # invalid data type
+
+    try:
+        vals = [coerce_write_value(val, data_type) for val in vals]
+    except (TypeError, ValueError):
+        return None, MB_ERR_DICT[3]  # illegal data value
+
+    regs = []
+    if data_type in ONE_BYTE_FORMATS:  # ('uint8', 'sint8'):
+        if len(vals) % 2:
+            vals.append(0)  # pad out the last register
+        for val_high, val_low in zip(vals[::2], vals[1::2]):
+            for byte_val in (val_high, val_low):
+                if (data_type == 'uint8' and byte_val != (byte_val & 0xFF)) or \
+                        (data_type == 'sint8' and (byte_val < -0x80 or byte_val > 0x7F)):
+                    return None, MB_ERR_DICT[3]  # illegal data value
+            regs.append(((val_high & 0xFF) << 8) | (val_low & 0xFF))
+    else:
+        for val in vals:
+            try:
+                val_regs = encode_val_to_regs(val, data_type)
+            except (TypeError, ValueError, OverflowError, AttributeError):
+                val_regs = None
+            if val_regs is None:
+                return None, MB_ERR_DICT[3]  # illegal data value
+
+            if word_swap:
+                val_regs.reverse()
+            regs.extend(val_regs)
+
+    if byte_swap:
+        regs = [((reg & 0xFF) << 8) | (reg >> 8) for reg in regs]
+
+    return regs, None
+
 
 def get_expected_num_ret_bytes(b_write_mb, mb_func, num_vals, data_type):
     num_regs = 1
@@ -692,8 +975,53 @@ def make_csv_header(mb_func, start_reg_zero, num_vals, num_regs, data_type):
     return csv_header
 
 
-def make_request_packet(serial_port, b_write_mb, mb_id, mb_func, start_reg_zero, val_to_write, num_regs):
+def make_multiple_regs_pdu(mb_func, start_reg_zero, num_regs, wrt_start_reg_zero, wrt_regs):
+    # function 23 (read/write multiple registers) or 16 (write multiple registers) with a list of registers
+    if mb_func == 23:
+        req_pdu = bytearray(10)
+        req_pdu[0] = 23
+        req_pdu[1] = (start_reg_zero >> 8) & 0xFF  # read starting register high byte
+        req_pdu[2] = start_reg_zero & 0xFF         # read starting register low byte
+        req_pdu[3] = (num_regs >> 8) & 0xFF        # number of registers to read high byte
+        req_pdu[4] = num_regs & 0xFF               # number of registers to read low byte
+        req_pdu[5] = (wrt_start_reg_zero >> 8) & 0xFF  # write starting register high byte
+        req_pdu[6] = wrt_start_reg_zero & 0xFF         # write starting register low byte
+    else:
+        req_pdu = bytearray(6)
+        req_pdu[0] = 16
+        req_pdu[1] = (wrt_start_reg_zero >> 8) & 0xFF
+        req_pdu[2] = wrt_start_reg_zero & 0xFF
+
+    req_pdu[-3] = (len(wrt_regs) >> 8) & 0xFF  # number of registers to write high byte
+    req_pdu[-2] = len(wrt_regs) & 0xFF         # number of registers to write low byte
+    req_pdu[-1] = (len(wrt_regs) * 2) & 0xFF   # number of bytes to follow
+    for wrt_reg in wrt_regs:
+        req_pdu.append((wrt_reg >> 8) & 0xFF)
+        req_pdu.append(wrt_reg & 0xFF)
+    return req_pdu
+
+
+def make_request_packet(serial_port, b_write_mb, mb_id, mb_func, start_reg_zero, val_to_write, num_regs,
+                        wrt_start_reg_zero=None, wrt_regs=None):
     packet_write_list = None
+    if wrt_regs is not None:  # function 23, or function 16 given a proper list of registers
+        req_pdu = make_multiple_regs_pdu(mb_func, start_reg_zero, num_regs, wrt_start_reg_zero, wrt_regs)
+
+        if serial_port is not None:  # com port communication
+            req_packet = bytearray([mb_id & 0xFF]) + req_pdu
+            req_packet.extend(calc_crc_byte_array(req_packet))
+            if b_write_mb:
+                packet_write_list = list(req_packet[:6])  # slave echoes the address and register count
+        else:  # TCP/IP communication
+            req_packet = bytearray(6)
+            req_packet[4] = ((len(req_pdu) + 1) >> 8) & 0xFF
+            req_packet[5] = (len(req_pdu) + 1) & 0xFF
+            req_packet.append(mb_id & 0xFF)
+            req_packet.extend(req_pdu)
+            if b_write_mb:
+                packet_write_list = list(req_packet[6:12])
+        return req_packet, packet_write_list
+
     if serial_port is not None:  # com port communication
         req_packet = bytearray(6)
         req_packet[0] = mb_id & 0xFF           # device address
@@ -806,6 +1134,39 @@ def make_request_packet(serial_port, b_write_mb, mb_id, mb_func, start_reg_zero,
     return req_packet, packet_write_list
 
 
+class RequestTemplate:
+    """Request packet compiled once, only the transaction id is patched in before each send."""
+    __slots__ = ('serial_port', 'mb_id', 'mb_func', 'num_regs', 'exp_num_bytes_ret', 'packet', 'packet_write_list',
+                 'crc', '_packet_view')
+
+    def __init__(self, serial_port, b_write_mb, mb_id, mb_func, start_reg_zero, val_to_write, num_regs,
+                 exp_num_bytes_ret, wrt_start_reg_zero=None, wrt_regs=None):
+        self.serial_port = serial_port
+        self.mb_id = mb_id
+        self.mb_func = mb_func
+        self.num_regs = num_regs
+        self.exp_num_bytes_ret = exp_num_bytes_ret
+        self.packet, self.packet_write_list = make_request_packet(serial_port, b_write_mb, mb_id, mb_func,
+                                                                  start_reg_zero, val_to_write, num_regs,
+                                                                  wrt_start_reg_zero, wrt_regs)
+        if serial_port is not None:
+            self.crc = bytes(self.packet[-2:])  # rtu packets never change, so neither does the crc
+        else:
+            self.crc = None
+        self._packet_view = memoryview(self.packet)
+
+    def get_packet(self, trans_id=None):
+        # returns a view of the packet to hand straight to sendall or serial write
+        if trans_id is not None and self.serial_port is None:
+            pack_into('>H', self.packet, 0, trans_id & 0xFFFF)  # MBAP transaction id
+        return self._packet_view
+
+
+def setup_rpi_pin(pi_pin_cntl):
+    if pi_pin_cntl is not None and get_rpi_gpio() is not None:
+        GPIO.setup(pi_pin_cntl, GPIO.OUT)
+
+
 def set_rpi_pin_tx(pi_pin_cntl):
     if pi_pin_cntl is not None and B_RPI_GPIO_EXISTS:
         GPIO.output(pi_pin_cntl, GPIO.LOW)
@@ -816,6 +1177,24 @@ def set_rpi_pin_rx(pi_pin_cntl):
         GPIO.output(pi_pin_cntl, GPIO.HIGH)
 
 
+def open_serial_port(serial_port, mb_timeout, pi_pin_cntl=None, baudrate=9600):
+    # mb_timeout in seconds, keep trying while the port is busy until the timeout runs out
+    import serial
+    setup_rpi_pin(pi_pin_cntl)
+    start_serial_time = time.time()
+
+    while True:
+        if time.time() - start_serial_time > mb_timeout:
+            return None, MB_ERR_DICT[115]  # port was busy for duration of timeout
+        try:
+            serial_conn = serial.Serial(serial_port, timeout=mb_timeout, baudrate=baudrate, exclusive=True)
+        except serial.serialutil.SerialException:
+            pass  # port is busy
+        else:
+            set_rpi_pin_tx(pi_pin_cntl)
+            return serial_conn, None
+
+
 def verify_no_comm_errs(serial_port, recv_packet_bytearr, verbosity, num_prnt_rws):
     error_code = None
     recv_packet = None
@@ -823,7 +1202,7 @@ def verify_no_comm_errs(serial_port, recv_packet_bytearr, verbosity, num_prnt_rw
     if serial_port is not None:  # using com port!
         if recv_packet_bytearr:  # recv_packet_bytearr != []:
             # print(list(rec_packet_bytearr))
-            recv_packet = list(recv_packet_bytearr[:-2])
+            recv_packet = memoryview(recv_packet_bytearr)[:-2]  # a view, the frame is not copied
 
             if calc_crc_byte_array(recv_packet) != recv_packet_bytearr[-2:]:
                 error_code = MB_ERR_DICT[113]
@@ -835,13 +1214,13 @@ def verify_no_comm_errs(serial_port, recv_packet_bytearr, verbosity, num_prnt_rw
                 tcp_hdr_exp_len = int.from_bytes(recv_packet_bytearr[4:6], byteorder='big')
                 # print(list(packetbt), '\n'*rws, end='')
                 if tcp_hdr_exp_len == (len(recv_packet_bytearr) - 6):
-                    recv_packet = list(recv_packet_bytearr[6:])
+                    recv_packet = memoryview(recv_packet_bytearr)[6:]  # a view, the frame is not copied
                     # print(packetrec)
                 else:
                     error_code = MB_ERR_DICT[108]  # UNEXPECTED MODBUS MESSAGE LENGTH
 
                     try:
-                        print('Possible ASCII message returned:', recv_packet_bytearr.decode('ascii'),
+                        print('Possible ASCII message returned:', bytes(recv_packet_bytearr).decode('ascii'),
                               '\n' * num_prnt_rws, end='')
                     except UnicodeDecodeError:
                         print('Possible ASCII message returned:', list(recv_packet_bytearr), '\n' * num_prnt_rws,
@@ -849,7 +1228,7 @@ def verify_no_comm_errs(serial_port, recv_packet_bytearr, verbosity, num_prnt_rw
             else:
                 if verbosity is not None:
                     try:
-                        print(recv_packet_bytearr.decode('ascii'), '\n' * num_prnt_rws, end='')
+                        print(bytes(recv_packet_bytearr).decode('ascii'), '\n' * num_prnt_rws, end='')
                     except UnicodeDecodeError:
                         print(list(recv_packet_bytearr), '\n' * num_prnt_rws, end='')
                 error_code = MB_ERR_DICT[106]  # UNEXPECTED RETURN DATA, SOCKET LIKELY CLOSED BY OTHER
@@ -869,14 +1248,14 @@ def verify_no_modbus_errs(recv_packet, mb_id, mb_func, val_to_write, b_write_mb,
     if mb_id == recv_packet[0] or recv_packet[0] == 0:  # check modbus device
         if recv_packet[1] == mb_func:  # check modbus function
             if b_write_mb:  # if write command, will have different checks
-                if packet_write_list == recv_packet:
+                if packet_write_list == list(recv_packet):
                     if mb_func == 6:
                         register_list = recv_packet[4:]
                     else:
                         register_list = [0, val_to_write]
                 else:
                     error_code = MB_ERR_DICT[111]
-                    print('first', recv_packet)
+                    print('first', list(recv_packet))
             else:
                 if recv_packet[2] == (len(recv_packet) - 3):  # check length of modbus message
                     register_list = recv_packet[3:]
@@ -888,7 +1267,7 @@ def verify_no_modbus_errs(recv_packet, mb_id, mb_func, val_to_write, b_write_mb,
             error_code = MB_ERR_DICT[110]  # UNEXPECTED MODBUS FUNCTION RETURNED
     else:
         error_code = MB_ERR_DICT[111]  # UNEXPECTED MODBUS SLAVE DEVICE MESSAGE
-        print('second', recv_packet)
+        print('second', list(recv_packet))
 
     return error_code, register_list
 
@@ -909,7 +1288,9 @@ def tick_poll_and_wait(cur_poll, num_polls, b_poll_forever, poll_start_time, pol
 # run script
 def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, data_type='float', b_byteswap=False,
                   b_wordswap=False, zero_based=False, mb_timeout=1500, file_name_input=None, verbosity=None, port=502,
-                  poll_delay=1000, mb_func=3, pi_pin_cntl=None, b_pi_pin_cleanup=True, b_raw_bytes=False):
+                  poll_delay=1000, mb_func=3, pi_pin_cntl=None, b_pi_pin_cleanup=True, b_raw_bytes=False,
+                  write_vals=None, write_reg=None, capture_file=None, aggregate=None,
+                  tslog_file=None, profiler=None):
 
     if b_help:
         print('Polls a modbus device through network.',
@@ -933,9 +1314,23 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
               '\nmb_func:     Modbus function. Default is 3.'
               '\npi_pin_cntl: Raspberry Pi GPIO pin (using BOARD pinouts) for Tx control of 485 chip.  If None, then '
               '\nb_raw_bytes: Returns bytes after accounting for word and byte swaps.'
+              '\nwrite_vals:  Values (of data_type) to write with function 23 before reading.'
+              '\nwrite_reg:   The address of the first register to write with function 23.'
+              '\ncapture_file: Appends every request and reply frame to this capture file.'
+              '\naggregate:   Window specs (WIDTH[/PANES][:STATS]) to write to file_name instead of every poll.'
+              '\ntslog_file:  Appends every poll to this compressed time series log, see python -m mbpy.mb_tslog.'
+              '\nprofiler:    mb_profile.PhaseProfiler, or anything with start() and mark(phase), to time each phase.'
               )
         return
 
+    # mark_phase(phase) charges the time since the previous mark to phase, a no-op unless a profiler is given
+    if profiler is not None:
+        profiler.start()
+        mark_phase = profiler.mark
+    else:
+        def mark_phase(phase):
+            pass
+
     ip, serial_port, error_code = validate_ip(ip)
     if error_code is not None:
         return error_code
@@ -967,8 +1362,6 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
         pi_pin_cntl, error_code = validate_cntl_pin(pi_pin_cntl)
         if error_code is not None:
             return error_code
-        if pi_pin_cntl is not None and B_RPI_GPIO_EXISTS:
-            GPIO.setup(pi_pin_cntl, GPIO.OUT)
 
     mb_timeout /= 1000  # mb_timeout / 1000  # convert from ms to s
     val_to_write = None
@@ -980,6 +1373,8 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
         val_to_write, error_code = validate_write_value(num_vals)
         if error_code is not None:
             return error_code
+        if mb_func == 5 and val_to_write not in (0, 1):
+            return MB_ERR_DICT[3]  # coils are either on or off
     else:
         b_write_mb = False
 
@@ -990,6 +1385,27 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
     if start_reg_zero < 0:
         return MB_ERR_DICT[103]  # raise ValueError('Invalid register lookup.')
 
+    # function 23 writes a block of registers then reads a block back in the same request
+    wrt_start_reg_zero = None
+    wrt_regs = None
+    if mb_func == 23:
+        if write_vals is None or write_reg is None:
+            return MB_ERR_DICT[3]  # illegal data value
+
+        write_reg, error_code = validate_register(write_reg)
+        if error_code is not None:
+            return error_code
+
+        wrt_start_reg_zero = write_reg - (not zero_based)
+        if wrt_start_reg_zero < 0:
+            return MB_ERR_DICT[103]
+
+        wrt_regs, error_code = translate_vals_to_regs(write_vals, data_type, b_byteswap, b_wordswap)
+        if error_code is not None:
+            return error_code
+        if len(wrt_regs) < 1 or len(wrt_regs) > 121 or num_regs > 125:
+            return MB_ERR_DICT[3]  # more than the function allows in one request
+
     # check if infinite polling
     if num_polls != 1 and b_write_mb:
         return MB_ERR_DICT[112]  # shouldn't have multiple polls for a write command
@@ -1004,7 +1420,7 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
             b_poll_forever = False
 
     # check filename for validity
-    file_name = validate_file_name(file_name_input)
+    file_name, error_code = validate_file_name(file_name_input)
 
     # check os to determine if there will be a problem with different print options
     if verbosity in (1, 3):
@@ -1034,50 +1450,60 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
         if os.name == 'nt':
             prog_bar_len = 65 - (2 * len(str(num_polls)))  # 65 = 80 - 15
         else:
-            rows, columns = os.popen('stty size', 'r').read().split()  # determine size of terminal
-            prog_bar_len = int(columns) - 15 - (2 * len(str(num_polls)))
+            prog_bar_len = get_terminal_columns() - 15 - (2 * len(str(num_polls)))
     else:
         prog_bar_len = 0
 
     mb_data = ModbusData(start_reg, num_vals, b_byteswap, b_wordswap, verbosity, data_type, mb_func,
                          b_raw_bytes=b_raw_bytes)
 
-    if file_name_input is not None:
+    aggregator = None
+    if aggregate and file_name_input is not None:
+        if b_write_mb or data_type in ('hex', 'bin', 'ascii'):
+            return MB_ERR_DICT[118]  # nothing to take the mean of
         try:
-            csv_file = open(file_name, 'w', newline='')
-        except IOError:
-            return MB_ERR_DICT[105]
-        else:
-            csv_file_wrtr = csv.writer(csv_file)
-            csv_header = make_csv_header(mb_func, start_reg_zero, num_vals, num_regs, data_type)
-            csv_file_wrtr.writerow(csv_header)
-    else:
-        csv_file = None
-        csv_file_wrtr = None
+            from mbpy import mb_aggregate  # folder.file import
+        except ImportError:
+            import mb_aggregate  # run from inside the mbpy folder
+        try:
+            aggregator = mb_aggregate.Aggregator(aggregate)
+        except ValueError:
+            return MB_ERR_DICT[118]
+
+    tslog = None
+    if tslog_file is not None and (b_write_mb or b_raw_bytes):
+        return MB_ERR_DICT[119]
+
+    def record_poll(otpt):
+        # every poll, good or not, to the stages that want all of them
+        ts_ns = time.time_ns()
+        if aggregator is not None:
+            aggregator.add(None, ts_ns, otpt)
+        if tslog is not None:
+            tslog.append(ts_ns, otpt)
 
     # ~ #create packet here:
-    req_packet, packet_write_list = make_request_packet(serial_port, b_write_mb, mb_id, mb_func, start_reg_zero,
-                                                        val_to_write, num_regs)
+    req_template = RequestTemplate(serial_port, b_write_mb, mb_id, mb_func, start_reg_zero, val_to_write, num_regs,
+                                   exp_num_bytes_ret, wrt_start_reg_zero, wrt_regs)
+    req_packet = req_template.get_packet()
+    packet_write_list = req_template.packet_write_list
+
+    import socket
+    import select
 
     serial_conn = None
+    # every reply is received into this one buffer and checked and decoded through views of it
+    recv_buf = bytearray(1024)
+    recv_view = memoryview(recv_buf)
+    mark_phase('setup')
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_conn:
         tcp_conn.settimeout(mb_timeout)
 
         if serial_port is not None:  # COM port
-            b_open_serial_port = False
-            start_serial_time = time.time()
-
-            while not b_open_serial_port:
-                if time.time() - start_serial_time > mb_timeout:
-                    return MB_ERR_DICT[115]  # port was busy for duration of timeout
-                try:
-                    serial_conn = serial.Serial(serial_port, timeout=mb_timeout, baudrate=9600, exclusive=True)
-                except serial.serialutil.SerialException:
-                    pass  # port is busy
-                else:
-                    b_open_serial_port = True
-                    set_rpi_pin_tx(pi_pin_cntl)
+            serial_conn, error_code = open_serial_port(serial_port, mb_timeout, pi_pin_cntl)
+            if error_code is not None:
+                return error_code
         else:
             try:
                 tcp_conn.connect((ip, port))
@@ -1090,8 +1516,58 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
                 return MB_ERR_DICT[19]
 
             tcp_conn.setblocking(0)
+        mark_phase('connect')
+
+        # the files are only made once there is a connection, so a failed start leaves nothing behind
+        if file_name_input is not None:
+            import csv
+            try:
+                csv_file = open(file_name, 'w', newline='')
+            except IOError:
+                return MB_ERR_DICT[105]
+            else:
+                csv_file_wrtr = csv.writer(csv_file)
+                csv_header = make_csv_header(mb_func, start_reg_zero, num_vals, num_regs, data_type)
+                if aggregator is not None:
+                    # one row per stat of each window that closes, in place of one row per poll
+                    csv_header[1:1] = ['Window', 'Stat']
+
+                    def write_window(key, window, end_ns, stats):
+                        window_time = str(datetime.fromtimestamp(end_ns / 1e9))
+                        csv_file_wrtr.writerows([window_time, window.get_name(), stat] +
+                                                (stat_vals if isinstance(stat_vals, list) else [stat_vals])
+                                                for stat, stat_vals in stats.items())
+                    aggregator.on_window = write_window
+                csv_file_wrtr.writerow(csv_header)
+        else:
+            csv_file = None
+            csv_file_wrtr = None
+
+        if tslog_file is not None:
+            try:
+                from mbpy import mb_tslog  # folder.file import
+            except ImportError:
+                import mb_tslog  # run from inside the mbpy folder
+            try:
+                # coils and discrete inputs always decode to 0 or 1
+                tslog = mb_tslog.TimeSeriesLog(tslog_file, 'uint8' if mb_func in (1, 2) else data_type, num_vals)
+            except (ValueError, IOError):
+                if csv_file is not None:
+                    csv_file.close()
+                return MB_ERR_DICT[119]
+
         valid_polls = 0
 
+        capture = None
+        if capture_file is not None:
+            try:
+                from mbpy import mb_capture  # folder.file import
+            except ImportError:
+                import mb_capture  # run from inside the mbpy folder
+            capture = mb_capture.FrameCapture(capture_file)
+            capture_transport = 'rtu' if serial_port is not None else 'tcp'
+            capture_endpoint = serial_port if serial_port is not None else ip + ':' + str(port)
+
         cur_poll = 1
         while cur_poll < num_polls + 1:
             try:
@@ -1105,6 +1581,9 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
                 else:
                     # clear Rx buffer !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
                     tcp_conn.sendall(req_packet)  # send modbus request
+                if capture is not None:
+                    capture.record_request(capture_transport, capture_endpoint, req_packet)
+                mark_phase('send')
 
                 if verbosity in (1, 3):
                     print('\x1b[', num_prnt_rws + 1, 'F' + ERASE_LINE, sep='', end='\r')
@@ -1113,38 +1592,58 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
                     print('\nPoll', cur_poll, 'at:', str(datetime.now()))
 
                 poll_start_time = time.time()
+                mark_phase('display')
 
                 if serial_port is not None:  # using com port!
-                    recv_packet_bytearr = serial_conn.read(exp_num_bytes_ret)  # blocks for mb_timeout seconds
+                    # blocks for mb_timeout seconds
+                    recv_packet_bytearr = recv_view[:serial_conn.readinto(recv_view[:exp_num_bytes_ret])]
 
                     set_rpi_pin_tx(pi_pin_cntl)
+                    mark_phase('wait')
                 else:  # using ethernet!
                     select_inputs = select.select([tcp_conn], [], [], mb_timeout)[0]
+                    mark_phase('wait')
 
                     if select_inputs:  # select_inputs != []:
                         try:
-                            recv_packet_bytearr = tcp_conn.recv(1024, )  # gives bytes type
+                            recv_packet_bytearr = recv_view[:tcp_conn.recv_into(recv_buf)]
                         except socket.timeout:
                             print('socket timeout')
+                            if capture is not None:
+                                capture.record_reply(capture_transport, capture_endpoint, b'')
                             mb_data.set_error(87)
                             break
                         except socket.error as r:
                             print(r)
+                            if capture is not None:
+                                capture.record_reply(capture_transport, capture_endpoint, b'')
                             mb_data.set_error(87)
                             break
                     else:  # select timed out
+                        if capture is not None:
+                            capture.record_reply(capture_transport, capture_endpoint, b'')
                         mb_data.set_error(87)
+                        record_poll(MB_ERR_DICT[87])
+                        mark_phase('write')
                         # b_conn_err = True
                         print_errs_prog_bar(verbosity, cur_poll, num_prnt_rws, b_poll_forever, valid_polls,
                                             prog_bar_len, num_polls, 87)
+                        mark_phase('display')
                         cur_poll, num_polls = tick_poll_and_wait(cur_poll, num_polls, b_poll_forever, poll_start_time,
                                                                  poll_delay)
+                        mark_phase('sleep')
                         continue  # start next loop
+                    mark_phase('recv')
 
+                if capture is not None:
+                    capture.record_reply(capture_transport, capture_endpoint, recv_packet_bytearr)
                 error_code, recv_packet = verify_no_comm_errs(serial_port, recv_packet_bytearr, verbosity, num_prnt_rws)
 
                 if error_code is not None:
+                    mark_phase('verify')
                     mb_data.set_error(error_code[1])
+                    record_poll(error_code)
+                    mark_phase('write')
                     if error_code[1] == 106:
                         break
                     elif error_code[1] != 108:
@@ -1153,37 +1652,51 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
                 else:
                     error_code, register_list = verify_no_modbus_errs(recv_packet, mb_id, mb_func, val_to_write,
                                                                       b_write_mb, packet_write_list)
+                    mark_phase('verify')
 
                     if error_code is not None:
                         mb_data.set_error(error_code[1])
+                        record_poll(error_code)
+                        mark_phase('write')
                         print_errs_prog_bar(verbosity, cur_poll, num_prnt_rws, b_poll_forever, valid_polls,
                                             prog_bar_len, num_polls, error_code[1])
                     else:
                         mb_data.translate_regs_to_vals(register_list)
+                        mark_phase('decode')
 
-                        if csv_file_wrtr is not None:
+                        record_poll(mb_data.get_value_array())
+                        if aggregator is None and csv_file_wrtr is not None:
                             mb_data.insert_datetime()
                             csv_file_wrtr.writerow(mb_data.get_value_array())
+                        mark_phase('write')
 
                         valid_polls += 1
                         print_errs_prog_bar(verbosity, cur_poll, num_prnt_rws, b_poll_forever, valid_polls,
                                             prog_bar_len, num_polls)
+                mark_phase('display')
 
                 cur_poll, num_polls = tick_poll_and_wait(cur_poll, num_polls, b_poll_forever, poll_start_time,
                                                          poll_delay)
+                mark_phase('sleep')
             except KeyboardInterrupt:
                 if not b_poll_forever:
                     mb_data.set_error(107)
                 break
             # end try
         # end while
+        if capture is not None:
+            capture.close()
     # end with
 
     if verbosity is not None:
         print()
 
+    if aggregator is not None:
+        aggregator.flush(time.time_ns())  # the last windows are cut short at the end of the run
     if csv_file_wrtr is not None:
         csv_file.close()
+    if tslog is not None:
+        tslog.close()
 
     if B_RPI_GPIO_EXISTS and pi_pin_cntl is not None and b_pi_pin_cleanup:
         GPIO.cleanup()
@@ -1191,7 +1704,10 @@ def modbus_poller(ip, mb_id, start_reg, num_vals, b_help=False, num_polls=1, dat
     return mb_data.get_value_array()
 
 
-if __name__ == '__main__':
+def main(argv=None):
+    global B_CMD_LINE
+    import argparse
+
     parser = argparse.ArgumentParser(description='Polls a modbus device through network.')
 
     parser.add_argument('ip', type=str, help='The IP address of the gateway or the comport (comX).')
@@ -1218,7 +1734,7 @@ if __name__ == '__main__':
     parser.add_argument('-pd', '--pdelay', type=int, default=1000,
                         help='Delay in ms to let function sleep to retrieve reasonable data.  Default is 1000.')
     parser.add_argument('-f', '--func', type=modbus_func_bw, default=3,
-                        help='Modbus function.  Only 3, 4, 5, and 6 are supported.')
+                        help='Modbus function.  Only 1, 2, 3, 4, 5, 6, and 23 are supported.')
     parser.add_argument('-pin', '--pin_cntl', type=pin_cntl_bw, default=None,
                         help='Pin control for 485 chip on Raspberry Pi hat. Only used for serial.  Use Board pin '
                              'numbers.  Default is None.')
@@ -1226,14 +1742,48 @@ if __name__ == '__main__':
                         help='Does not call GPIO.cleanup() at end and will leave pin_cntl at previous value.')
     parser.add_argument('-rb', '--raw_bytes', action='store_true',
                         help='Returns raw bytes after any necessary byte or word swaps.')
-
-    args = parser.parse_args()
+    parser.add_argument('-wr', '--wrt_reg', type=register_bw, default=None,
+                        help='The address of the first register to write with function 23.')
+    parser.add_argument('-wv', '--wrt_vals', type=write_vals_bw, default=None,
+                        help='Comma separated values of the chosen type to write with function 23 before reading. '
+                             'Use -wv=-1,2 if the first value is negative.')
+    parser.add_argument('-cap', '--capture', type=str, default=None,
+                        help='Appends every request and reply frame to this file, see python -m mbpy.mb_capture.')
+    parser.add_argument('-ag', '--aggregate', type=str, action='append', default=None,
+                        help='With -fl, writes the stats of this window instead of every poll.  WIDTH[/PANES][:STATS] '
+                             'in ms, such as 60000:min,max,mean,last or 900000/15:mean.  Can be given more than once.')
+    parser.add_argument('-ts', '--tslog', type=str, default=None,
+                        help='Appends every poll to this compressed time series log, see python -m mbpy.mb_tslog.')
+    parser.add_argument('--profile', type=str, nargs='?', const='phases', default=None,
+                        choices=('phases', 'cprofile', 'tracemalloc', 'all'),
+                        help='Prints the time spent in each phase of the poll loop at the end.  cprofile and '
+                             'tracemalloc also write their output files, all does both.')
+    parser.add_argument('--profile_out', type=str, default='mb_poll_profile',
+                        help='Base name of the --profile output files. Default is mb_poll_profile.')
+
+    args = parser.parse_args(argv)
+
+    def run_poller(profiler=None):
+        return modbus_poller(args.ip, args.dev, args.srt, args.lng, num_polls=args.poll, data_type=args.typ,
+                             b_byteswap=args.byteswap, b_wordswap=args.wordswap, zero_based=args.zbased,
+                             mb_timeout=args.timeout, file_name_input=args.file, verbosity=args.verbose,
+                             port=args.port, poll_delay=args.pdelay, mb_func=args.func, pi_pin_cntl=args.pin_cntl,
+                             b_pi_pin_cleanup=args.no_pin_cleanup, b_raw_bytes=args.raw_bytes,
+                             write_vals=args.wrt_vals, write_reg=args.wrt_reg, capture_file=args.capture,
+                             aggregate=args.aggregate, tslog_file=args.tslog, profiler=profiler)
 
     B_CMD_LINE = True
-    poll_results = modbus_poller(args.ip, args.dev, args.srt, args.lng, num_polls=args.poll, data_type=args.typ,
-                                 b_byteswap=args.byteswap, b_wordswap=args.wordswap, zero_based=args.zbased,
-                                 mb_timeout=args.timeout, file_name_input=args.file, verbosity=args.verbose, port=args.port,
-                                 poll_delay=args.pdelay, mb_func=args.func, pi_pin_cntl=args.pin_cntl,
-                                 b_pi_pin_cleanup=args.no_pin_cleanup, b_raw_bytes=args.raw_bytes)
+    if args.profile is not None:
+        try:
+            from mbpy import mb_profile  # folder.file import
+        except ImportError:
+            import mb_profile  # run from inside the mbpy folder
+        poll_results = mb_profile.run_profiled(run_poller, args.profile, args.profile_out)
+    else:
+        poll_results = run_poller()
 
     print(poll_results)
+
+
+if __name__ == '__main__':
+    main()
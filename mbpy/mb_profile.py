@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+import time
+
+
+# phases modbus_poller marks, in the order they happen in one poll
+POLL_PHASES = ('setup', 'connect', 'send', 'display', 'wait', 'recv', 'verify', 'decode', 'write', 'sleep')
+
+
+class PhaseStats:
+    """Running count, total, min and max time of one phase."""
+    __slots__ = ('count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if self.min is None or elapsed < self.min:
+            self.min = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+class PhaseProfiler:
+    """Splits the time of a poll loop into phases.
+
+    The loop calls mark(phase) as each phase ends, and the time since the previous mark is charged to that phase, so
+    a poll costs one timer read per phase.  timer is any function returning ns, time.perf_counter_ns by default, and
+    every callback is called as callback(phase, elapsed_ns) for tracing or live histograms.
+    """
+    def __init__(self, timer=time.perf_counter_ns, callbacks=None):
+        self.timer = timer
+        self.callbacks = list(callbacks) if callbacks else []
+        self.phases = {}  # phase: PhaseStats, in the order phases were first seen
+        self._last_mark = None
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def start(self):
+        self._last_mark = self.timer()
+
+    def mark(self, phase):
+        now = self.timer()
+        if self._last_mark is None:
+            self._last_mark = now
+            return
+        elapsed = now - self._last_mark
+        self._last_mark = now
+        phase_stats = self.phases.get(phase)
+        if phase_stats is None:
+            phase_stats = PhaseStats()
+            self.phases[phase] = phase_stats
+        phase_stats.add(elapsed)
+        for callback in self.callbacks:
+            callback(phase, elapsed)
+
+    def get_stats(self):
+        # {phase: {'count', 'total_ms', 'mean_ms', 'min_ms', 'max_ms', 'share'}}, share of the total time in [0, 1]
+        total_ns = sum(phase_stats.total for phase_stats in self.phases.values()) or 1
+        return {phase: {'count': phase_stats.count, 'total_ms': phase_stats.total / 1e6,
+                        'mean_ms': phase_stats.total / phase_stats.count / 1e6, 'min_ms': phase_stats.min / 1e6,
+                        'max_ms': phase_stats.max / 1e6, 'share': phase_stats.total / total_ns}
+                for phase, phase_stats in self.phases.items()}
+
+    def format_report(self):
+        lines = ['%-10s %8s %12s %10s %10s %10s %7s' % ('phase', 'count', 'total ms', 'mean ms', 'min ms', 'max ms',
+                                                          '%')]
+        for phase, stats in self.get_stats().items():
+            lines.append('%-10s %8d %12.3f %10.3f %10.3f %10.3f %7.1f' % (
+                phase, stats['count'], stats['total_ms'], stats['mean_ms'], stats['min_ms'], stats['max_ms'],
+                stats['share'] * 100))
+        return '\n'.join(lines)
+
+    def reset(self):
+        self.phases = {}
+        self._last_mark = None
+
+
+def run_profiled(func, mode='phases', out_name='mb_poll_profile', profiler=None):
+    # runs func(profiler) and prints the phase breakdown.  cprofile also writes out_name.prof (for pstats or
+    # snakeviz) and out_name_cprofile.txt, tracemalloc writes the biggest allocations to out_name_tracemalloc.txt.
+    # Returns what func returned.
+    profiler = profiler if profiler is not None else PhaseProfiler()
+    c_profile = None
+    if mode in ('cprofile', 'all'):
+        import cProfile
+        c_profile = cProfile.Profile()
+    if mode in ('tracemalloc', 'all'):
+        import tracemalloc
+        tracemalloc.start(10)
+
+    if c_profile is not None:
+        c_profile.enable()
+    try:
+        otpt = func(profiler)
+    finally:
+        if c_profile is not None:
+            c_profile.disable()
+
+    print(profiler.format_report())
+    if c_profile is not None:
+        import pstats
+        c_profile.dump_stats(out_name + '.prof')
+        with open(out_name + '_cprofile.txt', 'w') as stats_file:
+            pstats.Stats(c_profile, stream=stats_file).sort_stats('cumulative').print_stats(50)
+        print('cProfile written to', out_name + '.prof', 'and', out_name + '_cprofile.txt')
+    if mode in ('tracemalloc', 'all'):
+        snapshot = tracemalloc.take_snapshot()
+        cur_size, peak_size = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # leave out the modules imported along the way, only what the run itself holds on to is of interest
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+                                           tracemalloc.Filter(False, '*pstats.py')))
+        with open(out_name + '_tracemalloc.txt', 'w') as stats_file:
+            stats_file.write('current %d bytes, peak %d bytes\n' % (cur_size, peak_size))
+            for stat in snapshot.statistics('lineno')[:50]:
+                stats_file.write(str(stat) + '\n')
+        print('tracemalloc written to', out_name + '_tracemalloc.txt,', 'peak', peak_size, 'bytes')
+    return otpt
@@ -0,0 +1,535 @@
+#!/usr/bin/python3
+
+import time
+import socket
+import selectors
+from collections import deque
+try:
+    from mbpy import mb_poll  # folder.file import
+    from mbpy import mb_gateway
+    from mbpy import mb_serialmux
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+    import mb_gateway
+    import mb_serialmux
+
+
+READ_FUNCS = (1, 2, 3, 4)  # identical requests in flight are merged and their replies may be cached
+WRITE_FUNCS = (5, 6, 15, 16, 23)
+EXC_ILLEGAL_FUNCTION = 0x01
+EXC_PATH_UNAVAILABLE = 0x0A  # gateway exceptions, what a real gateway answers when the device can not be reached
+EXC_NO_RESPONSE = 0x0B
+
+
+def get_rtu_reply_len(req_pdu):
+    # bytes of the rtu reply to a request pdu, needed to find the end of a frame that has no length field
+    mb_func = req_pdu[0]
+    if mb_func in (1, 2):
+        return 5 + (int.from_bytes(req_pdu[3:5], byteorder='big') + 7) // 8
+    elif mb_func in (3, 4, 23):
+        return 5 + int.from_bytes(req_pdu[3:5], byteorder='big') * 2
+    return 8  # writes echo address and value or quantity
+
+
+def make_mbap_frame(trans_id, mb_id, pdu):
+    return trans_id.to_bytes(2, byteorder='big') + b'\x00\x00' + (len(pdu) + 1).to_bytes(2, byteorder='big') + \
+        bytes([mb_id]) + pdu
+
+
+class ProxyStats:
+    """Counters of the proxy, kept by the event loop and read from anywhere."""
+    __slots__ = ('num_clients', 'num_requests', 'num_sent', 'num_merged', 'num_cache_hits', 'num_timeouts',
+                 'num_bad_replies', 'num_conn_errs')
+
+    def __init__(self):
+        self.num_clients = 0  # connected right now
+        self.num_requests = 0  # from clients
+        self.num_sent = 0  # to devices
+        self.num_merged = 0  # answered by an identical read already queued or in flight
+        self.num_cache_hits = 0
+        self.num_timeouts = 0
+        self.num_bad_replies = 0  # unknown transaction id, wrong device or function, bad crc
+        self.num_conn_errs = 0
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class _Pending:
+    """One request to a device and every client waiting for its reply."""
+    __slots__ = ('key', 'mb_id', 'pdu', 'waiters', 'deadline')
+
+    def __init__(self, key, mb_id, pdu):
+        self.key = key  # (link, mb_id, pdu) for reads, None for writes which are never merged
+        self.mb_id = mb_id
+        self.pdu = pdu
+        self.waiters = []  # [(ProxyClient, client transaction id), ...]
+        self.deadline = 0
+
+
+class ProxyClient:
+    """One upstream connection, a BMS, historian or laptop speaking Modbus TCP to the proxy."""
+    def __init__(self, tcp_conn, address):
+        self.tcp_conn = tcp_conn
+        self.address = address
+        self.recv_buf = bytearray()
+        self.send_buf = bytearray()
+        self.b_closed = False
+
+    def get_frames(self):
+        # complete (transaction id, mb_id, pdu) requests in the buffer, None if the stream is not Modbus TCP
+        frames = []
+        while len(self.recv_buf) >= 8:
+            frame_len = 6 + int.from_bytes(self.recv_buf[4:6], byteorder='big')
+            if self.recv_buf[2:4] != b'\x00\x00' or not 8 <= frame_len <= 260:
+                return None
+            if len(self.recv_buf) < frame_len:
+                break
+            frames.append((int.from_bytes(self.recv_buf[0:2], byteorder='big'), self.recv_buf[6],
+                           bytes(self.recv_buf[7:frame_len])))
+            del self.recv_buf[:frame_len]
+        return frames
+
+
+class DeviceLink:
+    """The one connection the proxy keeps to a device or gateway, shared by every client."""
+    def __init__(self, ip, port=502, transport='tcp', max_in_flight=1):
+        self.ip = ip
+        self.port = port
+        self.transport = transport
+        # rtu frames carry no transaction id, so only one request may be out at a time
+        self.max_in_flight = 1 if transport == 'rtu_tcp' else max(1, max_in_flight)
+        self.tcp_conn = None
+        self.b_connecting = False
+        self.connect_deadline = 0
+        self.recv_buf = bytearray()
+        self.send_buf = bytearray()
+        self.queue = deque()  # _Pending not sent yet
+        self.in_flight = {}  # proxy transaction id: _Pending
+        self.next_trans_id = 0
+        self.assembler = mb_serialmux.RtuFrameAssembler()
+
+    def get_name(self):
+        return self.ip + ':' + str(self.port) + ('' if self.transport == 'tcp' else ' ' + self.transport)
+
+    def make_frame(self, pending):
+        # returns (transaction id, frame), the transaction id is the proxy's own so replies map back to one _Pending
+        if self.transport == 'rtu_tcp':
+            rtu_frame = bytes([pending.mb_id]) + pending.pdu
+            self.assembler.reset(pending.mb_id, get_rtu_reply_len(pending.pdu))
+            return 0, rtu_frame + bytes(mb_poll.calc_crc_byte_array(rtu_frame))
+        trans_id = self.next_trans_id
+        while trans_id in self.in_flight:
+            trans_id = (trans_id + 1) & 0xFFFF
+        self.next_trans_id = (trans_id + 1) & 0xFFFF
+        return trans_id, make_mbap_frame(trans_id, pending.mb_id, pending.pdu)
+
+    def get_replies(self):
+        # [(transaction id, mb_id, reply pdu or None if it failed its checks), ...] of every complete reply.  A tcp
+        # frame no device would send means the stream has lost its framing, it ends the list as (None, None, None)
+        replies = []
+        if self.transport == 'rtu_tcp':
+            if not self.in_flight:
+                del self.recv_buf[:]  # tail of a reply that already timed out
+                return replies
+            recv_packet_bytearr = self.assembler.feed(self.recv_buf)
+            del self.recv_buf[:]
+            if recv_packet_bytearr is not None:
+                error_code, recv_packet = mb_poll.verify_no_comm_errs(self.ip, recv_packet_bytearr, None, 0)
+                replies.append((0, recv_packet_bytearr[0], None if error_code is not None else bytes(recv_packet[1:])))
+            return replies
+
+        while len(self.recv_buf) >= 8:
+            frame_len = 6 + int.from_bytes(self.recv_buf[4:6], byteorder='big')
+            if frame_len < 8 or self.recv_buf[2:4] != b'\x00\x00':
+                # shorter than a device id and function code, or not modbus at all
+                del self.recv_buf[:]
+                replies.append((None, None, None))
+                break
+            if len(self.recv_buf) < frame_len:
+                break
+            recv_packet_bytearr = bytes(self.recv_buf[:frame_len])
+            del self.recv_buf[:frame_len]
+            error_code, recv_packet = mb_poll.verify_no_comm_errs(None, recv_packet_bytearr, None, 0)
+            replies.append((int.from_bytes(recv_packet_bytearr[0:2], byteorder='big'), recv_packet_bytearr[6],
+                            None if error_code is not None else bytes(recv_packet[1:])))
+        return replies
+
+
+class ModbusProxy:
+    """Modbus TCP server that fans many clients into one connection per device.
+
+    Requests are routed by device id to a DeviceLink, each link keeps at most max_in_flight requests out under its
+    own transaction ids and queues the rest.  A read identical to one already queued or in flight is not sent again,
+    its client is answered from the same reply.  With cache_ttl (ms) good read replies are kept that long and answered
+    without touching the device, any write to a device drops its cached reads.
+    """
+    def __init__(self, target, routes=None, bind='0.0.0.0', port=502, mb_timeout=1500, cache_ttl=0, policies=None):
+        # target and routes values are (ip, port, transport), routes is {mb_id: target} for devices on other gateways
+        self.bind = bind
+        self.port = port
+        self.mb_timeout = mb_timeout / 1000  # convert from ms to s
+        self.cache_ttl = cache_ttl / 1000
+        policies = policies if policies is not None else {}
+        self.links = {}  # (ip, port, transport): DeviceLink
+        for ip, link_port, transport in [target] + list((routes or {}).values()):
+            if (ip, link_port, transport) not in self.links:
+                policy = policies.get((ip, link_port), mb_gateway.GatewayPolicy())
+                self.links[(ip, link_port, transport)] = DeviceLink(ip, link_port, transport, policy.max_in_flight)
+        self._default_link = self.links[tuple(target)]
+        self._routes = {mb_id: self.links[tuple(route)] for mb_id, route in (routes or {}).items()}
+        self._merge = {}  # (link, mb_id, pdu): _Pending queued or in flight
+        self._cache = {}  # (link, mb_id, pdu): (reply pdu, monotonic time)
+        self.stats = ProxyStats()
+        self._listen_conn = None
+        self._selector = None
+        self._b_stopping = False
+
+    def open(self):
+        self._selector = selectors.DefaultSelector()
+        self._listen_conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listen_conn.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listen_conn.bind((self.bind, self.port))
+        self._listen_conn.listen(64)
+        self._listen_conn.setblocking(False)
+        self.port = self._listen_conn.getsockname()[1]  # the port picked by the os if 0 was asked for
+        self._selector.register(self._listen_conn, selectors.EVENT_READ, None)
+
+    def close(self):
+        if self._selector is not None:
+            for key in list(self._selector.get_map().values()):
+                key.fileobj.close()
+            self._selector.close()
+            self._selector = None
+        self._listen_conn = None
+        for link in self.links.values():
+            link.tcp_conn = None
+
+    def stop(self):
+        self._b_stopping = True  # safe to call from another thread, the loop ends within one wakeup
+
+    def get_stats(self):
+        stats = self.stats.to_dict()
+        stats['queued'] = sum(len(link.queue) + len(link.in_flight) for link in self.links.values())
+        return stats
+
+    def _update_events(self, conn_owner):
+        # only asks to hear about the socket draining while there is something left to send
+        self._selector.modify(conn_owner.tcp_conn, selectors.EVENT_READ |
+                              (selectors.EVENT_WRITE if conn_owner.send_buf else 0), conn_owner)
+
+    def _send(self, conn_owner, frame):
+        # sends what the socket takes now, the rest goes out as it drains.  conn_owner is a ProxyClient or DeviceLink
+        if not conn_owner.send_buf:
+            try:
+                sent = conn_owner.tcp_conn.send(frame)
+            except BlockingIOError:
+                sent = 0
+            frame = frame[sent:]
+        if frame:
+            conn_owner.send_buf.extend(frame)
+            self._update_events(conn_owner)
+
+    def _flush(self, conn_owner):
+        try:
+            sent = conn_owner.tcp_conn.send(conn_owner.send_buf)
+        except BlockingIOError:
+            return
+        del conn_owner.send_buf[:sent]
+        if not conn_owner.send_buf:
+            self._update_events(conn_owner)
+
+    def _reply(self, client, trans_id, mb_id, pdu):
+        if client.b_closed:
+            return
+        try:
+            self._send(client, make_mbap_frame(trans_id, mb_id, pdu))
+        except OSError:
+            self._close_client(client)
+
+    def _accept(self):
+        try:
+            tcp_conn, address = self._listen_conn.accept()
+        except BlockingIOError:
+            return
+        tcp_conn.setblocking(False)
+        tcp_conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = ProxyClient(tcp_conn, address)
+        self._selector.register(tcp_conn, selectors.EVENT_READ, client)
+        self.stats.num_clients += 1
+
+    def _close_client(self, client):
+        if client.b_closed:
+            return
+        client.b_closed = True
+        self.stats.num_clients -= 1
+        self._selector.unregister(client.tcp_conn)
+        client.tcp_conn.close()
+
+    def _on_client_readable(self, client):
+        try:
+            recv_chunk = client.tcp_conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            recv_chunk = b''
+        if not recv_chunk:
+            self._close_client(client)
+            return
+        client.recv_buf.extend(recv_chunk)
+        frames = client.get_frames()
+        if frames is None:
+            self._close_client(client)  # not speaking Modbus TCP
+            return
+        for trans_id, mb_id, pdu in frames:
+            self._on_request(client, trans_id, mb_id, pdu)
+
+    def _on_request(self, client, trans_id, mb_id, pdu):
+        self.stats.num_requests += 1
+        mb_func = pdu[0]
+        if mb_func not in READ_FUNCS and mb_func not in WRITE_FUNCS:
+            self._reply(client, trans_id, mb_id, bytes([mb_func | 0x80, EXC_ILLEGAL_FUNCTION]))
+            return
+        link = self._routes.get(mb_id, self._default_link)
+
+        if mb_func in READ_FUNCS:
+            key = (link, mb_id, pdu)
+            cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached[1] <= self.cache_ttl:
+                self.stats.num_cache_hits += 1
+                self._reply(client, trans_id, mb_id, cached[0])
+                return
+            pending = self._merge.get(key)
+            if pending is not None:
+                self.stats.num_merged += 1
+                pending.waiters.append((client, trans_id))
+                return
+            pending = _Pending(key, mb_id, pdu)
+            self._merge[key] = pending
+        else:
+            # writes are sent as they come, and whatever was cached for the device may be stale now
+            pending = _Pending(None, mb_id, pdu)
+            for key in [key for key in self._cache if key[0] is link and key[1] == mb_id]:
+                del self._cache[key]
+        pending.waiters.append((client, trans_id))
+        link.queue.append(pending)
+        self._service_link(link)
+
+    def _connect_link(self, link):
+        link.tcp_conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        link.tcp_conn.setblocking(False)
+        link.tcp_conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        link.b_connecting = True
+        link.connect_deadline = time.monotonic() + self.mb_timeout
+        try:
+            link.tcp_conn.connect((link.ip, link.port))
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._fail_link(link, EXC_PATH_UNAVAILABLE)
+            return
+        self._selector.register(link.tcp_conn, selectors.EVENT_READ | selectors.EVENT_WRITE, link)
+
+    def _fail_link(self, link, exc_code):
+        # drops the connection and answers everything queued or in flight with a gateway exception
+        if exc_code == EXC_PATH_UNAVAILABLE:
+            self.stats.num_conn_errs += 1
+        if link.tcp_conn is not None:
+            try:
+                self._selector.unregister(link.tcp_conn)
+            except (KeyError, ValueError):
+                pass
+            link.tcp_conn.close()
+        link.tcp_conn = None
+        link.b_connecting = False
+        del link.recv_buf[:]
+        del link.send_buf[:]
+        failed = list(link.in_flight.values()) + list(link.queue)
+        link.in_flight.clear()
+        link.queue.clear()
+        for pending in failed:
+            self._finish(pending, bytes([pending.pdu[0] | 0x80, exc_code]))
+
+    def _service_link(self, link):
+        # sends queued requests while the link has room for them
+        if not link.queue:
+            return
+        if link.tcp_conn is None:
+            self._connect_link(link)
+            return
+        if link.b_connecting:
+            return
+        while link.queue and len(link.in_flight) < link.max_in_flight:
+            pending = link.queue.popleft()
+            trans_id, frame = link.make_frame(pending)
+            pending.deadline = time.monotonic() + self.mb_timeout
+            link.in_flight[trans_id] = pending
+            self.stats.num_sent += 1
+            try:
+                self._send(link, frame)
+            except OSError:
+                self._fail_link(link, EXC_PATH_UNAVAILABLE)
+                return
+
+    def _on_link_event(self, link, events):
+        if link.b_connecting:
+            if link.tcp_conn.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                self._fail_link(link, EXC_PATH_UNAVAILABLE)
+                return
+            link.b_connecting = False
+            self._update_events(link)
+            self._service_link(link)
+            return
+
+        if events & selectors.EVENT_WRITE and link.send_buf:
+            try:
+                self._flush(link)
+            except OSError:
+                self._fail_link(link, EXC_PATH_UNAVAILABLE)
+                return
+        if not events & selectors.EVENT_READ:
+            return
+        try:
+            recv_chunk = link.tcp_conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            recv_chunk = b''
+        if not recv_chunk:
+            self._fail_link(link, EXC_PATH_UNAVAILABLE)  # device closed the connection
+            return
+        link.recv_buf.extend(recv_chunk)
+        b_lost_framing = False
+        for trans_id, mb_id, reply_pdu in link.get_replies():
+            b_lost_framing = trans_id is None
+            pending = link.in_flight.get(trans_id)
+            if pending is None or not reply_pdu or mb_id != pending.mb_id or reply_pdu[0] & 0x7F != pending.pdu[0]:
+                self.stats.num_bad_replies += 1
+                if pending is not None and link.transport == 'rtu_tcp':
+                    del link.in_flight[trans_id]
+                    self._finish(pending, bytes([pending.pdu[0] | 0x80, EXC_NO_RESPONSE]))
+                continue
+            del link.in_flight[trans_id]
+            if self.cache_ttl and pending.key is not None and not reply_pdu[0] & 0x80:
+                self._cache[pending.key] = (reply_pdu, time.monotonic())
+            self._finish(pending, reply_pdu)
+        if b_lost_framing:
+            # nothing after the bad frame can be matched to a request, start over on a new connection
+            self._fail_link(link, EXC_NO_RESPONSE)
+        self._service_link(link)
+
+    def _finish(self, pending, reply_pdu):
+        if pending.key is not None:
+            self._merge.pop(pending.key, None)
+        for client, trans_id in pending.waiters:
+            self._reply(client, trans_id, pending.mb_id, reply_pdu)
+
+    def _check_timeouts(self, now):
+        # returns the nearest deadline still running
+        next_deadline = None
+        for link in self.links.values():
+            if link.b_connecting and now >= link.connect_deadline:
+                self._fail_link(link, EXC_PATH_UNAVAILABLE)
+                continue
+            for trans_id, pending in list(link.in_flight.items()):
+                if now >= pending.deadline:
+                    self.stats.num_timeouts += 1
+                    del link.in_flight[trans_id]
+                    self._finish(pending, bytes([pending.pdu[0] | 0x80, EXC_NO_RESPONSE]))
+                elif next_deadline is None or pending.deadline < next_deadline:
+                    next_deadline = pending.deadline
+            self._service_link(link)
+        return next_deadline
+
+    def run(self, duration=None, max_wait=0.1):
+        # event loop, until duration (s) runs out, stop is called or Ctrl-C.  Opens the listening socket if open was
+        # not called
+        if self._selector is None:
+            self.open()
+        end_time = None if duration is None else time.monotonic() + duration
+        self._b_stopping = False
+        try:
+            while not self._b_stopping:
+                now = time.monotonic()
+                if end_time is not None and now >= end_time:
+                    break
+                next_deadline = self._check_timeouts(now)
+                wait_time = min(max_wait, next_deadline - now) if next_deadline is not None else max_wait
+                if end_time is not None:
+                    wait_time = min(wait_time, end_time - now)
+                for key, events in self._selector.select(max(0, wait_time)):
+                    if key.data is None:
+                        self._accept()
+                    elif isinstance(key.data, ProxyClient):
+                        if events & selectors.EVENT_WRITE:
+                            try:
+                                self._flush(key.data)
+                            except OSError:
+                                self._close_client(key.data)
+                                continue
+                        if events & selectors.EVENT_READ:
+                            self._on_client_readable(key.data)
+                    else:
+                        self._on_link_event(key.data, events)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+
+def parse_target(target, transport='tcp'):
+    # 'ip[:port]' or {'ip': ..., 'port': ..., 'transport': ...} to (ip, port, transport)
+    if isinstance(target, dict):
+        return target['ip'], int(target.get('port', 502)), target.get('transport', transport)
+    ip, port = mb_gateway.parse_endpoint(target)
+    return ip, port, transport
+
+
+def main(argv=None):
+    import argparse
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(description='Shares devices that take few connections between many Modbus TCP '
+                                                 'clients.')
+    parser.add_argument('target', type=str, help='IP[:PORT] of the device or gateway requests go to.')
+    parser.add_argument('-tr', '--transport', type=str, default='tcp', choices=('tcp', 'rtu_tcp'),
+                        help='Framing used towards the target. Default is tcp.')
+    parser.add_argument('-r', '--routes', type=str, default=None,
+                        help='JSON file of {"mb_id": "ip:port" or {"ip", "port", "transport"}} for devices that are '
+                             'not behind the target.')
+    parser.add_argument('-b', '--bind', type=str, default='0.0.0.0',
+                        help='Address to listen on. Default is 0.0.0.0.')
+    parser.add_argument('-pt', '--port', type=int, default=502, help='Port to listen on. Default is 502.')
+    parser.add_argument('-to', '--timeout', type=mb_poll.timeout_bw, default=1500,
+                        help='Time in milliseconds to wait for a device to reply. Default is 1500.')
+    parser.add_argument('-c', '--cache', type=int, default=0,
+                        help='Answers repeated reads from a cache for this many ms. Default is 0, no cache.')
+    parser.add_argument('-o', '--policies', type=str, default=None,
+                        help='Json gateway policy file from python -m mbpy.mb_gateway, max_in_flight sets how many '
+                             'requests go out at once on each connection. Default is 1.')
+    parser.add_argument('-d', '--duration', type=float, default=None,
+                        help='Seconds to run for. Default is until Ctrl-C.')
+    args = parser.parse_args(argv)
+
+    routes = None
+    if args.routes is not None:
+        with open(args.routes) as routes_file:
+            routes = {int(mb_id): parse_target(route) for mb_id, route in json.load(routes_file).items()}
+    policies = mb_gateway.load_policies(args.policies) if args.policies is not None else None
+
+    proxy = ModbusProxy(parse_target(args.target, args.transport), routes, args.bind, args.port, args.timeout,
+                        args.cache, policies)
+    try:
+        proxy.open()
+    except OSError as err:
+        print('Unable to listen on', args.bind + ':' + str(args.port), err, file=sys.stderr)
+        return
+    print('Proxying', ', '.join(link.get_name() for link in proxy.links.values()), 'on',
+          args.bind + ':' + str(proxy.port) + '. Ctrl-C to exit.')
+    proxy.run(args.duration)
+    print(proxy.get_stats(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
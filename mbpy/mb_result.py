@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+from array import array
+try:
+    from mbpy import mb_poll  # folder.file import
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+
+
+EMPTY_VALUES = array('d')
+
+
+def pack_values(values):
+    # value list from ModbusData to the most compact sequence that holds it exactly, strings stay a tuple
+    if not values:
+        return EMPTY_VALUES
+    if all(type(val) is int for val in values):
+        for typecode in ('b', 'B', 'h', 'H', 'q', 'Q'):
+            try:
+                return array(typecode, values)
+            except OverflowError:
+                pass
+    elif all(type(val) in (int, float) for val in values):
+        return array('d', values)
+    return tuple(values)
+
+
+class PollResult:
+    """One poll: what was asked, when, the reply bytes and either the decoded values or an error number."""
+    __slots__ = ('mb_id', 'mb_func', 'start_reg', 'send_ns', 'recv_ns', 'raw', 'values', 'error')
+
+    def __init__(self, mb_id, mb_func, start_reg, send_ns=0, recv_ns=0, raw=b'', values=EMPTY_VALUES, error=0):
+        self.mb_id = mb_id
+        self.mb_func = mb_func
+        self.start_reg = start_reg
+        self.send_ns = send_ns  # time.time_ns() just before the request was sent
+        self.recv_ns = recv_ns  # and once the reply was in, or the poll gave up
+        self.raw = raw  # data bytes of the reply, a memoryview into the received frame where there was one
+        self.values = values  # array, or a tuple for string types
+        self.error = error  # MB_ERR_DICT number, 0 if the poll worked
+
+    @classmethod
+    def from_otpt(cls, mb_id, mb_func, start_reg, otpt, send_ns=0, recv_ns=0, raw=b''):
+        # wraps a modbus_poller or ModbusClient.request output
+        if otpt and otpt[0] == 'Err':
+            return cls(mb_id, mb_func, start_reg, send_ns, recv_ns, raw, EMPTY_VALUES, otpt[1])
+        return cls(mb_id, mb_func, start_reg, send_ns, recv_ns, raw, pack_values(otpt), 0)
+
+    def is_ok(self):
+        return self.error == 0
+
+    def get_error(self):
+        # error tuple the same as modbus_poller returns, None if the poll worked
+        if not self.error:
+            return None
+        return mb_poll.MB_ERR_DICT.get(self.error, ('Err', self.error, 'UNKNOWN ERROR'))
+
+    def get_latency_ns(self):
+        return self.recv_ns - self.send_ns
+
+    def to_otpt(self):
+        # back to a value list or an error tuple for code that still expects those
+        return self.get_error() or list(self.values)
+
+    def __repr__(self):
+        return 'PollResult(mb_id=%r, mb_func=%r, start_reg=%r, recv_ns=%r, %s)' % (
+            self.mb_id, self.mb_func, self.start_reg, self.recv_ns,
+            'values=' + repr(list(self.values)) if not self.error else 'error=' + repr(self.get_error()))
+
+
+class ResultBatch:
+    """Many polls stored column by column in flat arrays, cheap to keep, pickle and scan.
+
+    Values of every poll share one array('d') and raw bytes share one bytearray, each poll's slice is found through
+    the offset columns.  Integers come back as integers, only polls decoded to strings (hex, bin, ascii) or holding
+    integers too big for a double keep their own values in obj_values instead.
+    """
+    def __init__(self):
+        self.mb_ids = array('B')
+        self.mb_funcs = array('B')
+        self.start_regs = array('I')
+        self.send_ns = array('q')
+        self.recv_ns = array('q')
+        self.errors = array('H')
+        self.b_ints = array('B')  # 1 if the poll's values were integers
+        self.value_offsets = array('I', [0])  # poll i holds values[value_offsets[i]:value_offsets[i + 1]]
+        self.values = array('d')
+        self.raw_offsets = array('I', [0])
+        self.raw = bytearray()
+        self.obj_values = {}  # poll index: values that do not fit the shared array
+
+    def __len__(self):
+        return len(self.mb_ids)
+
+    def append(self, result):
+        self.mb_ids.append(result.mb_id)
+        self.mb_funcs.append(result.mb_func)
+        self.start_regs.append(result.start_reg)
+        self.send_ns.append(result.send_ns)
+        self.recv_ns.append(result.recv_ns)
+        self.errors.append(result.error)
+        vals = result.values
+        b_ints = not isinstance(vals, tuple) and vals.typecode != 'd'
+        self.b_ints.append(b_ints)
+        if isinstance(vals, tuple) or (b_ints and vals and max(abs(min(vals)), max(vals)) > 1 << 53):
+            self.obj_values[len(self.mb_ids) - 1] = vals
+        elif b_ints:
+            self.values.fromlist(vals.tolist())
+        else:
+            self.values.extend(vals)
+        self.value_offsets.append(len(self.values))
+        self.raw.extend(result.raw)
+        self.raw_offsets.append(len(self.raw))
+
+    def append_otpt(self, mb_id, mb_func, start_reg, otpt, send_ns=0, recv_ns=0, raw=b''):
+        self.append(PollResult.from_otpt(mb_id, mb_func, start_reg, otpt, send_ns, recv_ns, raw))
+
+    def extend(self, results):
+        for result in results:
+            self.append(result)
+
+    def get_values(self, index):
+        if index in self.obj_values:
+            return self.obj_values[index]
+        vals = self.values[self.value_offsets[index]:self.value_offsets[index + 1]]
+        if self.b_ints[index]:
+            return array('q', [int(val) for val in vals])
+        return vals
+
+    def get_raw(self, index):
+        return bytes(self.raw[self.raw_offsets[index]:self.raw_offsets[index + 1]])
+
+    def __getitem__(self, index):
+        # builds the PollResult of one poll back from the columns
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('ResultBatch index out of range')
+        return PollResult(self.mb_ids[index], self.mb_funcs[index], self.start_regs[index], self.send_ns[index],
+                          self.recv_ns[index], self.get_raw(index), self.get_values(index), self.errors[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def get_num_errs(self):
+        return len(self) - self.errors.count(0)
+
+    def clear(self):
+        self.__init__()
@@ -0,0 +1,351 @@
+#!/usr/bin/python3
+
+import time
+import heapq
+import selectors
+from datetime import datetime
+try:
+    from mbpy import mb_poll  # folder.file import
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+
+
+# everything a device entry can hold, anything left out takes these values.  Devices of the same serial_port share a
+# bus, and the first device of a bus sets its baudrate and pi_pin_cntl
+DEVICE_DEFAULTS = {'baudrate': 9600, 'pi_pin_cntl': None, 'start_reg': 1, 'num_vals': 1, 'data_type': 'float',
+                   'mb_func': 3, 'b_byteswap': False, 'b_wordswap': False, 'zero_based': False, 'mb_timeout': 1500,
+                   'poll_delay': 1000, 'b_raw_bytes': False}
+
+
+def make_device(device):
+    # fills in defaults for a device dict, needs at least 'serial_port' and 'mb_id', raises ValueError if unusable
+    unknown_keys = set(device) - set(DEVICE_DEFAULTS) - {'serial_port', 'mb_id'}
+    if 'serial_port' not in device or 'mb_id' not in device or unknown_keys:
+        raise ValueError('Device needs serial_port and mb_id, unknown keys: ' + ', '.join(sorted(unknown_keys)))
+    full_device = dict(DEVICE_DEFAULTS)
+    full_device.update(device)
+    if full_device['mb_func'] not in (1, 2, 3, 4):
+        raise ValueError('Only functions 1, 2, 3 and 4 can be polled.')
+    try:
+        full_device['mb_id'], error_code = mb_poll.validate_device_id(full_device['mb_id'])
+        if error_code is not None:
+            raise ValueError('mb_id must be in [0, 255].')
+        full_device['start_reg'], error_code = mb_poll.validate_register(full_device['start_reg'])
+        if error_code is not None:
+            raise ValueError('Invalid start_reg.')
+        full_device['num_vals'], error_code = mb_poll.validate_num_registers(full_device['num_vals'])
+        if error_code is not None:
+            raise ValueError('Invalid num_vals.')
+    except (TypeError, ValueError) as err:
+        raise ValueError('Device ' + str(device['mb_id']) + ' on ' + str(device['serial_port']) + ': ' + str(err))
+    if mb_poll.validate_data_type(full_device['data_type'])[1] is not None:
+        raise ValueError('Invalid data_type ' + str(full_device['data_type']) + '.')
+    return full_device
+
+
+def get_silent_interval(baudrate):
+    # s of silence that has to separate two rtu frames, 3.5 characters of 11 bits or 1.75 ms above 19200 baud
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * 11 / baudrate
+
+
+class RtuFrameAssembler:
+    """Collects the bytes of one rtu reply as they trickle in, without ever blocking on the port."""
+    __slots__ = ('mb_id', 'exp_num_bytes_ret', 'buffer', 'num_skipped')
+
+    def __init__(self):
+        self.mb_id = None
+        self.exp_num_bytes_ret = 0
+        self.buffer = bytearray()
+        self.num_skipped = 0  # noise bytes thrown away in front of replies
+
+    def reset(self, mb_id, exp_num_bytes_ret):
+        self.mb_id = mb_id
+        self.exp_num_bytes_ret = exp_num_bytes_ret
+        del self.buffer[:]
+
+    def feed(self, data):
+        # returns the frame once every byte of it is in, otherwise None
+        self.buffer.extend(data)
+        if self.buffer and self.buffer[0] != self.mb_id:
+            # line noise or the tail of a late reply, a frame can only start with the address asked
+            start = self.buffer.find(self.mb_id)
+            self.num_skipped += len(self.buffer) if start < 0 else start
+            del self.buffer[:len(self.buffer) if start < 0 else start]
+        if len(self.buffer) < 5:
+            return None
+        frame_len = 5 if self.buffer[1] & 0x80 else self.exp_num_bytes_ret  # exception replies are 5 bytes long
+        if len(self.buffer) < frame_len:
+            return None
+        frame = bytes(self.buffer[:frame_len])
+        del self.buffer[:]
+        return frame
+
+
+class BusStats:
+    """Counters of one bus, kept by the event loop and read from anywhere."""
+    __slots__ = ('num_requests', 'num_replies', 'num_timeouts', 'num_crc_errs', 'num_exceptions', 'bytes_tx',
+                 'bytes_rx', 'busy_time')
+
+    def __init__(self):
+        self.num_requests = 0
+        self.num_replies = 0  # good replies, exceptions included
+        self.num_timeouts = 0
+        self.num_crc_errs = 0
+        self.num_exceptions = 0
+        self.bytes_tx = 0
+        self.bytes_rx = 0
+        self.busy_time = 0  # s between sending a request and its reply or timeout
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class SerialBus:
+    """One RS-485 port, polling its devices one request at a time without blocking the loop it runs in."""
+    def __init__(self, serial_port, baudrate=9600, pi_pin_cntl=None):
+        self.serial_port = serial_port
+        self.baudrate = baudrate
+        self.pi_pin_cntl = pi_pin_cntl
+        self.silent_interval = get_silent_interval(baudrate)
+        self.stats = BusStats()
+
+        self.serial_conn = None
+        self.assembler = RtuFrameAssembler()
+        self._polls = []  # (dev_index, device, RequestTemplate, ModbusData or None)
+        self._poll_due = []  # heap of (due time, poll index)
+        self._in_flight = None  # (poll index, due time, send time) of the request waiting for its reply
+        self._deadline = 0  # reply timeout of the request in flight
+        self._quiet_until = 0  # the line has to stay silent until then before the next request
+
+    def add_device(self, dev_index, device):
+        start_reg_zero = device['start_reg'] - (not device['zero_based'])
+        exp_num_bytes_ret, num_regs = mb_poll.get_expected_num_ret_bytes(False, device['mb_func'],
+                                                                         device['num_vals'], device['data_type'])
+        req_template = mb_poll.RequestTemplate(self.serial_port, False, device['mb_id'], device['mb_func'],
+                                               start_reg_zero, None, num_regs, exp_num_bytes_ret)
+        mb_data = mb_poll.ModbusData(device['start_reg'], device['num_vals'], device['b_byteswap'],
+                                     device['b_wordswap'], None, device['data_type'], device['mb_func'],
+                                     b_raw_bytes=device['b_raw_bytes'])
+        heapq.heappush(self._poll_due, (time.monotonic(), len(self._polls)))
+        self._polls.append((dev_index, device, req_template, mb_data))
+
+    def open(self):
+        self.serial_conn, error_code = mb_poll.open_serial_port(self.serial_port, 1, self.pi_pin_cntl, self.baudrate)
+        if error_code is None:
+            self.serial_conn.timeout = 0  # reads return whatever is there
+            self.serial_conn.reset_input_buffer()
+        return error_code
+
+    def close(self):
+        if self.serial_conn is not None:
+            self.serial_conn.close()
+            self.serial_conn = None
+
+    def fileno(self):
+        return self.serial_conn.fileno()
+
+    def get_wakeup(self):
+        # monotonic time the loop has to call service by, even if nothing arrives
+        if self._in_flight is not None:
+            return self._deadline
+        if not self._poll_due:
+            return None
+        return max(self._poll_due[0][0], self._quiet_until)
+
+    def service(self, now, on_result):
+        # times out the request in flight, then sends the next one if it is due and the line is quiet
+        if self._in_flight is not None and now >= self._deadline:
+            self.stats.num_timeouts += 1
+            self._finish(now, mb_poll.MB_ERR_DICT[87], on_result)
+        if self._in_flight is None and self._poll_due and now >= max(self._poll_due[0][0], self._quiet_until):
+            self._send(now)
+
+    def _send(self, now):
+        due_time, poll_index = heapq.heappop(self._poll_due)
+        dev_index, device, req_template, mb_data = self._polls[poll_index]
+        self.assembler.reset(device['mb_id'], req_template.exp_num_bytes_ret)
+        self.serial_conn.reset_input_buffer()
+        mb_poll.set_rpi_pin_tx(self.pi_pin_cntl)
+        self.serial_conn.write(req_template.get_packet())
+        mb_poll.set_rpi_pin_rx(self.pi_pin_cntl)
+
+        # the reply timeout starts once the request has left the port at line rate
+        packet_len = len(req_template.packet)
+        self._deadline = now + packet_len * 11 / self.baudrate + device['mb_timeout'] / 1000
+        self._in_flight = (poll_index, due_time, now)
+        self.stats.num_requests += 1
+        self.stats.bytes_tx += packet_len
+
+    def on_readable(self, on_result):
+        data = self.serial_conn.read(self.serial_conn.in_waiting or 1)
+        self.stats.bytes_rx += len(data)
+        if self._in_flight is None or not data:
+            return  # nobody asked, drop it
+        frame = self.assembler.feed(data)
+        if frame is None:
+            return
+
+        poll_index = self._in_flight[0]
+        dev_index, device, req_template, mb_data = self._polls[poll_index]
+        error_code, recv_packet = mb_poll.verify_no_comm_errs(self.serial_port, frame, None, 0)
+        if error_code is not None:
+            self.stats.num_crc_errs += 1
+            self._finish(time.monotonic(), error_code, on_result)
+            return
+        self.stats.num_replies += 1
+        error_code, register_list = mb_poll.verify_no_modbus_errs(recv_packet, device['mb_id'], device['mb_func'],
+                                                                  None, False, None)
+        if error_code is not None:
+            self.stats.num_exceptions += 1
+            self._finish(time.monotonic(), error_code, on_result)
+            return
+        mb_data.translate_regs_to_vals(register_list)
+        self._finish(time.monotonic(), mb_data.get_value_array(), on_result)
+
+    def _finish(self, now, otpt, on_result):
+        poll_index, due_time, send_time = self._in_flight
+        self._in_flight = None
+        self.stats.busy_time += now - send_time
+        self._quiet_until = now + self.silent_interval
+        # fixed rate schedule, but never try to catch up on polls missed while the bus was busy
+        heapq.heappush(self._poll_due, (max(due_time + self._polls[poll_index][1]['poll_delay'] / 1000, now),
+                                        poll_index))
+        on_result(self._polls[poll_index][0], time.time_ns(), otpt)
+
+
+class SerialMux:
+    """Polls devices on any number of serial ports from one thread, each bus running at its own line rate."""
+    def __init__(self, devices, on_result=None):
+        self.devices = [make_device(device) for device in devices]
+        self.on_result = on_result  # called as on_result(dev_index, time_ns, otpt) for every poll of every bus
+
+        self.buses = {}  # serial port: SerialBus
+        for dev_index, device in enumerate(self.devices):
+            bus = self.buses.get(device['serial_port'])
+            if bus is None:
+                bus = SerialBus(device['serial_port'], device['baudrate'], device['pi_pin_cntl'])
+                self.buses[device['serial_port']] = bus
+            bus.add_device(dev_index, device)
+
+        self.latest = {}  # dev_index: (time_ns, otpt)
+        self.num_polls = 0
+        self.num_errs = 0
+        self._selector = None
+        self._b_stopping = False
+
+    def _on_result(self, dev_index, poll_time_ns, otpt):
+        self.latest[dev_index] = (poll_time_ns, otpt)
+        self.num_polls += 1
+        if otpt and otpt[0] == 'Err':
+            self.num_errs += 1
+        if self.on_result is not None:
+            self.on_result(dev_index, poll_time_ns, otpt)
+
+    def open(self):
+        # returns {serial port: error tuple} for ports that could not be opened, the rest are polled anyway
+        self._selector = selectors.DefaultSelector()
+        port_errs = {}
+        for serial_port, bus in self.buses.items():
+            error_code = bus.open()
+            if error_code is not None:
+                port_errs[serial_port] = error_code
+                continue
+            self._selector.register(bus.fileno(), selectors.EVENT_READ, bus)
+        return port_errs
+
+    def close(self):
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        for bus in self.buses.values():
+            bus.close()
+
+    def get_stats(self):
+        # {serial port: counters} plus 'total' summed over every bus
+        bus_stats = {serial_port: bus.stats.to_dict() for serial_port, bus in self.buses.items()}
+        bus_stats['total'] = {key: sum(stats[key] for stats in list(bus_stats.values())) for key in BusStats.__slots__}
+        return bus_stats
+
+    def stop(self):
+        self._b_stopping = True  # safe to call from another thread, the loop ends within one wakeup
+
+    def run(self, duration=None, max_wait=0.1):
+        # event loop, until duration (s) runs out, stop is called or Ctrl-C.  Opens the ports if open was not called
+        if self._selector is None:
+            for serial_port, error_code in self.open().items():
+                print(serial_port, error_code)
+        live_buses = [bus for bus in self.buses.values() if bus.serial_conn is not None]
+        end_time = None if duration is None else time.monotonic() + duration
+        self._b_stopping = False
+        try:
+            while not self._b_stopping and live_buses:
+                now = time.monotonic()
+                if end_time is not None and now >= end_time:
+                    break
+                for bus in live_buses:
+                    bus.service(now, self._on_result)
+
+                # sleep until a byte arrives or the nearest timeout or poll is due
+                wakeups = [wakeup for wakeup in (bus.get_wakeup() for bus in live_buses) if wakeup is not None]
+                wait_time = min(wakeups + [now + max_wait]) - time.monotonic()
+                if end_time is not None:
+                    wait_time = min(wait_time, end_time - time.monotonic())
+                for key, events in self._selector.select(max(0, wait_time)):
+                    key.data.on_readable(self._on_result)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+
+def main(argv=None):
+    import argparse
+    import csv
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(description='Polls modbus devices on several serial ports from one process.')
+    parser.add_argument('devices', type=str,
+                        help='JSON file with a list of devices, each with serial_port and mb_id plus any of: ' +
+                             ', '.join(sorted(DEVICE_DEFAULTS)) + '.')
+    parser.add_argument('-d', '--duration', type=float, default=None,
+                        help='Seconds to poll for. Default is until Ctrl-C.')
+    parser.add_argument('-fl', '--file', type=str, default=None,
+                        help='Writes every result to this csv file. Default only prints a summary.')
+    args = parser.parse_args(argv)
+
+    with open(args.devices) as devices_file:
+        devices = json.load(devices_file)
+
+    csv_file = None
+    on_result = None
+    if args.file is not None:
+        csv_file = open(args.file if args.file.endswith('.csv') else args.file + '.csv', 'w', newline='')
+        csv_file_wrtr = csv.writer(csv_file)
+        csv_file_wrtr.writerow(['Datetime', 'serial_port', 'mb_id', 'start_reg', 'values'])
+
+        def on_result(dev_index, poll_time_ns, otpt):
+            device = serial_mux.devices[dev_index]
+            csv_file_wrtr.writerow([str(datetime.fromtimestamp(poll_time_ns / 1e9)), device['serial_port'],
+                                    device['mb_id'], device['start_reg']] + list(otpt))
+
+    serial_mux = SerialMux(devices, on_result)
+    print('Polling', len(serial_mux.devices), 'devices on', len(serial_mux.buses), 'serial ports. Ctrl-C to exit.')
+    start_time = time.monotonic()
+    serial_mux.run(args.duration)
+    run_time = time.monotonic() - start_time
+
+    if csv_file is not None:
+        csv_file.close()
+    for serial_port, stats in serial_mux.get_stats().items():
+        print(serial_port, ':', stats['num_requests'], 'requests,', stats['num_replies'], 'replies,',
+              stats['num_timeouts'], 'timeouts,', stats['num_crc_errs'], 'crc errors,',
+              round(stats['busy_time'] / max(run_time, 1e-9) * 100, 1), '% busy', file=sys.stderr)
+    print(serial_mux.num_polls, 'polls,', serial_mux.num_errs, 'errors,', round(serial_mux.num_polls / run_time, 1),
+          'polls per second.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+
+import os
+import time
+import heapq
+import signal
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from datetime import datetime
+try:
+    from mbpy import mb_client  # folder.file import
+except ImportError:
+    import mb_client  # run from inside the mbpy folder
+
+
+# everything a device entry can hold, anything left out takes these values
+DEVICE_DEFAULTS = {'port': 502, 'transport': 'tcp', 'start_reg': 1, 'num_vals': 1, 'data_type': 'float', 'mb_func': 3,
+                   'b_byteswap': False, 'b_wordswap': False, 'zero_based': False, 'mb_timeout': 1500,
+                   'poll_delay': 1000, 'b_raw_bytes': False}
+
+
+def make_device(device):
+    # fills in defaults for a device dict, needs at least 'ip' and 'mb_id'
+    unknown_keys = set(device) - set(DEVICE_DEFAULTS) - {'ip', 'mb_id'}
+    if 'ip' not in device or 'mb_id' not in device or unknown_keys:
+        raise ValueError('Device needs ip and mb_id, unknown keys: ' + ', '.join(sorted(unknown_keys)))
+    full_device = dict(DEVICE_DEFAULTS)
+    full_device.update(device)
+    return full_device
+
+
+def group_by_gateway(indexed_devices):
+    # {(ip, port, transport): [(dev_index, device), ...]}, each group shares one connection
+    gateways = {}
+    for dev_index, device in indexed_devices:
+        gateways.setdefault((device['ip'], device['port'], device['transport']), []).append((dev_index, device))
+    return gateways
+
+
+def shard_by_gateway(devices, num_workers):
+    # hands whole gateways to workers, largest first to whichever worker has the fewest devices so far
+    gateways = group_by_gateway(enumerate(devices))
+    shards = [[] for worker_iter in range(max(1, min(num_workers, len(gateways))))]
+    for gateway_devices in sorted(gateways.values(), key=len, reverse=True):
+        min(shards, key=len).extend(gateway_devices)
+    return shards
+
+
+def poll_gateway(gateway_devices, stop_event, results, results_lock, flush_event, batch_size):
+    # one thread per gateway, the only user of that gateway's connection
+    first_device = gateway_devices[0][1]
+    client = mb_client.ModbusClient(first_device['ip'], first_device['port'],
+                                    max(device['mb_timeout'] for dev_index, device in gateway_devices),
+                                    transport=first_device['transport'])
+    devices = dict(gateway_devices)
+    poll_due = [(time.monotonic(), dev_index) for dev_index, device in gateway_devices]
+    heapq.heapify(poll_due)
+
+    try:
+        while not stop_event.is_set():
+            due_time, dev_index = heapq.heappop(poll_due)
+            if due_time > time.monotonic() and stop_event.wait(due_time - time.monotonic()):
+                break
+
+            device = devices[dev_index]
+            poll_time_ns = time.time_ns()
+            otpt = client.request(device['mb_id'], device['mb_func'], device['start_reg'], device['num_vals'],
+                                  device['data_type'], device['b_byteswap'], device['b_wordswap'],
+                                  device['zero_based'], b_raw_bytes=device['b_raw_bytes'])
+            with results_lock:
+                results.append((dev_index, poll_time_ns, otpt))
+                if len(results) >= batch_size:
+                    flush_event.set()
+
+            # fixed rate schedule, but never try to catch up on polls missed while the device was slow
+            heapq.heappush(poll_due, (max(due_time + device['poll_delay'] / 1000, time.monotonic()), dev_index))
+    finally:
+        client.close()
+
+
+def wait_for_stop(stop_conn, stop_event):
+    try:
+        stop_conn.recv()
+    except (EOFError, OSError):
+        pass  # the parent has gone away, stop as well
+    stop_event.set()
+
+
+def run_shard(shard, result_conn, stop_conn, batch_size, batch_period, parent_conns=()):
+    # body of a worker process, polls its gateways and ships results to the parent in batches
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C and sends the stop
+    for parent_conn in parent_conns:
+        parent_conn.close()  # copies a fork left behind, the stop pipe only sees EOF once the parent holds the last
+
+    # nothing is shared with other processes besides the two pipes, a worker killed in the middle of anything cannot
+    # leave a lock held that the others would block on
+    stop_event = threading.Event()
+    threading.Thread(target=wait_for_stop, args=(stop_conn, stop_event), daemon=True).start()
+
+    results = []
+    results_lock = threading.Lock()
+    flush_event = threading.Event()
+    gateway_threads = [threading.Thread(target=poll_gateway, daemon=True,
+                                        args=(gateway_devices, stop_event, results, results_lock, flush_event,
+                                              batch_size))
+                       for gateway_devices in group_by_gateway(shard).values()]
+    for gateway_thread in gateway_threads:
+        gateway_thread.start()
+
+    while True:
+        b_stopping = stop_event.is_set()
+        flush_event.wait(batch_period)
+        flush_event.clear()
+        with results_lock:
+            batch = results[:]
+            del results[:]
+        if batch:
+            result_conn.send(batch)  # one pickle per batch instead of one per poll
+        if b_stopping:
+            break
+
+    for gateway_thread in gateway_threads:
+        gateway_thread.join(timeout=1)
+    result_conn.close()
+
+
+class ShardedPoller:
+    """Polls a large device list from several processes, each owning the connections to its own gateways."""
+    def __init__(self, devices, num_workers=None, on_batch=None, batch_size=500, batch_period=0.5, max_restarts=5):
+        self.devices = [make_device(device) for device in devices]
+        self.shards = shard_by_gateway(self.devices, num_workers or os.cpu_count() or 1)
+        self.on_batch = on_batch  # called in this process as on_batch(batch) with [(dev_index, time_ns, otpt), ...]
+        self.batch_size = batch_size
+        self.batch_period = batch_period
+        self.max_restarts = max_restarts
+
+        self.latest = {}  # dev_index: (time_ns, otpt)
+        self.num_polls = 0
+        self.num_errs = 0
+        self.restarts = [0] * len(self.shards)
+
+        self._mp_context = multiprocessing.get_context()
+        self._b_stopping = False
+        self._workers = [None] * len(self.shards)
+        # pipes per worker rather than a shared queue and event, a worker killed mid send can only break its own
+        self._result_conns = [None] * len(self.shards)
+        self._stop_conns = [None] * len(self.shards)
+
+    def _start_worker(self, worker_id):
+        recv_conn, send_conn = self._mp_context.Pipe(duplex=False)
+        stop_recv_conn, stop_send_conn = self._mp_context.Pipe(duplex=False)
+        parent_conns = []
+        if self._mp_context.get_start_method() == 'fork':
+            # a forked worker holds every pipe end this process has open, its own and the other workers'
+            parent_conns = [recv_conn, stop_send_conn] + [conn for conn in self._result_conns + self._stop_conns
+                                                          if conn is not None]
+        worker = self._mp_context.Process(target=run_shard, name='mb_shard_' + str(worker_id), daemon=True,
+                                          args=(self.shards[worker_id], send_conn, stop_recv_conn,
+                                                self.batch_size, self.batch_period, parent_conns))
+        worker.start()
+        send_conn.close()  # only the worker writes to it, so recv sees EOF once the worker is gone
+        stop_recv_conn.close()
+        self._workers[worker_id] = worker
+        self._result_conns[worker_id] = recv_conn
+        self._stop_conns[worker_id] = stop_send_conn
+
+    def start(self):
+        self._b_stopping = False
+        for worker_id in range(len(self.shards)):
+            self._start_worker(worker_id)
+
+    def _aggregate(self, batch):
+        for dev_index, poll_time_ns, otpt in batch:
+            self.latest[dev_index] = (poll_time_ns, otpt)
+            self.num_polls += 1
+            if otpt and otpt[0] == 'Err':
+                self.num_errs += 1
+        if self.on_batch is not None:
+            self.on_batch(batch)
+
+    def _receive(self, timeout):
+        # aggregates whatever batches arrive within timeout, returns ids of workers whose pipe has closed
+        closed_ids = []
+        live_conns = [result_conn for result_conn in self._result_conns if result_conn is not None]
+        if not live_conns:
+            time.sleep(timeout)
+            return closed_ids
+
+        for result_conn in wait(live_conns, timeout):
+            worker_id = self._result_conns.index(result_conn)
+            try:
+                batch = result_conn.recv()
+            except (EOFError, OSError):
+                result_conn.close()
+                self._result_conns[worker_id] = None
+                closed_ids.append(worker_id)
+            else:
+                self._aggregate(batch)
+        return closed_ids
+
+    def _supervise(self, closed_ids):
+        # restarts crashed workers, giving up on a shard once it has crashed max_restarts times
+        for worker_id in closed_ids:
+            worker = self._workers[worker_id]
+            if worker is None or self._b_stopping:
+                continue
+            worker.join(timeout=1)
+            self._stop_conns[worker_id].close()
+            if self.restarts[worker_id] >= self.max_restarts:
+                print('Worker', worker_id, 'exited with code', worker.exitcode, 'too many times, dropping',
+                      len(self.shards[worker_id]), 'devices.')
+                self._workers[worker_id] = None
+                continue
+            self.restarts[worker_id] += 1
+            print('Worker', worker_id, 'exited with code', worker.exitcode, 'restarting.')
+            self._start_worker(worker_id)
+
+    def run(self, duration=None):
+        # aggregates results until duration (s) runs out, every worker is gone or Ctrl-C
+        end_time = None if duration is None else time.monotonic() + duration
+        try:
+            while end_time is None or time.monotonic() < end_time:
+                self._supervise(self._receive(self.batch_period))
+                if not any(self._workers):
+                    break
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stop(self, grace_period=5):
+        # lets the workers flush their last batches, then terminates any that are still running
+        self._b_stopping = True
+        for stop_conn in self._stop_conns:
+            if stop_conn is not None:
+                try:
+                    stop_conn.send(True)
+                except OSError:
+                    pass  # worker already gone
+        end_time = time.monotonic() + grace_period
+        while any(self._result_conns) and time.monotonic() < end_time:
+            self._receive(0.1)
+        for worker_id, worker in enumerate(self._workers):
+            if worker is not None:
+                worker.join(timeout=0.1)
+                if worker.is_alive():
+                    worker.terminate()
+            for worker_conns in (self._result_conns, self._stop_conns):
+                if worker_conns[worker_id] is not None:
+                    worker_conns[worker_id].close()
+        self._workers = [None] * len(self.shards)
+        self._result_conns = [None] * len(self.shards)
+        self._stop_conns = [None] * len(self.shards)
+
+
+def main(argv=None):
+    import argparse
+    import csv
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(description='Polls many modbus devices from a pool of worker processes.')
+    parser.add_argument('devices', type=str,
+                        help='JSON file with a list of devices, each with ip and mb_id plus any of: ' +
+                             ', '.join(sorted(DEVICE_DEFAULTS)) + '.')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of worker processes. Default is one per cpu.')
+    parser.add_argument('-d', '--duration', type=float, default=None,
+                        help='Seconds to poll for. Default is until Ctrl-C.')
+    parser.add_argument('-fl', '--file', type=str, default=None,
+                        help='Writes every result to this csv file. Default only prints a summary.')
+    args = parser.parse_args(argv)
+
+    with open(args.devices) as devices_file:
+        devices = json.load(devices_file)
+
+    csv_file = None
+    on_batch = None
+    if args.file is not None:
+        csv_file = open(args.file if args.file.endswith('.csv') else args.file + '.csv', 'w', newline='')
+        csv_file_wrtr = csv.writer(csv_file)
+        csv_file_wrtr.writerow(['Datetime', 'ip', 'mb_id', 'start_reg', 'values'])
+
+        def on_batch(batch):
+            csv_file_wrtr.writerows([str(datetime.fromtimestamp(poll_time_ns / 1e9)), poller.devices[dev_index]['ip'],
+                                     poller.devices[dev_index]['mb_id'], poller.devices[dev_index]['start_reg']] +
+                                    list(otpt) for dev_index, poll_time_ns, otpt in batch)
+
+    poller = ShardedPoller(devices, args.workers, on_batch)
+    print('Polling', len(poller.devices), 'devices with', len(poller.shards), 'workers. Ctrl-C to exit.')
+    start_time = time.monotonic()
+    poller.start()
+    poller.run(args.duration)
+    run_time = time.monotonic() - start_time
+
+    if csv_file is not None:
+        csv_file.close()
+    print(poller.num_polls, 'polls,', poller.num_errs, 'errors,', round(poller.num_polls / run_time, 1),
+          'polls per second.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
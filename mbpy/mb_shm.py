@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+import time
+from struct import Struct
+from multiprocessing import shared_memory
+
+
+# layout of the table:  header | point names | rows
+#   header: magic, layout version, number of points, bytes per name, sequence number (odd while being written)
+#   row:    value (float64), time in ns of the poll (int64), status (int32, 0 or the MB_ERR_DICT number), padding
+SHM_MAGIC = b'MBSV'
+SHM_VERSION = 1
+HEADER_STRUCT = Struct('<4sIIIQ')
+HEADER_SIZE = 64
+SEQ_OFFSET = 16
+SEQ_STRUCT = Struct('<Q')
+NAME_SIZE = 64
+ROW_STRUCT = Struct('<dqi4x')
+ROW_NUMPY_DTYPE = {'names': ['value', 'ts_ns', 'status'], 'formats': ['<f8', '<i8', '<i4'], 'offsets': [0, 8, 16],
+                   'itemsize': ROW_STRUCT.size}
+
+
+def value_to_float(val):
+    # every value is stored as a float64, hex and bin strings go back to their register value, ascii to its bytes
+    if isinstance(val, str):
+        if val.startswith(('0x', '0b', '-0x', '-0b')):
+            return float(int(val, 0))
+        return float(int.from_bytes(val.encode('latin-1', 'ignore'), byteorder='big'))
+    return float(val)
+
+
+class SharedValueTable:
+    """Latest value of every point in shared memory, written by one poller and read by any number of processes.
+
+    Writers bump the sequence number to odd before changing rows and back to even after, readers retry whenever
+    the number was odd or changed while they read (a seqlock), so nobody ever waits on a lock.
+    """
+    def __init__(self, shm, names, b_owner):
+        self._shm = shm
+        self._buf = shm.buf
+        self.names = names
+        self.b_owner = b_owner
+        self.index = {name: row_iter for row_iter, name in enumerate(names)}
+        self.rows_offset = HEADER_SIZE + NAME_SIZE * len(names)
+
+    @classmethod
+    def create(cls, names, shm_name=None):
+        names = list(names)
+        long_names = [name for name in names if len(name.encode('utf-8')) > NAME_SIZE]
+        if long_names:
+            raise ValueError('Point names can be at most ' + str(NAME_SIZE) + ' bytes: ' + ', '.join(long_names))
+        shm = shared_memory.SharedMemory(name=shm_name, create=True,
+                                         size=HEADER_SIZE + (NAME_SIZE + ROW_STRUCT.size) * max(1, len(names)))
+        HEADER_STRUCT.pack_into(shm.buf, 0, SHM_MAGIC, SHM_VERSION, len(names), NAME_SIZE, 0)
+        for row_iter, name in enumerate(names):
+            name_bytes = name.encode('utf-8')
+            shm.buf[HEADER_SIZE + NAME_SIZE * row_iter:HEADER_SIZE + NAME_SIZE * row_iter + len(name_bytes)] = \
+                name_bytes
+        table = cls(shm, names, True)
+        for row_iter in range(len(names)):
+            ROW_STRUCT.pack_into(table._buf, table.rows_offset + ROW_STRUCT.size * row_iter, float('nan'), 0, 0)
+        return table
+
+    @classmethod
+    def from_poll_plan(cls, poll_plan, shm_name=None):
+        return cls.create([point['name'] for point in poll_plan.points], shm_name)
+
+    @classmethod
+    def attach(cls, shm_name):
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name, track=False)
+        except TypeError:  # python < 3.13 tracks every segment and would unlink it when this reader exits
+            shm = shared_memory.SharedMemory(name=shm_name)
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+
+        magic, version, num_points, name_size, seq = HEADER_STRUCT.unpack_from(shm.buf, 0)
+        if magic != SHM_MAGIC or version != SHM_VERSION or name_size != NAME_SIZE:
+            shm.close()
+            raise ValueError('Shared memory ' + shm_name + ' is not a value table this version can read.')
+        names = [bytes(shm.buf[HEADER_SIZE + NAME_SIZE * row_iter:HEADER_SIZE + NAME_SIZE * (row_iter + 1)])
+                 .rstrip(b'\x00').decode('utf-8', 'ignore') for row_iter in range(num_points)]
+        return cls(shm, names, False)
+
+    @property
+    def shm_name(self):
+        return self._shm.name
+
+    def close(self):
+        # raises BufferError while an array from as_numpy is still alive, del it first.  The owner unlinks the table
+        # either way, so it goes once the last process lets go of it
+        self._buf = None
+        try:
+            self._shm.close()
+        finally:
+            if self.b_owner:
+                self.b_owner = False
+                self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # writer side
+    def publish(self, point_vals, ts_ns=None):
+        # point_vals is {name: value} as returned by PollPlan.scan, an error tuple keeps the last value and sets status
+        if ts_ns is None:
+            ts_ns = time.time_ns()
+        seq = SEQ_STRUCT.unpack_from(self._buf, SEQ_OFFSET)[0]
+        SEQ_STRUCT.pack_into(self._buf, SEQ_OFFSET, seq + 1)  # odd, readers will retry
+        try:
+            for name, val in point_vals.items():
+                row_iter = self.index.get(name)
+                if row_iter is None:
+                    continue
+                row_offset = self.rows_offset + ROW_STRUCT.size * row_iter
+                if isinstance(val, tuple) and val and val[0] == 'Err':
+                    ROW_STRUCT.pack_into(self._buf, row_offset, ROW_STRUCT.unpack_from(self._buf, row_offset)[0],
+                                         ts_ns, val[1])
+                else:
+                    try:
+                        ROW_STRUCT.pack_into(self._buf, row_offset, value_to_float(val), ts_ns, 0)
+                    except (TypeError, ValueError, OverflowError):
+                        ROW_STRUCT.pack_into(self._buf, row_offset, float('nan'), ts_ns, 102)  # invalid data type
+        finally:
+            SEQ_STRUCT.pack_into(self._buf, SEQ_OFFSET, seq + 2)  # even again, rows are consistent
+
+    # reader side
+    def read_begin(self):
+        # waits out a writer in progress and returns the sequence number to hand to read_retry
+        while True:
+            seq = SEQ_STRUCT.unpack_from(self._buf, SEQ_OFFSET)[0]
+            if not seq & 0x1:
+                return seq
+            time.sleep(0)
+
+    def read_retry(self, seq):
+        # True if a write happened since read_begin and whatever was read has to be read again
+        return SEQ_STRUCT.unpack_from(self._buf, SEQ_OFFSET)[0] != seq
+
+    def read_point(self, name):
+        # (value, ts_ns, status) of one point
+        row_offset = self.rows_offset + ROW_STRUCT.size * self.index[name]
+        while True:
+            seq = self.read_begin()
+            row = ROW_STRUCT.unpack_from(self._buf, row_offset)
+            if not self.read_retry(seq):
+                return row
+
+    def snapshot(self):
+        # {name: (value, ts_ns, status)} for every point, all from the same write
+        while True:
+            seq = self.read_begin()
+            rows = list(ROW_STRUCT.iter_unpack(self._buf[self.rows_offset:self.rows_offset +
+                                                         ROW_STRUCT.size * len(self.names)]))
+            if not self.read_retry(seq):
+                return dict(zip(self.names, rows))
+
+    def as_numpy(self):
+        # structured array (value, ts_ns, status) mapped straight onto the shared rows, no copy.  Wrap reads in
+        # read_begin and read_retry to be sure they all came from the same write.  The array has to be deleted
+        # before close.
+        import numpy  # optional, only needed for this view
+        return numpy.ndarray((len(self.names),), dtype=numpy.dtype(ROW_NUMPY_DTYPE), buffer=self._buf,
+                             offset=self.rows_offset)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Prints the latest values from a shared memory value table.')
+    parser.add_argument('shm_name', type=str, help='Name the poller published the table under.')
+    parser.add_argument('-p', '--poll', type=int, default=1, help='The number of reads. Default is 1, 0 is forever.')
+    parser.add_argument('-pd', '--pdelay', type=int, default=1000, help='Delay in ms between reads. Default is 1000.')
+    args = parser.parse_args(argv)
+
+    with SharedValueTable.attach(args.shm_name) as table:
+        cur_poll = 0
+        try:
+            while args.poll < 1 or cur_poll < args.poll:
+                if cur_poll:
+                    time.sleep(args.pdelay / 1000)
+                for name, (val, ts_ns, status) in table.snapshot().items():
+                    print(name, ':', val if status == 0 else ('Err', status), ts_ns)
+                cur_poll += 1
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
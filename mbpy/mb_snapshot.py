@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+
+import time
+import errno
+import socket
+import selectors
+from datetime import datetime
+try:
+    from mbpy import mb_poll  # folder.file import
+    from mbpy import mb_result
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+    import mb_result
+
+
+# everything a device entry can hold, anything left out takes these values
+DEVICE_DEFAULTS = {'port': 502, 'start_reg': 1, 'num_vals': 1, 'data_type': 'float', 'mb_func': 3,
+                   'b_byteswap': False, 'b_wordswap': False, 'zero_based': False, 'b_raw_bytes': False}
+SPIN_TIME = 0.002  # s before the instant that are spent spinning instead of sleeping
+MAX_REQUEST_REGS = {1: 2000, 2: 2000, 3: 125, 4: 125}  # most coils or registers one read may ask for
+
+
+def make_device(device):
+    # fills in defaults for a device dict, needs at least 'ip' and 'mb_id', raises ValueError if unusable
+    unknown_keys = set(device) - set(DEVICE_DEFAULTS) - {'ip', 'mb_id'}
+    if 'ip' not in device or 'mb_id' not in device or unknown_keys:
+        raise ValueError('Device needs ip and mb_id, unknown keys: ' + ', '.join(sorted(unknown_keys)))
+    full_device = dict(DEVICE_DEFAULTS)
+    full_device.update(device)
+    if full_device['mb_func'] not in (1, 2, 3, 4):
+        raise ValueError('Only functions 1, 2, 3 and 4 can be polled.')
+    if full_device['data_type'] not in mb_poll.DATA_TYPE_LIST:
+        raise ValueError('Invalid data_type ' + str(full_device['data_type']) + '.')
+    try:
+        full_device['mb_id'] = mb_poll.device_bw(full_device['mb_id'])
+        full_device['start_reg'] = mb_poll.register_bw(full_device['start_reg'])
+        num_regs = mb_poll.get_expected_num_ret_bytes(False, full_device['mb_func'], full_device['num_vals'],
+                                                      full_device['data_type'])[1]
+    except Exception as err:  # ValueError, TypeError or the argparse.ArgumentTypeError of the mb_poll checks
+        raise ValueError('Device ' + str(device['mb_id']) + ' at ' + str(device['ip']) + ': ' + str(err))
+    full_device['num_vals'] = int(full_device['num_vals'])
+    start_reg_zero = full_device['start_reg'] - (not full_device['zero_based'])
+    if num_regs > MAX_REQUEST_REGS[full_device['mb_func']] or start_reg_zero < 0 or \
+            start_reg_zero + num_regs > 0x10000:
+        raise ValueError('Device ' + str(device['mb_id']) + ' at ' + str(device['ip']) + ': function ' +
+                         str(full_device['mb_func']) + ' can read at most ' +
+                         str(MAX_REQUEST_REGS[full_device['mb_func']]) + ' registers, all below 65536.')
+    return full_device
+
+
+def wait_until_ns(instant_ns):
+    # sleeps most of the way and spins the rest, time.sleep alone overshoots by up to a scheduler tick
+    while True:
+        time_left = (instant_ns - time.time_ns()) / 1e9
+        if time_left <= 0:
+            return
+        if time_left > SPIN_TIME:
+            time.sleep(time_left - SPIN_TIME)
+
+
+class Snapshot:
+    """Every device read in one burst, with the times each request went out and each reply came back."""
+    def __init__(self, instant_ns, results):
+        self.instant_ns = instant_ns  # when the burst was scheduled for
+        self.results = results  # mb_result.ResultBatch, one poll per device in device order
+
+    def get_send_skew_ns(self):
+        # spread between the first and last request leaving this host, devices that were not connected sent nothing
+        sent_ns = [send_ns for send_ns in self.results.send_ns if send_ns]
+        if not sent_ns:
+            return 0
+        return max(sent_ns) - min(sent_ns)
+
+    def get_skew_ns(self):
+        # spread of the middle of each good round trip, the best guess of when each device took its reading
+        mid_ns = [(send_ns + recv_ns) // 2 for send_ns, recv_ns, error in
+                  zip(self.results.send_ns, self.results.recv_ns, self.results.errors) if not error]
+        if not mid_ns:
+            return 0
+        return max(mid_ns) - min(mid_ns)
+
+    def get_num_errs(self):
+        return self.results.get_num_errs()
+
+
+class _Endpoint:
+    """One pre-opened connection and the devices read over it."""
+    __slots__ = ('ip', 'port', 'sock', 'dev_indexes', 'trans_id', 'buffer')
+
+    def __init__(self, ip, port):
+        self.ip = ip
+        self.port = port
+        self.sock = None
+        self.dev_indexes = []
+        self.trans_id = 0
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class SnapshotPoller:
+    """Reads many TCP devices at nearly the same instant.
+
+    Connections are opened ahead of time and requests are compiled once, so a snapshot is a single pass of non
+    blocking sends followed by one select loop for the replies.  Devices behind the same ip and port share a
+    connection and their requests are pipelined with their own transaction ids.
+    """
+    def __init__(self, devices, mb_timeout=1500):
+        self.devices = [make_device(device) for device in devices]
+        self.mb_timeout = mb_timeout / 1000  # convert from ms to s
+
+        self.endpoints = {}  # (ip, port): _Endpoint
+        self._templates = []
+        self._mb_datas = []
+        for dev_index, device in enumerate(self.devices):
+            endpoint = self.endpoints.get((device['ip'], device['port']))
+            if endpoint is None:
+                endpoint = _Endpoint(device['ip'], device['port'])
+                self.endpoints[(device['ip'], device['port'])] = endpoint
+            endpoint.dev_indexes.append(dev_index)
+
+            start_reg_zero = device['start_reg'] - (not device['zero_based'])
+            exp_num_bytes_ret, num_regs = mb_poll.get_expected_num_ret_bytes(False, device['mb_func'],
+                                                                             device['num_vals'], device['data_type'])
+            self._templates.append(mb_poll.RequestTemplate(None, False, device['mb_id'], device['mb_func'],
+                                                           start_reg_zero, None, num_regs, exp_num_bytes_ret))
+            self._mb_datas.append(mb_poll.ModbusData(device['start_reg'], device['num_vals'], device['b_byteswap'],
+                                                     device['b_wordswap'], None, device['data_type'],
+                                                     device['mb_func'], b_raw_bytes=device['b_raw_bytes']))
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def connect(self):
+        # opens every closed connection at once, returns the number that could not be opened
+        pending = {}
+        with selectors.DefaultSelector() as selector:
+            for endpoint in self.endpoints.values():
+                if endpoint.sock is not None:
+                    continue
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # every request leaves at once
+                connect_err = sock.connect_ex((endpoint.ip, endpoint.port))
+                if connect_err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    sock.close()
+                    continue
+                pending[sock] = endpoint
+                selector.register(sock, selectors.EVENT_WRITE, endpoint)
+
+            end_time = time.monotonic() + self.mb_timeout
+            while pending and time.monotonic() < end_time:
+                for key, events in selector.select(end_time - time.monotonic()):
+                    selector.unregister(key.fileobj)
+                    del pending[key.fileobj]
+                    if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                        key.data.sock = key.fileobj
+                        key.data.buffer = bytearray()
+                    else:
+                        key.fileobj.close()
+        for sock in pending:
+            sock.close()
+        return sum(1 for endpoint in self.endpoints.values() if endpoint.sock is None)
+
+    def close(self):
+        for endpoint in self.endpoints.values():
+            endpoint.close()
+
+    def take(self, instant_ns=None):
+        # reads every device in one burst at instant_ns (time.time_ns, default now) and returns a Snapshot
+        self.connect()  # only connections lost since the last snapshot, well before the instant
+        num_devices = len(self.devices)
+        send_ns = [0] * num_devices
+        recv_ns = [0] * num_devices
+        frames = [None] * num_devices
+        errors = [None] * num_devices
+        in_flight = {}  # (endpoint ip, port, trans_id): dev_index
+
+        # every request of a connection goes out in one send, built before the instant
+        bursts = []  # (endpoint, bytes of every request, dev_indexes)
+        for endpoint in self.endpoints.values():
+            if endpoint.sock is None:
+                for dev_index in endpoint.dev_indexes:
+                    errors[dev_index] = mb_poll.MB_ERR_DICT[19]
+                continue
+            burst = bytearray()
+            for dev_index in endpoint.dev_indexes:
+                endpoint.trans_id = (endpoint.trans_id + 1) & 0xFFFF
+                burst.extend(self._templates[dev_index].get_packet(endpoint.trans_id))
+                in_flight[(endpoint.ip, endpoint.port, endpoint.trans_id)] = dev_index
+            bursts.append((endpoint, bytes(burst), endpoint.dev_indexes))
+
+        if instant_ns is not None:
+            wait_until_ns(instant_ns)
+        else:
+            instant_ns = time.time_ns()
+
+        # the burst, nothing in here but sends
+        for endpoint, burst, dev_indexes in bursts:
+            burst_ns = time.time_ns()
+            try:
+                b_sent = endpoint.sock.send(burst) == len(burst)
+            except OSError:
+                b_sent = False
+            for dev_index in dev_indexes:
+                send_ns[dev_index] = burst_ns
+            if not b_sent:
+                for dev_index in dev_indexes:
+                    errors[dev_index] = mb_poll.MB_ERR_DICT[106]
+                for in_flight_key in [key for key, dev_index in in_flight.items() if dev_index in dev_indexes]:
+                    del in_flight[in_flight_key]
+
+        # replies, stamped the moment they are read
+        with selectors.DefaultSelector() as selector:
+            for endpoint in self.endpoints.values():
+                if endpoint.sock is not None:
+                    selector.register(endpoint.sock, selectors.EVENT_READ, endpoint)
+            end_time = time.monotonic() + self.mb_timeout
+            while in_flight and time.monotonic() < end_time:
+                for key, events in selector.select(end_time - time.monotonic()):
+                    endpoint = key.data
+                    try:
+                        recv_chunk = endpoint.sock.recv(4096)
+                    except OSError:
+                        recv_chunk = b''
+                    chunk_ns = time.time_ns()
+                    if not recv_chunk:
+                        selector.unregister(endpoint.sock)
+                        endpoint.close()  # reopened before the next snapshot
+                        continue
+                    endpoint.buffer.extend(recv_chunk)
+                    while len(endpoint.buffer) >= 6:
+                        frame_len = 6 + int.from_bytes(endpoint.buffer[4:6], byteorder='big')
+                        if len(endpoint.buffer) < frame_len:
+                            break
+                        trans_id = int.from_bytes(endpoint.buffer[:2], byteorder='big')
+                        dev_index = in_flight.pop((endpoint.ip, endpoint.port, trans_id), None)
+                        if dev_index is not None:  # otherwise a late reply to an earlier snapshot
+                            frames[dev_index] = bytes(endpoint.buffer[:frame_len])
+                            recv_ns[dev_index] = chunk_ns
+                        del endpoint.buffer[:frame_len]
+
+        timeout_ns = time.time_ns()
+        for dev_index in in_flight.values():
+            errors[dev_index] = mb_poll.MB_ERR_DICT[87]
+            recv_ns[dev_index] = timeout_ns
+
+        # decoding waits until every reply is in so it never delays a timestamp
+        results = mb_result.ResultBatch()
+        for dev_index, device in enumerate(self.devices):
+            error_code = errors[dev_index]
+            frame = frames[dev_index]
+            register_list = None
+            if error_code is None:
+                error_code, recv_packet = mb_poll.verify_no_comm_errs(None, frame, None, 0)
+            if error_code is None:
+                error_code, register_list = mb_poll.verify_no_modbus_errs(recv_packet, device['mb_id'],
+                                                                          device['mb_func'], None, False, None)
+            if error_code is not None:
+                results.append_otpt(device['mb_id'], device['mb_func'], device['start_reg'], error_code,
+                                    send_ns[dev_index], recv_ns[dev_index])
+                continue
+            mb_data = self._mb_datas[dev_index]
+            mb_data.translate_regs_to_vals(register_list)
+            results.append_otpt(device['mb_id'], device['mb_func'], device['start_reg'], mb_data.get_value_array(),
+                                send_ns[dev_index], recv_ns[dev_index], memoryview(frame)[9:])
+        return Snapshot(instant_ns, results)
+
+    def run(self, interval=1000, count=None, on_snapshot=None):
+        # a snapshot on every multiple of interval (ms) of the wall clock, so separate pollers line up as well
+        interval_ns = int(interval * 1e6)
+        num_snapshots = 0
+        try:
+            while count is None or num_snapshots < count:
+                instant_ns = (time.time_ns() // interval_ns + 1) * interval_ns
+                snapshot = self.take(instant_ns)
+                num_snapshots += 1
+                if on_snapshot is not None:
+                    on_snapshot(snapshot)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+
+def main(argv=None):
+    import argparse
+    import csv
+    import json
+
+    parser = argparse.ArgumentParser(description='Reads many modbus TCP devices at the same instant.')
+    parser.add_argument('devices', type=str,
+                        help='JSON file with a list of devices, each with ip and mb_id plus any of: ' +
+                             ', '.join(sorted(DEVICE_DEFAULTS)) + '.')
+    parser.add_argument('-i', '--interval', type=float, default=1000,
+                        help='Time in ms between snapshots, aligned to the clock. Default is 1000.')
+    parser.add_argument('-n', '--count', type=int, default=None, help='Number of snapshots. Default is until Ctrl-C.')
+    parser.add_argument('-to', '--timeout', type=mb_poll.timeout_bw, default=1500,
+                        help='Time in milliseconds to wait for reply message. Default is 1500.')
+    parser.add_argument('-fl', '--file', type=str, default=None,
+                        help='Writes every reading to this csv file. Default only prints the skew.')
+    args = parser.parse_args(argv)
+
+    with open(args.devices) as devices_file:
+        devices = json.load(devices_file)
+
+    csv_file = None
+    if args.file is not None:
+        csv_file = open(args.file if args.file.endswith('.csv') else args.file + '.csv', 'w', newline='')
+        csv_file_wrtr = csv.writer(csv_file)
+        csv_file_wrtr.writerow(['Snapshot', 'ip', 'mb_id', 'start_reg', 'send_ns', 'recv_ns', 'values'])
+
+    def on_snapshot(snapshot):
+        print(datetime.fromtimestamp(snapshot.instant_ns / 1e9), ':', len(snapshot.results), 'devices,',
+              snapshot.get_num_errs(), 'errors, send skew', round(snapshot.get_send_skew_ns() / 1e6, 3), 'ms, skew',
+              round(snapshot.get_skew_ns() / 1e6, 3), 'ms')
+        if csv_file is not None:
+            snapshot_time = str(datetime.fromtimestamp(snapshot.instant_ns / 1e9))
+            csv_file_wrtr.writerows([snapshot_time, device['ip'], device['mb_id'], device['start_reg'],
+                                     result.send_ns, result.recv_ns] + list(result.to_otpt())
+                                    for device, result in zip(poller.devices, snapshot.results))
+
+    poller = SnapshotPoller(devices, args.timeout)
+    num_failed = poller.connect()
+    print('Snapshots of', len(poller.devices), 'devices over', len(poller.endpoints), 'connections,', num_failed,
+          'could not connect. Ctrl-C to exit.')
+    poller.run(args.interval, args.count, on_snapshot)
+    if csv_file is not None:
+        csv_file.close()
+
+
+if __name__ == '__main__':
+    main()
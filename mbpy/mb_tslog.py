@@ -0,0 +1,323 @@
+#!/usr/bin/python3
+
+import os
+import mmap
+import zlib
+import threading
+from struct import Struct, pack, unpack, error as struct_error
+from itertools import accumulate
+try:
+    from mbpy import mb_poll  # folder.file import
+except ImportError:
+    import mb_poll  # run from inside the mbpy folder
+
+
+# layout of a time series log:  header | blocks
+#   header: magic, layout version, data type, values per sample, time resolution in ns
+#   block:  first and last time in ns, samples, compressed length, then the zlib compressed columns.  Every block
+#           decodes on its own, so a time range only touches the blocks that overlap it.
+# columns of a block: byte length of each column, then
+#   times:   delta of delta of the time in resolution steps, zigzag varints
+#   status:  0 or the error number of each sample, varints
+#   values:  one column per value.  Integer types store the zigzag varint delta to the previous sample, float types
+#            store the XOR of the double's bits with the previous sample as a control byte (high nibble zero bytes
+#            in front, low nibble bytes kept) and the bytes kept, 0 alone when the value did not change
+TSLOG_MAGIC = b'MBTL'
+TSLOG_VERSION = 1
+HEADER_STRUCT = Struct('<4sI8sHq')
+BLOCK_STRUCT = Struct('<qqII')
+FLOAT_FORMATS = ('float', 'dbl', 'engy')  # decoded to floats, the rest of the numeric types are integers
+
+
+def zigzag(val):
+    # small negative numbers to small positive ones, any size of int
+    return val << 1 if val >= 0 else ((-val) << 1) - 1
+
+
+def unzigzag(val):
+    return (val >> 1) ^ -(val & 1)
+
+
+def encode_varints(vals, otpt):
+    for val in vals:
+        while val > 0x7F:
+            otpt.append((val & 0x7F) | 0x80)
+            val >>= 7
+        otpt.append(val)
+
+
+def decode_varints(data):
+    # bulk decode, one byte varints (the usual case for small deltas) skip the python loop entirely
+    if not data or max(data) < 0x80:
+        return list(data)
+    vals = []
+    val = shift = 0
+    for byte in data:
+        val |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            vals.append(val)
+            val = shift = 0
+    return vals
+
+
+def encode_xor_floats(vals, otpt):
+    prev_bits = 0
+    for val in vals:
+        bits = unpack('<Q', pack('<d', val))[0]
+        xor = bits ^ prev_bits
+        prev_bits = bits
+        if not xor:
+            otpt.append(0)
+            continue
+        xor_bytes = xor.to_bytes(8, byteorder='big')
+        num_lead = (64 - xor.bit_length()) // 8
+        num_kept = 8 - num_lead - ((xor & -xor).bit_length() - 1) // 8
+        otpt.append((num_lead << 4) | num_kept)
+        otpt.extend(xor_bytes[num_lead:num_lead + num_kept])
+
+
+def decode_xor_floats(data, num_samples):
+    vals = []
+    prev_bits = 0
+    pos = 0
+    unpack_dbl = Struct('<d').unpack
+    for sample_iter in range(num_samples):
+        ctrl = data[pos]
+        pos += 1
+        if ctrl:
+            num_lead, num_kept = ctrl >> 4, ctrl & 0x0F
+            prev_bits ^= int.from_bytes(data[pos:pos + num_kept], byteorder='big') << (8 * (8 - num_lead - num_kept))
+            pos += num_kept
+        vals.append(unpack_dbl(prev_bits.to_bytes(8, byteorder='little'))[0])
+    return vals
+
+
+def get_value_kind(data_type):
+    # 'float' or 'int', None for types that do not decode to numbers
+    if data_type in FLOAT_FORMATS:
+        return 'float'
+    elif data_type in mb_poll.DATA_TYPE_LIST and data_type not in ('hex', 'bin', 'ascii'):
+        return 'int'
+    return None
+
+
+class TimeSeriesLog:
+    """Append only, block compressed log of every poll of one request, a fraction of the size of a csv file."""
+    def __init__(self, file_name, data_type, num_vals, block_size=3600, resolution_ns=1000000):
+        self.kind = get_value_kind(data_type)
+        if self.kind is None:
+            raise ValueError('Type ' + str(data_type) + ' can not be logged as a time series.')
+        self.file_name = file_name
+        self.data_type = data_type
+        self.num_vals = num_vals
+        self.block_size = block_size  # samples per block, a block is only written once full or flushed
+        self.resolution_ns = resolution_ns  # times are stored as multiples of this
+
+        if os.path.exists(file_name) and os.path.getsize(file_name) >= HEADER_STRUCT.size:
+            header = read_header(file_name)
+            if (header['data_type'], header['num_vals']) != (data_type, num_vals):
+                raise ValueError(file_name + ' already logs ' + str(header['num_vals']) + ' ' + header['data_type'] +
+                                 ' values.')
+            self.resolution_ns = header['resolution_ns']
+            self._file = open(file_name, 'ab')
+            # a block torn by a crash would swallow the next one appended, cut the file back to the last whole block
+            index = read_index(file_name)
+            data_end = index[-1][3] + index[-1][4] if index else HEADER_STRUCT.size
+            if self._file.tell() > data_end:
+                self._file.truncate(data_end)
+        else:
+            self._file = open(file_name, 'wb')
+            self._file.write(HEADER_STRUCT.pack(TSLOG_MAGIC, TSLOG_VERSION, data_type.encode('ascii'), num_vals,
+                                                self.resolution_ns))
+        self._times = []
+        self._statuses = []
+        self._columns = [[] for val_iter in range(num_vals)]
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def append(self, ts_ns, otpt):
+        # one poll, the value list or an error tuple.  Errors keep the previous values so they cost nothing to store
+        with self._lock:
+            self._times.append(ts_ns // self.resolution_ns)
+            if otpt and otpt[0] == 'Err':
+                self._statuses.append(otpt[1])
+                for column in self._columns:
+                    column.append(column[-1] if column else 0)
+            else:
+                self._statuses.append(0)
+                for column, val in zip(self._columns, otpt):
+                    column.append(val)
+            if len(self._times) >= self.block_size:
+                self._write_block()
+
+    def _write_block(self):
+        if not self._times:
+            return
+        columns = []
+        times = self._times
+        time_deltas = [times[0]] + [cur - prev for prev, cur in zip(times, times[1:])]
+        time_dods = [time_deltas[0]] + [cur - prev for prev, cur in zip(time_deltas, time_deltas[1:])]
+        time_column = bytearray()
+        encode_varints([zigzag(dod) for dod in time_dods], time_column)
+        columns.append(time_column)
+        status_column = bytearray()
+        encode_varints(self._statuses, status_column)
+        columns.append(status_column)
+        for vals in self._columns:
+            val_column = bytearray()
+            if self.kind == 'float':
+                encode_xor_floats(vals, val_column)
+            else:
+                encode_varints([zigzag(cur - prev) for prev, cur in zip([0] + vals, vals)], val_column)
+            columns.append(val_column)
+
+        payload = zlib.compress(pack('<' + str(len(columns)) + 'I', *[len(column) for column in columns]) +
+                                b''.join(columns))
+        self._file.write(BLOCK_STRUCT.pack(times[0] * self.resolution_ns, times[-1] * self.resolution_ns,
+                                           len(times), len(payload)))
+        self._file.write(payload)
+        self._times = []
+        self._statuses = []
+        self._columns = [[] for val_iter in range(self.num_vals)]
+
+    def flush(self):
+        # writes the samples so far as a block of their own, call rarely, small blocks compress worse
+        with self._lock:
+            self._write_block()
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._write_block()
+            self._file.close()
+
+
+def read_header(file_name):
+    with open(file_name, 'rb') as log_file:
+        magic, version, data_type, num_vals, resolution_ns = HEADER_STRUCT.unpack(log_file.read(HEADER_STRUCT.size))
+    if magic != TSLOG_MAGIC or version != TSLOG_VERSION:
+        raise ValueError(file_name + ' is not a time series log this version can read.')
+    return {'data_type': data_type.rstrip(b'\x00').decode('ascii'), 'num_vals': num_vals,
+            'resolution_ns': resolution_ns}
+
+
+def read_index(file_name):
+    # [(first_ns, last_ns, num_samples, offset of the payload, payload length), ...] from the block headers alone
+    index = []
+    with open(file_name, 'rb') as log_file:
+        file_size = os.fstat(log_file.fileno()).st_size
+        offset = HEADER_STRUCT.size
+        while offset + BLOCK_STRUCT.size <= file_size:
+            log_file.seek(offset)
+            first_ns, last_ns, num_samples, payload_len = BLOCK_STRUCT.unpack(log_file.read(BLOCK_STRUCT.size))
+            offset += BLOCK_STRUCT.size
+            if offset + payload_len > file_size:
+                break  # last block was cut short
+            index.append((first_ns, last_ns, num_samples, offset, payload_len))
+            offset += payload_len
+    return index
+
+
+def decode_block(payload, num_samples, num_vals, kind, resolution_ns):
+    # (times in ns, statuses, [values of each sample per column]) of one block
+    data = zlib.decompress(payload)
+    num_columns = num_vals + 2
+    column_lens = unpack('<' + str(num_columns) + 'I', data[:4 * num_columns])
+    columns = []
+    pos = 4 * num_columns
+    for column_len in column_lens:
+        columns.append(data[pos:pos + column_len])
+        pos += column_len
+
+    times = [time_step * resolution_ns for time_step in
+             accumulate(accumulate(unzigzag(dod) for dod in decode_varints(columns[0])))]
+    statuses = decode_varints(columns[1])
+    val_columns = []
+    for column in columns[2:]:
+        if kind == 'float':
+            val_columns.append(decode_xor_floats(column, num_samples))
+        else:
+            val_columns.append(list(accumulate(unzigzag(delta) for delta in decode_varints(column))))
+    return times, statuses, val_columns
+
+
+def read_blocks(file_name, start_ns=None, end_ns=None):
+    # yields the decoded columns of every block that overlaps [start_ns, end_ns], the others are never decompressed
+    header = read_header(file_name)
+    kind = get_value_kind(header['data_type'])
+    with open(file_name, 'rb') as log_file:
+        if os.fstat(log_file.fileno()).st_size <= HEADER_STRUCT.size:
+            return
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as log_map:
+            for first_ns, last_ns, num_samples, offset, payload_len in read_index(file_name):
+                if (start_ns is not None and last_ns < start_ns) or (end_ns is not None and first_ns > end_ns):
+                    continue
+                try:
+                    block = decode_block(log_map[offset:offset + payload_len], num_samples, header['num_vals'], kind,
+                                         header['resolution_ns'])
+                except (zlib.error, struct_error):
+                    return  # a damaged block, what follows it can not be trusted either
+                yield block
+
+
+def read_rows(file_name, start_ns=None, end_ns=None):
+    # yields (ts_ns, values or error tuple) in the same form they were appended
+    for times, statuses, val_columns in read_blocks(file_name, start_ns, end_ns):
+        for ts_ns, status, vals in zip(times, statuses, zip(*val_columns) if val_columns else [()] * len(times)):
+            if (start_ns is not None and ts_ns < start_ns) or (end_ns is not None and ts_ns > end_ns):
+                continue
+            if status:
+                yield ts_ns, mb_poll.MB_ERR_DICT.get(status, ('Err', status, 'UNKNOWN ERROR'))
+            else:
+                yield ts_ns, list(vals)
+
+
+def main(argv=None):
+    import csv
+    import sys
+    import argparse
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description='Decodes a time series log written by mb_poll --tslog.')
+    parser.add_argument('tslog', type=str, help='Time series log file.')
+    parser.add_argument('-s', '--start', type=str, default=None,
+                        help='First time to decode, as YYYY-MM-DD[ HH:MM[:SS]]. Default is the start of the log.')
+    parser.add_argument('-e', '--end', type=str, default=None, help='Last time to decode. Default is the end.')
+    parser.add_argument('-fl', '--file', type=str, default=None,
+                        help='Writes the rows to this csv file instead of printing them.')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print the size of the log.')
+    args = parser.parse_args(argv)
+
+    start_ns = int(datetime.fromisoformat(args.start).timestamp() * 1e9) if args.start else None
+    end_ns = int(datetime.fromisoformat(args.end).timestamp() * 1e9) if args.end else None
+    header = read_header(args.tslog)
+    index = read_index(args.tslog)
+    num_samples = sum(block[2] for block in index)
+    print(args.tslog, ':', num_samples, 'samples of', header['num_vals'], header['data_type'], 'values in',
+          len(index), 'blocks,', os.path.getsize(args.tslog), 'bytes,',
+          round(os.path.getsize(args.tslog) / max(num_samples, 1), 2), 'bytes per sample', file=sys.stderr)
+    if args.quiet:
+        return
+
+    csv_file = None
+    if args.file is not None:
+        csv_file = open(args.file if args.file.endswith('.csv') else args.file + '.csv', 'w', newline='')
+        csv_file_wrtr = csv.writer(csv_file)
+    for ts_ns, otpt in read_rows(args.tslog, start_ns, end_ns):
+        if csv_file is not None:
+            csv_file_wrtr.writerow([str(datetime.fromtimestamp(ts_ns / 1e9))] + list(otpt))
+        else:
+            print(datetime.fromtimestamp(ts_ns / 1e9), otpt)
+    if csv_file is not None:
+        csv_file.close()
+
+
+if __name__ == '__main__':
+    main()
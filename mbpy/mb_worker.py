@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+import time
+import queue
+import threading
+
+
+class PollWorker(threading.Thread):
+    """Long lived thread that calls poll_func on a fixed schedule and hands each result to a bounded queue.
+
+    The connection lives inside poll_func (a bound ModbusClient.request or PollPlan.scan), so it stays open between
+    polls.  Pause, resume and stop only set events, the thread notices them between polls and never has to be killed.
+    """
+    def __init__(self, poll_func, poll_delay=1000, on_close=None, max_queued=1000, b_single_shot=False,
+                 next_due_func=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.poll_func = poll_func
+        self.poll_delay = poll_delay / 1000  # convert from ms to s
+        self.on_close = on_close  # called from the worker thread once it stops, e.g. ModbusClient.close
+        self.b_single_shot = b_single_shot  # pause after every poll, used for writes
+        # returns the time.monotonic() of the next poll in place of the fixed rate, e.g. PollPlan.get_next_due
+        self.next_due_func = next_due_func
+        self.results = queue.Queue(maxsize=max_queued)  # (time of poll in s since epoch, otpt)
+        self.num_dropped = 0  # results thrown away because nobody was reading the queue
+
+        self._stop_event = threading.Event()
+        self._run_event = threading.Event()  # cleared while paused
+
+    def pause(self):
+        self._run_event.clear()
+
+    def resume(self):
+        self._run_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._run_event.set()  # wake the thread if it is paused so it can exit
+
+    def is_paused(self):
+        return not self._run_event.is_set()
+
+    def is_stopped(self):
+        return self._stop_event.is_set()
+
+    def get_results(self):
+        # everything queued so far, oldest first, without blocking
+        results = []
+        try:
+            while True:
+                results.append(self.results.get_nowait())
+        except queue.Empty:
+            return results
+
+    def _put_result(self, result):
+        # when the reader falls behind the oldest result goes, the newest is always kept
+        while True:
+            try:
+                self.results.put_nowait(result)
+                return
+            except queue.Full:
+                try:
+                    self.results.get_nowait()
+                    self.num_dropped += 1
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        next_poll_time = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                if not self._run_event.is_set():
+                    self._run_event.wait()
+                    next_poll_time = time.monotonic()  # a resume polls right away
+                    continue
+
+                time_left = next_poll_time - time.monotonic()
+                if time_left > 0 and self._stop_event.wait(time_left):
+                    break
+                if not self._run_event.is_set():
+                    continue  # paused while waiting for the next poll
+
+                poll_time = time.time()
+                otpt = self.poll_func()
+                if self._stop_event.is_set():
+                    break
+                self._put_result((poll_time, otpt))
+                if self.b_single_shot:
+                    self._run_event.clear()
+
+                # fixed rate schedule, but never try to catch up on polls missed while the device was slow
+                next_due = self.next_due_func() if self.next_due_func is not None else None
+                if next_due is None:
+                    next_poll_time = max(next_poll_time + self.poll_delay, time.monotonic())
+                else:
+                    next_poll_time = next_due
+        finally:
+            if self.on_close is not None:
+                self.on_close()
@@ -0,0 +1,33 @@
+import unittest
+
+from mbpy import mb_aggregate
+from mbpy import mb_poll
+
+
+class TestErrorOnlyWindow(unittest.TestCase):
+    def test_error_only_window(self):
+        closed = []
+        aggregator = mb_aggregate.Aggregator(['1000:first,last,min,max,mean,sum,count,errs'],
+                                             lambda key, window, end_ns, stats: closed.append((end_ns, stats)))
+        aggregator.add('dev', 0, mb_poll.MB_ERR_DICT[87])
+        aggregator.add('dev', 500 * 10 ** 6, mb_poll.MB_ERR_DICT[87])
+        aggregator.add('dev', 1500 * 10 ** 6, [1, 2])
+
+        self.assertEqual(closed, [(10 ** 9, {'first': None, 'last': None, 'min': None, 'max': None, 'mean': None,
+                                             'sum': None, 'count': 0, 'errs': 2})])
+        self.assertEqual(aggregator.get_current('dev')['mean'], [1, 2])
+
+    def test_errors_between_values(self):
+        closed = []
+        aggregator = mb_aggregate.Aggregator(['1000:mean,count,errs'],
+                                             lambda key, window, end_ns, stats: closed.append(stats))
+        aggregator.add('dev', 0, [1.0])
+        aggregator.add('dev', 100 * 10 ** 6, mb_poll.MB_ERR_DICT[87])
+        aggregator.add('dev', 200 * 10 ** 6, [3.0])
+        aggregator.flush()
+
+        self.assertEqual(closed, [{'mean': [2.0], 'count': 2, 'errs': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()